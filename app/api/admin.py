@@ -0,0 +1,40 @@
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+
+from app.api.auth import get_current_user
+from app.core import profiling
+from app.services.auth_cache import CachedUser
+
+router = APIRouter()
+
+
+def get_current_superuser(current_user: CachedUser = Depends(get_current_user)) -> CachedUser:
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough privileges")
+    return current_user
+
+
+@router.get("/admin/profiles")
+def list_profiles(_: CachedUser = Depends(get_current_superuser)) -> List[Dict[str, Any]]:
+    """Saved request profiles, newest first."""
+    return profiling.store.list()
+
+
+@router.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, _: CachedUser = Depends(get_current_superuser)) -> FileResponse:
+    """The profile's JSON report: request details and asyncio task timing breakdown."""
+    path = profiling.store.path(profile_id, ".json")
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="application/json")
+
+
+@router.get("/admin/profiles/{profile_id}/folded")
+def download_profile_stacks(profile_id: str, _: CachedUser = Depends(get_current_superuser)) -> FileResponse:
+    """Stack samples in folded format, for flamegraph.pl, inferno or speedscope."""
+    path = profiling.store.path(profile_id, ".folded")
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"{profile_id}.folded")
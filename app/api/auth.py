@@ -1,15 +1,22 @@
+import time
 from datetime import timedelta
+from typing import Any, Dict, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
-from app.core.security import create_access_token
-from app.db.crud import (authenticate_user, create_user, get_user_by_email,
-                         get_user_by_username)
+from app.core.security import (create_access_token, get_password_hash_async,
+                               verify_and_update_password_async)
+from app.db.crud import (create_user, get_user, get_user_by_email,
+                         get_user_by_username, update_user_password_hash)
 from app.db.session import get_db
+from app.services import auth_cache, usage
+from app.services.auth_cache import CachedUser
 
 router = APIRouter()
 
@@ -37,9 +44,33 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 
+async def _authenticate(db: Session, username: str, password: str) -> Optional[CachedUser]:
+    """
+    Like crud.authenticate_user, but the user comes from a short-TTL cache when possible and
+    bcrypt runs in the password hashing process pool. A hash made with outdated settings
+    (e.g. fewer BCRYPT_ROUNDS) is replaced on a successful login.
+    """
+    user = auth_cache.users_by_username.get(username)
+    if user is None:
+        db_user = await run_in_threadpool(get_user_by_username, db, username)
+        if db_user is None:
+            return None
+        user = CachedUser.from_user(db_user)
+        auth_cache.users_by_username.put(username, user)
+    if not user.password_hash:
+        return None  # Created from Google Workspace; has no password
+    valid, new_hash = await verify_and_update_password_async(password, user.password_hash)
+    if not valid:
+        return None
+    if new_hash:
+        await run_in_threadpool(update_user_password_hash, db, user.id, new_hash)
+        auth_cache.users_by_username.pop(username)
+    return user
+
+
 @router.post("/auth/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await _authenticate(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,18 +85,56 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 
 @router.post("/auth/register", response_model=UserResponse)
-def register_user(user_in: UserCreate, db: Session = Depends(get_db)):
-    user = get_user_by_username(db, username=user_in.username)
+async def register_user(user_in: UserCreate, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(get_user_by_username, db, user_in.username)
     if user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered",
         )
-    user = get_user_by_email(db, email=user_in.email)
+    user = await run_in_threadpool(get_user_by_email, db, user_in.email)
     if user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered",
         )
-    user = create_user(db, username=user_in.username, email=user_in.email, password=user_in.password)
+    password_hash = await get_password_hash_async(user_in.password)
+    user = await run_in_threadpool(
+        create_user, db, username=user_in.username, email=user_in.email, password_hash=password_hash
+    )
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> CachedUser:
+    """Resolves a bearer token to its user; tokens seen in the last AUTH_TOKEN_CACHE_TTL_SECONDS skip the DB."""
+    user = auth_cache.users_by_token.get(token)
+    if user is not None:
+        return user
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        user_id = int(payload.get("sub"))
+        expires_at = float(payload["exp"])
+    except (JWTError, KeyError, TypeError, ValueError):
+        raise credentials_exception
+    db_user = await run_in_threadpool(get_user, db, user_id)
+    if db_user is None or not db_user.is_active:
+        raise credentials_exception
+    user = CachedUser.from_user(db_user)
+    # Never cached past the token's own expiry.
+    auth_cache.users_by_token.put(token, user, ttl_seconds=expires_at - time.time())
     return user
+
+
+@router.get("/usage")
+def read_token_usage(current_user: CachedUser = Depends(get_current_user), db: Session = Depends(get_db)) -> Dict[str, Any]:
+    """The current user's token usage and remaining budget, overall and per spreadsheet."""
+    summary = usage.usage_summary(db, current_user.id)
+    budget = current_user.token_budget if current_user.token_budget is not None else settings.USER_TOKEN_BUDGET
+    summary["budget_tokens"] = budget or None
+    summary["remaining_tokens"] = max(0, budget - summary["totals"]["total_tokens"]) if budget else None
+    return summary
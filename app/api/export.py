@@ -0,0 +1,32 @@
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+
+from app.api.auth import get_current_user
+from app.services import export
+from app.services.auth_cache import CachedUser
+
+router = APIRouter()
+
+
+@router.get("/export/generations")
+def export_generations(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    spreadsheet_id: Optional[str] = None,
+    platform: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_user),
+) -> StreamingResponse:
+    """
+    Streams the current user's generation history, with product fields, as NDJSON or CSV.
+    Filters: created_from (inclusive) to created_to (exclusive), spreadsheet_id, platform.
+    """
+    filters = export.ExportFilters(created_from, created_to, spreadsheet_id, platform)
+    return StreamingResponse(
+        export.stream_generations(current_user.id, filters, export_format),
+        media_type=export.FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="ad-generations.{export_format}"'},
+    )
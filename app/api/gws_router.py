@@ -1,23 +1,35 @@
+import asyncio
 import logging  # Import logging
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
 from fastapi import APIRouter, Depends, HTTPException, Request
-from google.auth.transport import requests as google_auth_requests
-from google.oauth2 import id_token
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from app.core.config import settings  # Import settings for GCP_OAUTH_CLIENT_ID
+from app.core.deadline import Deadline
 from app.core.gws_cards import generate_ads_card, homepage_card
-from app.db.crud import create_product  # To save products before generation
-from app.db.models import Product  # For creating Product instances
+from app.core.responses import CardResponse
+from app.db.crud import (  # To save products before generation
+    create_product, get_or_create_workspace_user)
+from app.db.models import Product, User  # For creating Product instances
 from app.db.session import get_db
-from app.services.ai_service import \
-    generate_batch_ads_with_search  # The actual AI service
+from app.services import (header_cache, idempotency, prefetch, similarity,
+                          usage)
+from app.services.ai_service import (  # The actual AI service
+    generate_batch_ad_variants_with_search, generate_batch_ads_with_search,
+    is_usable_ad)
+from app.services.row_filter import (DUPLICATE, EMPTY, MISSING_FIELDS,
+                                     SKIP_MARKERS, prefilter)
 from app.utils.google_api_clients import (  # Import sheets API client
-    get_sheet_values, update_sheet_values)
-from app.utils.sheets_utils import \
-    construct_header_range  # Import the new utility
+    get_sheet_values_cached, get_spreadsheet_version,
+    get_user_info, schedule_cache_restamp, update_sheet_values)
+from app.utils.google_auth_request import auth_request
+from app.utils.row_batch import RowBatch
+from app.utils.sheets_quota import user_key
+from app.utils.sheets_utils import (  # Import the new utility
+    col_to_num, construct_header_range,
+    get_sheet_name_and_columns_from_range, group_row_spans, num_to_col)
 
 logger = logging.getLogger(__name__)  # Add logger
 
@@ -77,10 +89,14 @@ async def verify_google_id_token(request: Request) -> Dict[str, Any]:
         f"verify_google_id_token: Verifying token against audience (URL): {expected_audience_url}"
     )
 
+    # Imported here rather than at module load to keep cold starts fast; app.core.warmup
+    # preloads them in the background.
+    from google.oauth2 import id_token
+
     try:
         id_info = id_token.verify_oauth2_token(
             token,
-            google_auth_requests.Request(),
+            auth_request,  # Reuses Google's certs while their Cache-Control allows
             audience=expected_audience_url,  # Verify against the endpoint URL for SYSTEM_ID_TOKEN
         )
         logger.info(
@@ -162,15 +178,12 @@ async def on_homepage(
         "userOAuthToken", {}
     )
     if user_access_token:
-        url = "https://www.googleapis.com/oauth2/v3/userinfo"
-        headers = {"Authorization": f"Bearer {user_access_token}"}
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            user_info = response.json()
+        user_info = await get_user_info(user_access_token)
+        if user_info is not None:
             logger.info(
                 f"on_homepage: user_info.get('email'): {user_info.get('email')}"
             )
-    return homepage_card.create_homepage_card(base_url)
+    return CardResponse(homepage_card.render_homepage_card(base_url))
 
 
 @router.post("/onFileScopeGranted")
@@ -216,9 +229,86 @@ async def on_generate_ads_form(
         f"on_generate_ads_form: Constructed base_url for card actions: {base_url}"
     )
 
-    # For now, a simple card:
-    card_json = generate_ads_card.create_generate_ads_card(base_url)
-    return card_json
+    # Prefill the form from the last run on this spreadsheet, if any.
+    sheet_id = request_body.get("sheets", {}).get("id")
+    last_mapping = header_cache.get_latest_mapping(db, sheet_id) if sheet_id else None
+    # While the user fills in the form, read what the submit will need (see app.services.prefetch).
+    user_oauth_token = request_body.get("authorizationEventObject", {}).get("userOAuthToken")
+    if sheet_id and user_oauth_token:
+        prefetch.schedule(user_oauth_token, sheet_id, last_mapping)
+    return CardResponse(generate_ads_card.render_generate_ads_card(base_url, defaults=_form_defaults(last_mapping)))
+
+
+def _form_defaults(mapping: Optional[header_cache.HeaderMapping]) -> Dict[str, str]:
+    """Form values (and a detected-columns summary) derived from a cached header mapping."""
+    if mapping is None:
+        return {}
+    defaults = {"header_row": str(mapping.header_row)}
+    parsed_header_range = get_sheet_name_and_columns_from_range(mapping.header_range)
+    if mapping.last_data_range:
+        defaults["data_range"] = mapping.last_data_range
+    if parsed_header_range:
+        _, start_col, end_col = parsed_header_range
+        defaults["output_column"] = num_to_col(col_to_num(end_col) + 1)
+        start_col_num = col_to_num(start_col)
+        defaults["detected_columns"] = ", ".join(
+            f"{role.replace('_', ' ').title()}: {num_to_col(start_col_num + index)} ({mapping.headers[index]})"
+            for role, index in mapping.column_roles.items()
+            if index < len(mapping.headers)
+        )
+    return defaults
+
+
+def _gws_user_claims(request_body: Dict[Any, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Claims of the userIdToken in the event object, which identifies the user running the
+    add-on. Google's signature and the expiry are verified, and the audience too when
+    GCP_OAUTH_CLIENT_ID is set. None if there is no token or it does not verify.
+    """
+    user_id_token = request_body.get("authorizationEventObject", {}).get("userIdToken")
+    if not user_id_token:
+        return None
+    from google.oauth2 import id_token
+
+    try:
+        return id_token.verify_oauth2_token(user_id_token, auth_request, audience=settings.GCP_OAUTH_CLIENT_ID)
+    except ValueError as e:
+        logger.warning(f"Could not verify the user ID token: {e}")
+        return None
+
+
+def _gws_db_user(db: Session, request_body: Dict[Any, Any]) -> Optional[User]:
+    """The User that usage is accounted to; None if the add-on user cannot be identified."""
+    claims = _gws_user_claims(request_body)
+    if not claims or not claims.get("sub"):
+        return None
+    email = claims.get("email") if claims.get("email_verified") else None
+    try:
+        return get_or_create_workspace_user(db, claims["sub"], email)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not look up the user of Google account {claims['sub']}: {e}")
+        db.rollback()
+        return None
+
+
+def _describe_output_columns(start_col_num: int, platforms: List[str], variants: int) -> str:
+    """e.g. 'column E' or 'columns E-H (E: Facebook #1, F: Facebook #2, G: Instagram #1, H: Instagram #2)'."""
+    if len(platforms) * variants == 1:
+        return f"column {num_to_col(start_col_num)}"
+    labels = []
+    for offset, (platform, variant) in enumerate((p, v) for p in platforms for v in range(1, variants + 1)):
+        labels.append(f"{num_to_col(start_col_num + offset)}: {platform} #{variant}")
+    end_col = num_to_col(start_col_num + len(labels) - 1)
+    return f"columns {num_to_col(start_col_num)}-{end_col} ({', '.join(labels)})"
+
+
+def _describe_unfinished_rows(data_range: str, start_row: int, unfinished_offsets: List[int]) -> str:
+    """A1 ranges (same sheet and columns as data_range) covering the rows left unfinished, e.g. 'Sheet1!A42:D101'."""
+    parsed_range = get_sheet_name_and_columns_from_range(data_range)
+    sheet_prefix = f"{data_range.split('!')[0]}!" if "!" in data_range else ""
+    start_col, end_col = (parsed_range[1], parsed_range[2]) if parsed_range else ("", "")
+    spans = group_row_spans([start_row + offset for offset in unfinished_offsets])
+    return ", ".join(f"{sheet_prefix}{start_col}{first}:{end_col}{last}" for first, last in spans)
 
 
 # This endpoint will process the form, read sheet data, call AI, and write back.
@@ -229,6 +319,29 @@ async def generate_and_write_ads(
     gws_user: Dict = Depends(verify_google_id_token),
     db: Session = Depends(get_db),
 ):
+    # Workspace cuts the action off after ~30s; every stage below takes its timeout from this budget.
+    deadline = Deadline.for_gws_action()
+
+    # Double clicks and retries of the same submission attach to the run already in progress
+    # instead of re-running the whole batch and racing it to write the same range.
+    user_oauth_token = request_body.get("authorizationEventObject", {}).get("userOAuthToken") or ""
+    idempotency_key = idempotency.make_key(
+        user=user_key(user_oauth_token),
+        spreadsheet_id=request_body.get("sheets", {}).get("id"),
+        form_inputs=request_body.get("commonEventObject", {}).get("formInputs", {}),
+    )
+    return await idempotency.run_once(
+        db, idempotency_key, deadline,
+        lambda: _generate_and_write_ads(request_body, gws_user, db, deadline),
+    )
+
+
+async def _generate_and_write_ads(
+    request_body: Dict[Any, Any],
+    gws_user: Dict,
+    db: Session,
+    deadline: Deadline,
+) -> Dict[str, Any]:
     logger.info(
         f"generate_and_write_ads called with request_body: {request_body}"
     )
@@ -248,8 +361,10 @@ async def generate_and_write_ads(
     output_column = form_inputs.get("output_column", {}).get("stringInputs", {}).get("value", [None])[0]
     tone = form_inputs.get("tone", {}).get("stringInputs", {}).get("value", ["Professional"])[0]
     max_length_str = form_inputs.get("max_length", {}).get("stringInputs", {}).get("value", ["150"])[0]
+    platforms_str = form_inputs.get("platforms", {}).get("stringInputs", {}).get("value", [settings.DEFAULT_PLATFORMS])[0]
+    variants_str = form_inputs.get("variants", {}).get("stringInputs", {}).get("value", ["1"])[0]
 
-    logger.info(f"generate_and_write_ads - Form Inputs: data_range='{data_range}', header_row='{header_row_str}', output_column='{output_column}', tone='{tone}', max_length='{max_length_str}'")
+    logger.info(f"generate_and_write_ads - Form Inputs: data_range='{data_range}', header_row='{header_row_str}', output_column='{output_column}', tone='{tone}', max_length='{max_length_str}', platforms='{platforms_str}', variants='{variants_str}'")
 
     if not all([data_range, header_row_str, output_column]):
         logger.error("generate_and_write_ads: Missing required form inputs (data_range, header_row, or output_column).")
@@ -262,13 +377,31 @@ async def generate_and_write_ads(
     try:
         header_row = int(header_row_str)
         max_length = int(max_length_str)
+        variants = int(variants_str or "1")
     except ValueError:
-        logger.error("generate_and_write_ads: Invalid number format for header_row or max_length.")
+        logger.error("generate_and_write_ads: Invalid number format for header_row, max_length or variants.")
+        return {
+            "action": {
+                "notification": {"text": "Error: Header Row, Max Length and Variants must be numbers."}
+            }
+        }
+
+    # De-duplicate platforms while keeping the user's order; it defines the output column order.
+    platforms = list(dict.fromkeys(p.strip() for p in (platforms_str or "").split(",") if p.strip()))
+    if not platforms:
+        platforms = [settings.DEFAULT_PLATFORMS.split(",")[0].strip()]
+    if not 1 <= variants <= settings.MAX_AD_VARIANTS or len(platforms) > settings.MAX_AD_PLATFORMS:
+        logger.error(f"generate_and_write_ads: Out of range platforms={platforms} or variants={variants}.")
         return {
             "action": {
-                "notification": {"text": "Error: Header Row and Max Length must be numbers."}
+                "notification": {"text": f"Error: Use 1-{settings.MAX_AD_VARIANTS} variants and at most {settings.MAX_AD_PLATFORMS} platforms."}
             }
         }
+    try:
+        output_start_col_num = col_to_num(output_column.strip().upper())
+    except ValueError:
+        logger.error(f"generate_and_write_ads: Invalid output column '{output_column}'.")
+        return {"action": {"notification": {"text": "Error: Output Column must be a column letter (e.g., E)."}}}
 
     # Placeholder for actual processing logic
 
@@ -295,11 +428,21 @@ async def generate_and_write_ads(
         return {"action": {"notification": {"text": "Error: Invalid data range or header row format."}}}
     logger.info(f"generate_and_write_ads: Constructed header_a1_range: {header_a1_range}")
 
-    # 4. Read Headers using Sheets API
-    header_values = await get_sheet_values(
-        token=user_oauth_token,
-        spreadsheet_id=sheet_id,
-        range_a1=header_a1_range
+    # A prefetch started when the form was opened may still be reading these ranges; wait for it
+    # rather than reading them a second time. Its results land in the caches used below.
+    await prefetch.wait_for(user_oauth_token, sheet_id, header_a1_range, data_range, deadline)
+
+    # 4./5. Read the header row and the data rows together. Both are served from memory while
+    # the spreadsheet's Drive version is unchanged, so the cached column mapping is always
+    # checked against the header row as it is now. The version is looked up once for the run.
+    sheet_version = None
+    if settings.SHEETS_VALUES_CACHE_ENABLED:
+        sheet_version = await get_spreadsheet_version(user_oauth_token, sheet_id, deadline=deadline)
+    header_values, data_rows_values = await asyncio.gather(
+        get_sheet_values_cached(token=user_oauth_token, spreadsheet_id=sheet_id, range_a1=header_a1_range,
+                                deadline=deadline, version=sheet_version),
+        get_sheet_values_cached(token=user_oauth_token, spreadsheet_id=sheet_id, range_a1=data_range,
+                                deadline=deadline, version=sheet_version),
     )
 
     if not header_values or not header_values[0]:
@@ -308,13 +451,7 @@ async def generate_and_write_ads(
 
     headers_list = [str(header) for header in header_values[0]]  # Ensure all headers are strings
     logger.info(f"generate_and_write_ads: Fetched headers: {headers_list}")
-
-    # 5. Read Data Rows using Sheets API (from data_range)
-    data_rows_values = await get_sheet_values(
-        token=user_oauth_token,
-        spreadsheet_id=sheet_id,
-        range_a1=data_range  # Use the user-provided data_range
-    )
+    header_mapping = header_cache.resolve(db, sheet_id, header_a1_range, header_row, headers_list, data_range)
 
     if not data_rows_values:
         logger.error(f"generate_and_write_ads: Could not read data rows from {data_range} or range is empty.")
@@ -322,22 +459,16 @@ async def generate_and_write_ads(
 
     logger.info(f"generate_and_write_ads: Fetched {len(data_rows_values)} data row(s). First row (sample): {data_rows_values[0] if data_rows_values else 'N/A'}")
 
-    # 6. Prepare data for AI (list of dicts: {header: value})
-    products_for_ai = []
-    for row_values in data_rows_values:
-        product_data = {}
-        for i, header_name in enumerate(headers_list):
-            if i < len(row_values):
-                product_data[header_name] = str(row_values[i])  # Ensure value is string
-            else:
-                product_data[header_name] = ""  # Handle rows with fewer cells than headers
-        products_for_ai.append(product_data)
+    # 6. Prepare data for AI ({header: value} per row)
+    # Columnar batch: headers stored once, rows exposed as lightweight {header: value} views.
+    # Column roles come from the cached mapping, so later stages read e.g. the name column by index.
+    products_for_ai = RowBatch.from_values(headers_list, data_rows_values, column_roles=header_mapping.column_roles)
 
     if not products_for_ai:
         logger.warning("generate_and_write_ads: No product data prepared for AI.")
         return {"action": {"notification": {"text": "No data to process after parsing."}}}
 
-    logger.info(f"generate_and_write_ads: Prepared {len(products_for_ai)} products for AI. First product (sample): {products_for_ai[0] if products_for_ai else 'N/A'}")
+    logger.info(f"generate_and_write_ads: Prepared {len(products_for_ai)} products for AI. First product (sample): {dict(products_for_ai[0])}")
 
     # 7. Call ai_service.generate_batch_ads_with_search
     # The AI service now expects a list of product data dictionaries.
@@ -349,24 +480,112 @@ async def generate_and_write_ads(
     # but since we're using list indices now, it's not strictly necessary for result mapping.
     # The current `generate_batch_ads_with_search` doesn't require `product_name_header_key` anymore.
 
-    ai_results: List[Tuple[str, str]] = await generate_batch_ads_with_search(
-        products_data=products_for_ai,
-        tone=tone,
-        max_length=max_length,
-        platform="Facebook"  # Assuming Facebook for now, can be a form input later
-    )
+    # Only valid, unique rows go to the model. Empty or incomplete rows get a marker in their
+    # output cells, and duplicates reuse the ads of their first occurrence.
+    products_to_generate, row_filter = prefilter(products_for_ai)
+    skipped_count = len(products_for_ai) - len(products_to_generate)
+    if skipped_count:
+        logger.info(
+            f"generate_and_write_ads: Sending {len(products_to_generate)} of {len(products_for_ai)} rows to the model "
+            f"({row_filter.count(EMPTY)} empty, {row_filter.count(MISSING_FIELDS)} missing required fields, "
+            f"{row_filter.count(DUPLICATE)} duplicates)."
+        )
 
-    if not ai_results or len(ai_results) != len(products_for_ai):
+    # Refuse the run, or cap it to the rows that fit, when its estimated token cost
+    # (rows x recent average tokens per row) exceeds the user's or spreadsheet's remaining budget.
+    db_user = _gws_db_user(db, request_body)
+    if db_user is None and settings.TOKEN_BUDGET_ENABLED and settings.USER_TOKEN_BUDGET and products_to_generate:
+        # Without a user the per-user budget could not be enforced.
+        logger.warning(f"generate_and_write_ads: Refusing run on sheet {sheet_id}: the add-on user could not be identified.")
+        return {
+            "action": {
+                "notification": {"text": "Error: Could not identify your Google account, so the run was not started. Please try again."}
+            }
+        }
+    budget = usage.check_budget(db, db_user, sheet_id, len(products_to_generate))
+    if products_to_generate and not budget.allowed_rows:
+        logger.warning(f"generate_and_write_ads: Token budget exhausted for user {db_user.id if db_user else None} / sheet {sheet_id}.")
+        return {
+            "action": {
+                "notification": {"text": f"Error: Token budget reached ({budget.remaining_tokens:,} tokens left, this run needs about {budget.estimated_tokens:,}). Try again later or with a smaller data range."}
+            }
+        }
+    batch_to_generate = products_to_generate
+    if budget.capped:
+        logger.warning(
+            f"generate_and_write_ads: Capping run to {budget.allowed_rows} of {budget.requested_rows} rows: "
+            f"about {budget.estimated_tokens:,} tokens needed, {budget.remaining_tokens:,} left."
+        )
+        batch_to_generate = products_to_generate.take(range(budget.allowed_rows))
+    batch_usage = usage.BatchUsage()
+
+    # A single platform/variant keeps the original one-ad-per-row path; otherwise every row
+    # gets len(platforms) * variants ads from one model call, written to adjacent columns.
+    # Rows the deadline cut off come back as None.
+    output_width = len(platforms) * variants
+    unique_ads: List[Optional[List[str]]] = []
+    similar = None
+    if not batch_to_generate:
+        pass
+    elif output_width == 1:
+        # Near-duplicates of the user's past products (size/colour variants) get the past ad adapted.
+        if db_user is not None:
+            similar = await similarity.find_similar(db_user.id, batch_to_generate, platforms[0], tone, max_length)
+        ai_results: List[Optional[Tuple[str, str]]] = await generate_batch_ads_with_search(
+            products_data=batch_to_generate,
+            tone=tone,
+            max_length=max_length,
+            platform=platforms[0],
+            deadline=deadline,
+            max_concurrency=settings.SCHEDULER_TENANT_MAX_CONCURRENT_CALLS,
+            tenant=user_key(user_oauth_token),  # Rows share model-call slots fairly with other users' requests
+            usage=batch_usage,
+            similar_ads=similar.matches if similar else None
+        )
+        unique_ads = [[result[0]] if result else None for result in ai_results]  # Prepare data for writing (list of lists)
+    else:
+        variant_results: List[Optional[Tuple[List[str], str]]] = await generate_batch_ad_variants_with_search(
+            products_data=batch_to_generate,
+            platforms=platforms,
+            variants=variants,
+            tone=tone,
+            max_length=max_length,
+            deadline=deadline,
+            max_concurrency=settings.SCHEDULER_TENANT_MAX_CONCURRENT_CALLS,
+            tenant=user_key(user_oauth_token),
+            usage=batch_usage
+        )
+        unique_ads = [result[0] if result else None for result in variant_results]
+    # Rows over the budget are left unfinished, like rows the deadline cut off.
+    unique_ads += [None] * (len(products_to_generate) - len(batch_to_generate))
+
+    if len(unique_ads) != len(products_to_generate):
         logger.error("generate_and_write_ads: AI service did not return expected results.")
         return {"action": {"notification": {"text": "Error: Failed to generate ads from AI service."}}}
+    ads_to_write = row_filter.expand(unique_ads, lambda status: [SKIP_MARKERS[status]] * output_width)
 
-    logger.info(f"generate_and_write_ads: Received {len(ai_results)} results from AI service.")
+    unfinished_offsets = [offset for offset, ads in enumerate(ads_to_write) if ads is None]
+    marked_count = row_filter.count(EMPTY) + row_filter.count(MISSING_FIELDS)
+    finished_count = len(ads_to_write) - len(unfinished_offsets) - marked_count
+    if products_to_generate and not any(ads is not None for ads in unique_ads):
+        logger.error("generate_and_write_ads: Deadline reached before any ad was generated.")
+        return {"action": {"notification": {"text": "Error: Timed out before any ads were generated. Try a smaller data range."}}}
+
+    logger.info(f"generate_and_write_ads: Received {finished_count} of {len(ads_to_write)} results from AI service.")
     # Example log of the first result, if any
-    if ai_results:
-        logger.info(f"generate_and_write_ads: First AI result - Ad: '{ai_results[0][0][:50]}...', Ref: '{ai_results[0][1][:50]}...'")
+    first_ads = next((ads for ads in unique_ads if ads is not None), None)
+    if first_ads:
+        logger.info(f"generate_and_write_ads: First AI result - Ads: {[ad[:50] for ad in first_ads]}")
+
+    # Unfinished rows are sent as null cells, which the Sheets API skips, and trailing
+    # unfinished rows are dropped from the write altogether.
+    while ads_to_write[-1] is None:
+        ads_to_write.pop()
+    ads_to_write = [ads if ads is not None else [None] * output_width for ads in ads_to_write]
 
-    # 8. Write results back to sheet using Sheets API
-    ads_to_write = [[ad_text] for ad_text, _ in ai_results]  # Prepare data for writing (list of lists)
+    # 8. Write results back to sheet using Sheets API (one write covering all output columns)
+    output_start_column = num_to_col(output_start_col_num)
+    output_end_column = num_to_col(output_start_col_num + output_width - 1)
 
     # Determine the starting row from the data_range (e.g., "Sheet1!A2:D10" -> 2)
     # This is a simplified approach; a more robust parser might be needed for complex ranges.
@@ -378,23 +597,67 @@ async def generate_and_write_ads(
         return {"action": {"notification": {"text": "Error: Could not determine output range."}}}
 
     # Construct the output range, e.g., "Sheet1!E2:E10" if output_column is E and data starts at row 2
-    # Assuming output_column is a single letter like "E"
-    # and ads_to_write has the same number of rows as products_for_ai
-    output_range_a1 = f"{data_range.split('!')[0]}!{output_column}{start_row_for_output}:{output_column}{start_row_for_output + len(ads_to_write) - 1}"
+    # (or "Sheet1!E2:H10" when several platforms/variants are written side by side),
+    # assuming ads_to_write has the same number of rows as products_for_ai
+    output_range_a1 = f"{data_range.split('!')[0]}!{output_start_column}{start_row_for_output}:{output_end_column}{start_row_for_output + len(ads_to_write) - 1}"
     logger.info(f"generate_and_write_ads: Constructed output_range_a1 for writing: {output_range_a1}")
 
     update_result = await update_sheet_values(
         token=user_oauth_token,
         spreadsheet_id=sheet_id,
         range_a1=output_range_a1,
-        values=ads_to_write
+        values=ads_to_write,
+        deadline=deadline
     )
+    if update_result and settings.SHEETS_VALUES_CACHE_ENABLED:
+        schedule_cache_restamp(user_oauth_token, sheet_id, sheet_version, output_range_a1)
+
+    # The tokens were spent whether or not the write succeeded, so every generated row is recorded.
+    row_columns = None
+    if similar is not None:
+        row_columns = similarity.remember(similar, {
+            position: ads[0] for position, ads in enumerate(unique_ads) if ads is not None and is_usable_ad(ads[0])
+        })
+    usage.record_generations(
+        db,
+        user_id=db_user.id if db_user else None,
+        spreadsheet_id=sheet_id,
+        batch_usage=batch_usage,
+        rows=[
+            (position, start_row_for_output + row_filter.unique_positions[position], ads)
+            for position, ads in enumerate(unique_ads) if ads is not None
+        ],
+        platform=", ".join(platforms),
+        generation_params={
+            "source": "sheet",
+            "data_range": data_range,
+            "output_range": output_range_a1,
+            "tone": tone,
+            "max_length": max_length,
+            "platforms": platforms,
+            "variants": variants,
+            "written": bool(update_result),
+        },
+        row_columns=row_columns,
+    )
+    logger.info(f"generate_and_write_ads: Token usage for this run: {batch_usage.totals()}")
 
     if update_result:
-        logger.info(f"generate_and_write_ads: Successfully wrote {len(ads_to_write)} ads to sheet.")
+        logger.info(f"generate_and_write_ads: Successfully wrote {finished_count} rows of ads to sheet.")
+        written_text = f"{finished_count * output_width} ads to {_describe_output_columns(output_start_col_num, platforms, variants)}"
+        if marked_count:
+            written_text += f" (skipped {marked_count} empty or incomplete rows)"
+        if unfinished_offsets:
+            resume_ranges = _describe_unfinished_rows(data_range, start_row_for_output, unfinished_offsets)
+            logger.warning(f"generate_and_write_ads: {len(unfinished_offsets)} rows unfinished (deadline or token budget): {resume_ranges}")
+            return {
+                "action": {
+                    "notification": {"text": f"{'Token budget' if budget.capped else 'Time limit'} reached: wrote {written_text} for {finished_count} of {len(products_for_ai)} rows. Run again with data range {resume_ranges} to finish."}
+                }
+            }
         return {
             "action": {
-                "notification": {"text": f"Successfully generated and wrote {len(ads_to_write)} ads to column {output_column}."}
+                "notification": {"text": f"Successfully generated and wrote {written_text}."}
             }
         }
     else:
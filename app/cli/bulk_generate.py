@@ -0,0 +1,327 @@
+"""
+Offline bulk ad generation over CSV/XLSX product catalogs.
+
+Runs the same generation path as the add-on (ai_service + RowBatch) without
+Google Sheets. Input rows are streamed in chunks and sharded across a process pool;
+each worker process runs one event loop for its lifetime, with a bounded number of
+concurrent model calls, or submits the chunk as one Gemini batch prediction job (--backend).
+Every fully generated chunk is written to a part file under `<output>.parts/`,
+which doubles as the checkpoint: re-running the same command skips chunks that
+already have a part file and retries the rest. When all chunks are done the parts are
+merged, in input order, into the CSV or Parquet output.
+
+Usage:
+    python -m app.cli.bulk_generate products.xlsx ads.parquet --workers 8 --concurrency 16
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+AD_TEXT_COLUMN = "ad_text"
+REFERENCE_COLUMN = "reference_strategy"
+MANIFEST_NAME = "manifest.json"
+
+
+def read_catalog(path: Path, sheet_name: Optional[str] = None) -> Tuple[List[str], Iterator[List[Any]]]:
+    """Returns (headers, row iterator) for a CSV or XLSX file without loading it into memory."""
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        handle = open(path, newline="", encoding="utf-8-sig")
+        reader = csv.reader(handle)
+        headers = next(reader, [])
+
+        def csv_rows() -> Iterator[List[Any]]:
+            with handle:
+                yield from reader
+
+        return [str(h) for h in headers], csv_rows()
+
+    if suffix in (".xlsx", ".xlsm"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise SystemExit("Reading XLSX requires openpyxl (pip install 'gsheet-ads-text-bycline[bulk]').") from e
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        worksheet = workbook[sheet_name] if sheet_name else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        headers = next(rows, ())
+
+        def xlsx_rows() -> Iterator[List[Any]]:
+            try:
+                for row in rows:
+                    yield ["" if value is None else value for value in row]
+            finally:
+                workbook.close()
+
+        return ["" if h is None else str(h) for h in headers], xlsx_rows()
+
+    raise SystemExit(f"Unsupported input format '{suffix}'. Use .csv or .xlsx.")
+
+
+def iter_chunks(rows: Iterator[List[Any]], chunk_size: int) -> Iterator[Tuple[int, List[List[Any]]]]:
+    chunk: List[List[Any]] = []
+    chunk_index = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk_index, chunk
+            chunk_index += 1
+            chunk = []
+    if chunk:
+        yield chunk_index, chunk
+
+
+def _part_path(parts_dir: Path, chunk_index: int) -> Path:
+    return parts_dir / f"chunk-{chunk_index:07d}.csv"
+
+
+class ChunkFailed(Exception):
+    """A chunk with rows left without an ad; it gets no part file, so a rerun retries it."""
+
+
+# The worker's event loop. The Gemini client (ai_service.get_client) is cached per process
+# and its async transport is bound to the loop it first ran on, so every chunk a worker
+# processes must run on this same loop rather than a fresh asyncio.run() loop.
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _init_worker() -> None:
+    global _worker_loop
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+
+
+def _run_on_worker_loop(coro: Any) -> Any:
+    if _worker_loop is None:
+        _init_worker()  # Called outside the pool, e.g. from tests
+    return _worker_loop.run_until_complete(coro)
+
+
+def process_chunk(
+    chunk_index: int,
+    headers: List[str],
+    rows: List[List[Any]],
+    parts_dir: str,
+    options: Dict[str, Any],
+) -> Tuple[int, int]:
+    """
+    Worker entry point: generates ads for one chunk on the worker's event loop and writes
+    the chunk's part file atomically. Returns (chunk_index, row_count). Raises ChunkFailed,
+    without writing the part file, if any row got the fallback text instead of an ad.
+    """
+    # Imported here so the parent process never builds a Gemini client.
+    from app.services.ai_service import (AD_TEXT_FALLBACK,
+                                         generate_batch_ads_via_batch_job,
+                                         generate_batch_ads_with_search,
+                                         select_backend)
+    from app.services.row_filter import SKIP_MARKERS, prefilter
+    from app.utils.row_batch import RowBatch
+
+    # Empty/incomplete rows are marked instead of generated; duplicates reuse the first row's ad.
+    products_to_generate, row_filter = prefilter(RowBatch.from_values(headers, rows))
+    if not len(products_to_generate):
+        unique_results = []
+    elif select_backend(len(products_to_generate), options["backend"]) == "batch":
+        unique_results = _run_on_worker_loop(generate_batch_ads_via_batch_job(
+            products_data=products_to_generate,
+            tone=options["tone"],
+            max_length=options["max_length"],
+            platform=options["platform"],
+        ))
+    else:
+        unique_results = _run_on_worker_loop(generate_batch_ads_with_search(
+            products_data=products_to_generate,
+            tone=options["tone"],
+            max_length=options["max_length"],
+            platform=options["platform"],
+            max_concurrency=options["concurrency"],
+        ))
+    failed = sum(result is None or result[0] == AD_TEXT_FALLBACK for result in unique_results)
+    if failed:
+        # Not checkpointed, so rerunning the command retries this chunk.
+        raise ChunkFailed(f"{failed} row(s) of chunk {chunk_index} were left without an ad.")
+    results = row_filter.expand(unique_results, lambda status: (SKIP_MARKERS[status], ""))
+
+    final_path = _part_path(Path(parts_dir), chunk_index)
+    tmp_path = final_path.with_suffix(".tmp")
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for row_values, result in zip(rows, results):
+            ad_text, reference_strategy = result if result else ("", "")
+            padded = list(row_values[:len(headers)]) + [""] * (len(headers) - len(row_values))
+            writer.writerow(padded + [ad_text, reference_strategy])
+    os.replace(tmp_path, final_path)  # A part file only exists once the whole chunk is done
+    return chunk_index, len(rows)
+
+
+def _prepare_parts_dir(parts_dir: Path, manifest: Dict[str, Any]) -> Set[int]:
+    """Creates or validates the checkpoint directory; returns chunk indexes already completed."""
+    manifest_path = parts_dir / MANIFEST_NAME
+    if manifest_path.exists():
+        existing = json.loads(manifest_path.read_text())
+        if existing != manifest:
+            raise SystemExit(
+                f"{parts_dir} holds a checkpoint from a run with different options: {existing}. "
+                "Delete it or rerun with the same options."
+            )
+    else:
+        parts_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+    for leftover in parts_dir.glob("*.tmp"):
+        leftover.unlink()
+    return {int(p.stem.split("-")[1]) for p in parts_dir.glob("chunk-*.csv")}
+
+
+def merge_parts(parts_dir: Path, output_path: Path, headers: List[str]) -> int:
+    """Concatenates part files in chunk order into the CSV or Parquet output. Returns rows written."""
+    columns = headers + [AD_TEXT_COLUMN, REFERENCE_COLUMN]
+    part_files = sorted(parts_dir.glob("chunk-*.csv"))
+    tmp_output = output_path.with_name(output_path.name + ".tmp")
+    total_rows = 0
+
+    if output_path.suffix.lower() == ".parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("Writing Parquet requires pyarrow (pip install 'gsheet-ads-text-bycline[bulk]').") from e
+        schema = pa.schema([(name, pa.string()) for name in columns])
+        with pq.ParquetWriter(tmp_output, schema) as writer:
+            for part_file in part_files:
+                with open(part_file, newline="", encoding="utf-8") as f:
+                    part_rows = list(csv.reader(f))
+                if part_rows:
+                    writer.write_table(pa.Table.from_pylist(
+                        [dict(zip(columns, row)) for row in part_rows], schema=schema
+                    ))
+                total_rows += len(part_rows)
+    else:
+        with open(tmp_output, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for part_file in part_files:
+                with open(part_file, newline="", encoding="utf-8") as f:
+                    for row in csv.reader(f):
+                        writer.writerow(row)
+                        total_rows += 1
+    os.replace(tmp_output, output_path)
+    return total_rows
+
+
+def run(args: argparse.Namespace) -> int:
+    input_path = Path(args.input)
+    output_path = Path(args.output)
+    if output_path.suffix.lower() not in (".csv", ".parquet"):
+        raise SystemExit("Output must be a .csv or .parquet file.")
+    parts_dir = Path(args.parts_dir) if args.parts_dir else output_path.with_name(output_path.name + ".parts")
+
+    headers, rows = read_catalog(input_path, args.sheet)
+    if not headers:
+        raise SystemExit(f"{input_path} has no header row.")
+
+    options = {
+        "tone": args.tone,
+        "max_length": args.max_length,
+        "platform": args.platform,
+        "concurrency": args.concurrency,
+        "backend": args.backend,
+    }
+    manifest = {"input": str(input_path.resolve()), "chunk_size": args.chunk_size, "headers": headers, **options}
+    completed = _prepare_parts_dir(parts_dir, manifest)
+    if completed:
+        logger.info(f"Resuming: {len(completed)} chunk(s) already done in {parts_dir}.")
+
+    started_at = time.perf_counter()
+    rows_done = 0
+    failed_chunks = 0
+    max_in_flight = args.workers * 2  # Bound memory: only a few chunks are queued per worker
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+    ) as pool:
+        in_flight: Set[Future] = set()
+        for chunk_index, chunk_rows in iter_chunks(rows, args.chunk_size):
+            if chunk_index in completed:
+                continue
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collected, failed = _collect(done, started_at, rows_done)
+                rows_done, failed_chunks = rows_done + collected, failed_chunks + failed
+            in_flight.add(pool.submit(process_chunk, chunk_index, headers, chunk_rows, str(parts_dir), options))
+        done, _ = wait(in_flight)
+        collected, failed = _collect(done, started_at, rows_done)
+        rows_done, failed_chunks = rows_done + collected, failed_chunks + failed
+
+    if failed_chunks:
+        logger.error(
+            f"{failed_chunks} chunk(s) have rows without an ad and were not checkpointed; "
+            f"rerun the same command to retry them ({rows_done} rows generated this run)."
+        )
+        return 1
+    total_rows = merge_parts(parts_dir, output_path, headers)
+    if not args.keep_parts:
+        shutil.rmtree(parts_dir)
+    elapsed = time.perf_counter() - started_at
+    logger.info(f"Wrote {total_rows} rows to {output_path} ({rows_done} generated this run in {elapsed:.1f}s).")
+    return 0
+
+
+def _collect(done: Set[Future], started_at: float, rows_done_before: int) -> Tuple[int, int]:
+    """Logs finished chunks; returns (rows done, chunks failed). Other worker errors are re-raised."""
+    rows_done, failed_chunks = 0, 0
+    for future in done:
+        try:
+            chunk_index, row_count = future.result()  # Finished parts stay checkpointed
+        except ChunkFailed as e:
+            logger.warning(str(e))
+            failed_chunks += 1
+            continue
+        rows_done += row_count
+        elapsed = time.perf_counter() - started_at
+        total = rows_done_before + rows_done
+        logger.info(f"Chunk {chunk_index} done ({row_count} rows). {total} rows this run, {total / elapsed:.1f} rows/s.")
+    return rows_done, failed_chunks
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate ad text for a CSV/XLSX product catalog.")
+    parser.add_argument("input", help="Input .csv or .xlsx file; the first row holds the column headers.")
+    parser.add_argument("output", help="Output .csv or .parquet file (input columns + ad_text + reference_strategy).")
+    parser.add_argument("--sheet", help="XLSX worksheet name (defaults to the active sheet).")
+    parser.add_argument("--tone", default=settings.DEFAULT_TONE)
+    parser.add_argument("--max-length", type=int, default=settings.DEFAULT_MAX_LENGTH)
+    parser.add_argument("--platform", default=settings.DEFAULT_PLATFORMS.split(",")[0].strip())
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes.")
+    parser.add_argument("--concurrency", type=int, default=settings.BULK_CONCURRENCY_PER_WORKER,
+                        help="Concurrent model calls per worker process.")
+    parser.add_argument("--backend", choices=["online", "batch", "auto"], default="online",
+                        help="online: one model call per row; batch: one batch prediction job per chunk "
+                             "(cheaper, but takes minutes to hours; use a large --chunk-size); auto: batch "
+                             "for chunks with at least BATCH_PREDICTION_MIN_ROWS rows to generate.")
+    parser.add_argument("--chunk-size", type=int, default=settings.BULK_CHUNK_SIZE,
+                        help="Rows per work unit and checkpoint.")
+    parser.add_argument("--parts-dir", help="Checkpoint directory (defaults to <output>.parts).")
+    parser.add_argument("--keep-parts", action="store_true", help="Keep part files after merging.")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    return run(build_parser().parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,5 @@
 import os
-from typing import Optional  # Added Optional import
+from typing import Any, Dict, List, Optional  # Added Optional import
 
 from pydantic import PostgresDsn
 from pydantic_settings import BaseSettings
@@ -15,6 +15,18 @@ class Settings(BaseSettings):
     # Security settings
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
+    BCRYPT_ROUNDS: int = 12  # Existing hashes with other rounds are rehashed on the next login
+    PASSWORD_HASH_WORKERS: int = 2  # Processes dedicated to bcrypt
+    PASSWORD_HASH_MAX_PENDING: int = 64  # Hashing jobs queued in the pool before further requests wait
+    AUTH_TOKEN_CACHE_TTL_SECONDS: float = 60.0  # Access token -> user, skips the DB lookup
+    AUTH_USER_CACHE_TTL_SECONDS: float = 30.0  # Username -> user for logins
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+    USER_INFO_CACHE_TTL_SECONDS: float = 300.0  # Google OAuth userinfo per add-on user token
+
+    # Response layer: rendered cards are cached per base URL; larger responses are gzipped
+    CARD_CACHE_MAX_HOSTS: int = 32
+    GZIP_MINIMUM_SIZE_BYTES: int = 500  # The homepage card is ~600 bytes
+    GZIP_COMPRESS_LEVEL: int = 6
 
     # Google Gemini API settings
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
@@ -31,10 +43,156 @@ class Settings(BaseSettings):
     # RAG settings
     VECTOR_DIMENSION: int = 768
     SIMILARITY_THRESHOLD: float = 0.7
+    # Single-ad rows whose nearest past product (same user, platform, tone and max length)
+    # scores at least SIMILARITY_THRESHOLD get that product's ad adapted by SIMILARITY_ADAPT_MODEL,
+    # without search, instead of a full generation. Past products scoring above
+    # SIMILARITY_MAX_SCORE are the same product (e.g. a rerun of the same rows), which is
+    # generated afresh rather than given its old ad back.
+    SIMILARITY_MAX_SCORE: float = 0.999
+    SIMILARITY_REUSE_ENABLED: bool = True
+    SIMILARITY_EMBEDDER: str = "hashing"  # "hashing" (local, deterministic) or "gemini"
+    SIMILARITY_EMBEDDING_MODEL: str = "text-embedding-004"  # For SIMILARITY_EMBEDDER=gemini
+    SIMILARITY_INDEX_BACKEND: str = "memory"  # "memory" (needs NumPy) or "pgvector"; changes the embedding column type
+    SIMILARITY_INDEX_MAX_ROWS: int = 5000  # Most recent generations searched per user/platform/tone/max length
+    SIMILARITY_INDEX_TTL_SECONDS: float = 600.0
+    SIMILARITY_INDEX_MAX_SCOPES: int = 256
+    SIMILARITY_ADAPT_MODEL: str = "gemini-1.5-flash-8b-latest"
 
     # Ad generation settings
     DEFAULT_MAX_LENGTH: int = 150
     DEFAULT_TONE: str = "Professional"
+    DEFAULT_PLATFORMS: str = "Facebook"  # Comma-separated
+    MAX_AD_PLATFORMS: int = 5
+    MAX_AD_VARIANTS: int = 5
+
+    # Request deadline settings
+    # Workspace add-on actions are cut off after ~30s; stop starting new work before that
+    # and keep enough time back to write finished rows to the sheet.
+    GWS_ACTION_DEADLINE_SECONDS: float = 25.0
+    DEADLINE_WRITE_RESERVE_SECONDS: float = 3.0
+    MIN_AI_CALL_SECONDS: float = 2.0  # Don't start a row with less time than this left
+    SHEETS_REQUEST_TIMEOUT_SECONDS: float = 30.0
+
+    # Sheets API quota settings (Google's defaults: 300/min per project, 60/min per user, each for reads and writes)
+    SHEETS_PROJECT_READS_PER_MINUTE: int = 300
+    SHEETS_PROJECT_WRITES_PER_MINUTE: int = 300
+    SHEETS_USER_READS_PER_MINUTE: int = 60
+    SHEETS_USER_WRITES_PER_MINUTE: int = 60
+    SHEETS_QUOTA_BURST_SECONDS: float = 5.0  # Bucket capacity, in seconds of refill
+    SHEETS_QUOTA_MAX_USERS: int = 10000
+    SHEETS_MAX_RETRIES: int = 4
+    SHEETS_RETRY_BASE_DELAY_SECONDS: float = 1.0
+    SHEETS_RETRY_MAX_DELAY_SECONDS: float = 32.0
+
+    # Cache of range values, reused while the spreadsheet's Drive version is unchanged
+    SHEETS_VALUES_CACHE_ENABLED: bool = True
+    SHEETS_VALUES_CACHE_MAX_ENTRIES: int = 64
+    SHEETS_VALUES_CACHE_MAX_CELLS: int = 2_000_000
+
+    # Duplicate "Generate & Write Ads" submissions (double clicks, retries) attach to the run in flight.
+    # A successful run's response is replayed to identical submissions for IDEMPOTENCY_REPLAY_SECONDS.
+    IDEMPOTENCY_LEASE_SECONDS: float = 60.0  # A claim older than this is treated as abandoned
+    IDEMPOTENCY_REPLAY_SECONDS: float = 15.0
+    IDEMPOTENCY_POLL_INTERVAL_SECONDS: float = 0.5
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 300.0  # How often each worker deletes expired records
+
+    # Gemini hedging and circuit breaker settings
+    # A second identical request is sent when the first has not answered after the
+    # HEDGE_PERCENTILE latency of recent calls, for at most HEDGE_BUDGET_RATIO extra requests.
+    HEDGE_ENABLED: bool = True
+    HEDGE_PERCENTILE: float = 95.0
+    HEDGE_MIN_SAMPLES: int = 20
+    HEDGE_DEFAULT_DELAY_SECONDS: float = 8.0  # Used until HEDGE_MIN_SAMPLES latencies are known
+    HEDGE_MIN_DELAY_SECONDS: float = 1.0
+    HEDGE_BUDGET_RATIO: float = 0.1
+    CIRCUIT_BREAKER_WINDOW: int = 20
+    CIRCUIT_BREAKER_MIN_REQUESTS: int = 10
+    CIRCUIT_BREAKER_ERROR_RATE: float = 0.5
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 30.0
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 1
+
+    # Header/column-mapping cache settings
+    HEADER_CACHE_MAX_ENTRIES: int = 1024
+
+    # Speculative prefetch when the generate form opens (see app/services/prefetch.py)
+    PREFETCH_ENABLED: bool = True
+    PREFETCH_TTL_SECONDS: float = 120.0  # How long a submit can pick up a prefetch
+    PREFETCH_MAX_WAIT_SECONDS: float = 5.0  # Longest a submit waits for a prefetch still in flight
+    PREFETCH_MAX_ENTRIES: int = 10000
+
+    # Row pre-filter: empty, incomplete and duplicate rows are not sent to the model
+    ROW_FILTER_ENABLED: bool = True
+    ROW_FILTER_MIN_CHARS: int = 2  # Rows with less non-blank text than this count as empty
+    ROW_FILTER_REQUIRED_ROLES: List[str] = ["name"]  # Only checked when the role maps to a column
+
+    # Fair scheduling of model calls across tenants (see app/services/fair_scheduler.py)
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_MAX_CONCURRENT_CALLS: int = 32  # Per worker process
+    SCHEDULER_TENANT_MAX_CONCURRENT_CALLS: int = 8
+    SCHEDULER_INTERACTIVE_MAX_ROWS: int = 200  # Requests with more rows are scheduled as bulk
+    SCHEDULER_INTERACTIVE_WEIGHT: float = 4.0
+    SCHEDULER_BULK_WEIGHT: float = 1.0
+
+    # Token usage accounting and budgets (see app/services/usage.py)
+    # Budgets are in total tokens over a rolling TOKEN_BUDGET_WINDOW_HOURS window; 0 disables that budget.
+    # A run's cost is estimated up front as rows x the user's recent average tokens per row.
+    TOKEN_BUDGET_ENABLED: bool = True
+    TOKEN_BUDGET_WINDOW_HOURS: float = 24.0
+    USER_TOKEN_BUDGET: int = 2_000_000  # Per user; User.token_budget overrides it
+    SPREADSHEET_TOKEN_BUDGET: int = 0  # Per spreadsheet, across users
+    TOKEN_ESTIMATE_DEFAULT_PER_ROW: int = 2000  # Until there is usage history to average
+    TOKEN_ESTIMATE_SAMPLE_SIZE: int = 200
+
+    # Generation history export (see app/services/export.py)
+    EXPORT_BATCH_ROWS: int = 1000  # Rows fetched per server-side cursor round trip, and per streamed chunk
+
+    # Streamed single-ad generation and length repair (see app/services/ad_length.py)
+    AD_STREAMING_ENABLED: bool = True
+    AD_STREAM_OVERSHOOT_FACTOR: float = 1.5  # Cut the stream once the ad passes this x max_length
+    AD_STREAM_REFERENCE_MAX_CHARS: int = 600  # Cut the stream once the reference note is this long
+    AD_LENGTH_REPAIR_ENABLED: bool = True
+    AD_LENGTH_TOLERANCE: float = 1.1  # Ads up to this x max_length are left as they are
+    AD_LOCAL_TRIM_MIN_RATIO: float = 0.6  # Dropping trailing sentences must keep this much of max_length
+    AD_REPAIR_MODEL: str = "gemini-1.5-flash-8b-latest"
+
+    # Batch prediction for large runs that can wait (see app/services/batch_prediction.py)
+    BATCH_PREDICTION_BACKEND: str = "gemini"  # "gemini" (the Batch API) or "local" (offline stand-in)
+    BATCH_PREDICTION_MIN_ROWS: int = 1000  # Backend "auto" uses batch prediction from this many rows
+    BATCH_POLL_INTERVAL_SECONDS: float = 30.0
+    BATCH_MAX_WAIT_SECONDS: float = 24 * 3600  # Jobs still running after this are cancelled
+
+    # Offline bulk CLI settings (python -m app.cli.bulk_generate)
+    BULK_CHUNK_SIZE: int = 500
+    BULK_CONCURRENCY_PER_WORKER: int = 8
+
+    # Model routing settings
+    # Each route names a model and whether the Google Search tool is attached.
+    # Rows are scored 0..1 on how much product information they already carry;
+    # rows at or above AD_ROUTE_RICH_ROW_MIN_SCORE use AD_ROUTE_FOR_RICH_ROWS.
+    AD_MODEL_ROUTES: Dict[str, Dict[str, Any]] = {
+        "grounded": {"model": "gemini-1.5-flash-latest", "use_search": True},
+        "direct": {"model": "gemini-1.5-flash-8b-latest", "use_search": False},
+    }
+    AD_ROUTE_FOR_RICH_ROWS: str = "direct"
+    AD_ROUTE_FOR_THIN_ROWS: str = "grounded"
+    AD_ROUTE_RICH_ROW_MIN_SCORE: float = 0.75
+
+    # Prompt prefix caching: a batch's shared instructions are registered once as Gemini cached
+    # content when they reach the model's minimum cacheable size (32k tokens for Gemini 1.5);
+    # shorter prefixes are sent as the system instruction.
+    PROMPT_CONTEXT_CACHE_ENABLED: bool = True
+    PROMPT_CONTEXT_CACHE_MIN_TOKENS: int = 32768
+    PROMPT_CONTEXT_CACHE_TTL_SECONDS: int = 600
+
+    # Opt-in request profiling (see app/core/profiling.py); profiles are listed at /api/v1/admin/profiles
+    PROFILER_ENABLED: bool = False
+    PROFILER_SAMPLE_RATE: float = 0.01  # Fraction of requests profiled in full (stack samples and task timings)
+    PROFILER_SLOW_REQUEST_SECONDS: float = 10.0  # Requests at least this slow are saved, with a snapshot of the loop's tasks
+    PROFILER_INTERVAL_SECONDS: float = 0.01
+    PROFILER_WINDOW_SECONDS: float = 120.0  # Stack samples kept; must exceed the slowest request
+    PROFILER_DIR: str = "/tmp/ads-text-profiles"
+    PROFILER_MAX_PROFILES: int = 200
+    PROFILER_EXCLUDE_PATHS: List[str] = ["/health", "/ready", "/metrics", "/api/v1/admin"]
 
     class Config:
         case_sensitive = True
@@ -0,0 +1,37 @@
+import time
+from typing import Optional
+
+from app.core.config import settings
+
+
+class Deadline:
+    """
+    A request-wide time budget. Created once per request and passed down so every
+    stage (Sheets reads, AI calls, the final write) derives its timeout from what is left.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    @classmethod
+    def for_gws_action(cls) -> "Deadline":
+        return cls(settings.GWS_ACTION_DEADLINE_SECONDS)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: Optional[float] = None, reserve: float = 0.0) -> float:
+        """
+        Seconds a single call may take: what is left after holding back `reserve`
+        seconds for later stages, optionally capped at `cap`. Never negative.
+        """
+        available = max(0.0, self.remaining() - reserve)
+        return min(available, cap) if cap is not None else available
+
+    def has_time_for(self, seconds: float, reserve: float = 0.0) -> bool:
+        return self.timeout(reserve=reserve) >= seconds
@@ -1,15 +1,27 @@
+import json
 import logging
-from typing import Any, Dict
+import re
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Values prefilled per request; the rest of the card only depends on base_url.
+PREFILLED_FIELDS = ("data_range", "header_row", "output_column", "detected_columns")
+PLACEHOLDER = re.compile(r"@@(\w+)@@")
+
 
-def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
+def create_generate_ads_card(base_url: str, defaults: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
     """
     Creates the Card Service JSON for the 'Generate Ads Options' form.
     This form collects data range, header row, output column, and generation parameters.
+    `defaults` prefills data_range/header_row/output_column (e.g. from the last run on this
+    spreadsheet) and may carry a 'detected_columns' summary shown above the inputs.
     """
     logger.info(f"Creating generate_ads_card with base_url: {base_url}")
+    defaults = defaults or {}
 
     card_json = {
         "action": {
@@ -24,6 +36,7 @@ def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
                                     {
                                         "textInput": {
                                             "name": "data_range",
+                                            "value": defaults.get("data_range", ""),
                                             "label": "Data Rows Range (e.g., Sheet1!A2:D100)",
                                             "hintText": "Range of data to process, excluding headers."
                                         }
@@ -31,6 +44,7 @@ def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
                                     {
                                         "textInput": {
                                             "name": "header_row",
+                                            "value": defaults.get("header_row", ""),
                                             "label": "Header Row Number (e.g., 1)",
                                             "hintText": "Row number containing column headers."
                                         }
@@ -38,6 +52,7 @@ def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
                                     {
                                         "textInput": {
                                             "name": "output_column",
+                                            "value": defaults.get("output_column", ""),
                                             "label": "Output Starting Column Letter (e.g., E)",
                                             "hintText": "Ads & references will be written starting here."
                                         }
@@ -63,6 +78,25 @@ def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
                                                     "inputType": "INTEGER"
                                             }
                                         }
+                                    },
+                                    {
+                                        "textInput": {
+                                            "name": "platforms",
+                                            "label": "Platforms (comma-separated)",
+                                            "value": settings.DEFAULT_PLATFORMS,
+                                            "hintText": "e.g., Facebook, Instagram, Google Ads"
+                                        }
+                                    },
+                                    {
+                                        "textInput": {
+                                            "name": "variants",
+                                            "label": "Variants per Platform",
+                                            "value": "1",
+                                            "hintText": "Each platform/variant is written to its own column.",
+                                            "validation": {
+                                                    "inputType": "INTEGER"
+                                            }
+                                        }
                                     }
                                 ]
                             },
@@ -90,4 +124,29 @@ def create_generate_ads_card(base_url: str) -> Dict[str, Any]:
             ]
         }
     }
+    if defaults.get("detected_columns"):
+        data_selection_widgets = card_json["action"]["navigations"][0]["pushCard"]["sections"][0]["widgets"]
+        data_selection_widgets.insert(0, {
+            "textParagraph": {"text": f"<b>Detected columns:</b> {defaults['detected_columns']}"}
+        })
     return card_json
+
+
+@lru_cache(maxsize=2 * settings.CARD_CACHE_MAX_HOSTS)
+def _card_template(base_url: str, with_detected_columns: bool) -> str:
+    placeholders = {
+        name: f"@@{name}@@" for name in PREFILLED_FIELDS if with_detected_columns or name != "detected_columns"
+    }
+    return json.dumps(create_generate_ads_card(base_url, placeholders), separators=(",", ":"))
+
+
+def render_generate_ads_card(base_url: str, defaults: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    create_generate_ads_card serialized to JSON. The card is built once per base URL (with
+    and without the detected-columns line); a request only substitutes its JSON-escaped
+    prefilled values into the cached text, in one pass.
+    """
+    defaults = defaults or {}
+    template = _card_template(base_url, bool(defaults.get("detected_columns")))
+    escaped = {name: json.dumps(str(defaults.get(name, "")))[1:-1] for name in PREFILLED_FIELDS}
+    return PLACEHOLDER.sub(lambda match: escaped.get(match.group(1), match.group(0)), template).encode("utf-8")
@@ -1,5 +1,9 @@
+import json
+from functools import lru_cache
 from typing import Any, Dict
 
+from app.core.config import settings
+
 
 def create_homepage_card(base_url: str) -> Dict[str, Any]:
     """
@@ -57,3 +61,9 @@ def create_homepage_card(base_url: str) -> Dict[str, Any]:
         }
     }
     return card_json
+
+
+@lru_cache(maxsize=settings.CARD_CACHE_MAX_HOSTS)
+def render_homepage_card(base_url: str) -> bytes:
+    """create_homepage_card serialized to JSON, built once per base URL."""
+    return json.dumps(create_homepage_card(base_url), separators=(",", ":")).encode("utf-8")
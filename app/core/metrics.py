@@ -0,0 +1,65 @@
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List
+
+# Simple in-process metrics registry. Counters are monotonically increasing
+# totals; observations keep a bounded window of recent samples for percentiles
+# plus all-time count/sum. Exposed as JSON at /metrics.
+
+OBSERVATION_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_observations: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=OBSERVATION_WINDOW))
+_observation_totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])  # [count, sum]
+
+
+def _metric_key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values` (pct in 0-100). Returns 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def increment(name: str, value: float = 1, **labels: Any) -> None:
+    key = _metric_key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    key = _metric_key(name, labels)
+    with _lock:
+        _observations[key].append(value)
+        totals = _observation_totals[key]
+        totals[0] += 1
+        totals[1] += value
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+        observations = {key: list(window) for key, window in _observations.items()}
+        totals = {key: tuple(value) for key, value in _observation_totals.items()}
+
+    summaries = {}
+    for key, window in observations.items():
+        count, total = totals[key]
+        summaries[key] = {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+            "p50": percentile(window, 50),
+            "p95": percentile(window, 95),
+            "max": max(window) if window else 0.0,
+        }
+    return {"counters": counters, "observations": summaries}
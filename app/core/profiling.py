@@ -0,0 +1,340 @@
+import asyncio
+import collections.abc
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Opt-in request profiling (PROFILER_ENABLED). A request picked for sampling when it
+# arrives (PROFILER_SAMPLE_RATE) is profiled in full: while sampled requests are in flight,
+# a background thread samples the event loop thread's stack every PROFILER_INTERVAL_SECONDS
+# and a task factory tallies every new task's time on the loop. Both are off otherwise.
+# Every request is timed, and one still running after PROFILER_SLOW_REQUEST_SECONDS gets a
+# snapshot of the await stacks of the loop's tasks at that moment (a single timer callback,
+# so unsampled requests cost next to nothing). Sampled and slow requests are saved as a
+# folded-stacks flamegraph (stack samples, or the task snapshot for an unsampled slow
+# request), next to a JSON report, in a bounded directory ring (PROFILER_DIR,
+# PROFILER_MAX_PROFILES).
+#
+# Stack samples are of the whole event loop, so a profile also contains whatever other
+# requests ran on the loop at the same time; frames under `select` are the loop waiting
+# on I/O (Sheets, Gemini), everything else is CPU on the loop. Work in threads (sync
+# endpoints, to_thread) shows up only as the awaiting task's wall time.
+
+PROFILE_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into a time-bounded ring."""
+
+    def __init__(self, interval: float, window_seconds: float):
+        self.interval = interval
+        self.samples: Deque[Tuple[float, Tuple[str, ...]]] = deque(maxlen=max(1, int(window_seconds / interval)))
+        self._labels: Dict[Any, str] = {}
+        self.skipped_code: Set[Any] = set()  # Frames left out of samples (the task timing wrapper)
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread_id: Optional[int] = None
+
+    def start(self, target_thread_id: int) -> None:
+        if self._thread is not None:
+            return
+        self._target_thread_id = target_thread_id
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def resume(self) -> None:
+        self._active.set()
+
+    def pause(self) -> None:
+        self._active.clear()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            frame = sys._current_frames().get(self._target_thread_id)
+            stack = []
+            while frame is not None:
+                if frame.f_code not in self.skipped_code:
+                    stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            del frame
+            if stack:
+                self.samples.append((time.perf_counter(), tuple(reversed(stack))))
+            time.sleep(self.interval)
+
+    def folded(self, started_at: float, finished_at: float) -> Tuple[str, int]:
+        """Samples taken in [started_at, finished_at] in folded-stacks format ("a;b;c count" lines)."""
+        return _fold(stack for sampled_at, stack in list(self.samples) if started_at <= sampled_at <= finished_at)
+
+
+def _fold(stacks: Iterable[Tuple[str, ...]]) -> Tuple[str, int]:
+    counts = Counter(stacks)
+    lines = [f"{';'.join(stack)} {count}" for stack, count in counts.most_common()]
+    return "\n".join(lines) + ("\n" if lines else ""), sum(counts.values())
+
+
+class RequestRecorder:
+    """Per-request tally of asyncio tasks: how long each lived and how long it held the loop."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.perf_counter()
+        self.tasks: Dict[str, List[float]] = {}  # label -> [count, wall seconds, busy seconds, max wall seconds]
+        self.task_stacks: List[Tuple[str, ...]] = []  # Await stacks of the loop's tasks once the request turned slow
+        self.snapshot_at: Optional[float] = None
+
+    def snapshot_tasks(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Records where every task on `loop` is waiting (outermost coroutine first)."""
+        self.snapshot_at = time.perf_counter()
+        for task in asyncio.all_tasks(loop):
+            stack = tuple(sampler._label(code) for code in _await_stack(task.get_coro()))
+            if stack:
+                self.task_stacks.append(stack)
+
+    def add_task(self, label: str, wall_seconds: float, busy_seconds: float) -> None:
+        entry = self.tasks.setdefault(label, [0, 0.0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += wall_seconds
+        entry[2] += busy_seconds
+        entry[3] = max(entry[3], wall_seconds)
+
+    def breakdown(self, wall_seconds: float, limit: int = 50) -> Dict[str, Any]:
+        ordered = sorted(self.tasks.items(), key=lambda item: item[1][2], reverse=True)
+        busy_seconds = sum(entry[2] for entry in self.tasks.values())
+        return {
+            "wall_seconds": round(wall_seconds, 4),
+            # Time the request's tasks spent running on the loop (CPU, including blocking calls)
+            "loop_busy_seconds": round(busy_seconds, 4),
+            "tasks": [
+                {
+                    "task": label,
+                    "count": int(count),
+                    "wall_seconds": round(wall, 4),
+                    "busy_seconds": round(busy, 4),
+                    "max_wall_seconds": round(max_wall, 4),
+                }
+                for label, (count, wall, busy, max_wall) in ordered[:limit]
+            ],
+        }
+
+
+_current_request: contextvars.ContextVar[Optional[RequestRecorder]] = contextvars.ContextVar("profiled_request", default=None)
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Wraps a task's coroutine to time each step it runs on the loop."""
+
+    __slots__ = ("_coro", "_label", "_created_at", "_busy")
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._label = getattr(coro, "__qualname__", type(coro).__name__)
+        self._created_at = time.perf_counter()
+        self._busy = 0.0
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    def _step(self, method, *args):
+        started_at = time.perf_counter()
+        finished = True
+        try:
+            result = method(*args)
+            finished = False
+            return result
+        finally:
+            now = time.perf_counter()
+            self._busy += now - started_at
+            if finished:
+                # The task's context is current here, so this is the request it ran for (if any).
+                recorder = _current_request.get()
+                if recorder is not None:
+                    recorder.add_task(self._label, now - self._created_at, self._busy)
+
+
+def _await_stack(coro) -> List[Any]:
+    """Code objects of a suspended coroutine and the coroutines it is awaiting, outermost first."""
+    codes = []
+    while coro is not None:
+        if isinstance(coro, _TimedCoroutine):
+            coro = coro._coro
+            continue
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        codes.append(frame.f_code)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return codes
+
+
+def _timed_task_factory(loop, coro, **kwargs):
+    return asyncio.Task(_TimedCoroutine(coro), loop=loop, **kwargs)
+
+
+class ProfileStore:
+    """A directory of at most `max_profiles` profiles (<id>.json + <id>.folded), oldest evicted first."""
+
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def save(self, profile_id: str, report: Dict[str, Any], folded: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f"{profile_id}.folded").write_text(folded)
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(report, indent=2))
+        self._evict()
+
+    def _evict(self) -> None:
+        reports = sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for path in reports[:max(0, len(reports) - self.max_profiles)]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".folded").unlink(missing_ok=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not self.directory.exists():
+            return []
+        reports = []
+        for path in sorted(self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime, reverse=True):
+            try:
+                report = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # Evicted or half-written by another worker
+            reports.append({key: report.get(key) for key in ("id", "method", "path", "status", "reason", "wall_seconds", "recorded_at")})
+        return reports
+
+    def path(self, profile_id: str, suffix: str) -> Optional[Path]:
+        if not PROFILE_ID.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}{suffix}"
+        return path if path.is_file() else None
+
+
+sampler = StackSampler(settings.PROFILER_INTERVAL_SECONDS, settings.PROFILER_WINDOW_SECONDS)
+sampler.skipped_code = {_TimedCoroutine.send.__code__, _TimedCoroutine.throw.__code__, _TimedCoroutine._step.__code__}
+store = ProfileStore(settings.PROFILER_DIR, settings.PROFILER_MAX_PROFILES)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled HTTP requests and snapshots slow ones (see the module comment)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._sampled_in_flight = 0
+
+    def _sampling_started(self) -> None:
+        """The first sampled request in flight installs the task timing factory and wakes the sampler."""
+        self._sampled_in_flight += 1
+        if self._sampled_in_flight > 1:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.get_task_factory() is None:
+            loop.set_task_factory(_timed_task_factory)
+        sampler.start(threading.get_ident())
+        sampler.resume()
+
+    def _sampling_finished(self) -> None:
+        """The last sampled request in flight removes the factory (if still ours) and pauses the sampler."""
+        self._sampled_in_flight -= 1
+        if self._sampled_in_flight:
+            return
+        sampler.pause()
+        loop = asyncio.get_running_loop()
+        if loop.get_task_factory() is _timed_task_factory:
+            loop.set_task_factory(None)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if (scope["type"] != "http" or not settings.PROFILER_ENABLED
+                or any(path.startswith(prefix) for prefix in settings.PROFILER_EXCLUDE_PATHS)):
+            await self.app(scope, receive, send)
+            return
+
+        sampled = random.random() < settings.PROFILER_SAMPLE_RATE
+        recorder = RequestRecorder(scope.get("method", ""), path)
+        token = _current_request.set(recorder)
+        loop = asyncio.get_running_loop()
+        slow_snapshot = loop.call_later(settings.PROFILER_SLOW_REQUEST_SECONDS, recorder.snapshot_tasks, loop)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        if sampled:
+            self._sampling_started()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            slow_snapshot.cancel()
+            if sampled:
+                self._sampling_finished()
+            _current_request.reset(token)
+            finished_at = time.perf_counter()
+            if finished_at - recorder.started_at >= settings.PROFILER_SLOW_REQUEST_SECONDS:
+                await self._save(recorder, status["code"], finished_at, "slow", sampled)
+            elif sampled:
+                await self._save(recorder, status["code"], finished_at, "sampled", sampled)
+
+    async def _save(self, recorder: RequestRecorder, status_code: int, finished_at: float,
+                    reason: str, sampled: bool) -> None:
+        wall_seconds = finished_at - recorder.started_at
+        if sampled:
+            folded, sample_count = sampler.folded(recorder.started_at, finished_at)
+        else:
+            folded, sample_count = _fold(recorder.task_stacks)[0], 0
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{random.getrandbits(32):08x}"
+        report = {
+            "id": profile_id,
+            "method": recorder.method,
+            "path": recorder.path,
+            "status": status_code,
+            "reason": reason,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "stack_samples": sample_count,
+            "sample_interval_seconds": sampler.interval,
+            # Tasks on the loop when the request passed PROFILER_SLOW_REQUEST_SECONDS
+            "task_snapshot_at_seconds": (
+                round(recorder.snapshot_at - recorder.started_at, 4) if recorder.snapshot_at is not None else None
+            ),
+            "task_snapshot": [";".join(stack) for stack in recorder.task_stacks],
+            **recorder.breakdown(wall_seconds),
+        }
+        try:
+            await asyncio.to_thread(store.save, profile_id, report, folded)
+        except OSError as e:
+            logger.error(f"Could not save profile {profile_id}: {e}")
+            return
+        metrics.increment("profiles_saved_total", reason=reason)
+        logger.info(f"Saved {reason} request profile {profile_id} for {recorder.method} {recorder.path} ({wall_seconds:.2f}s).")
@@ -0,0 +1,16 @@
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # Optional speedup (pip install 'gsheet-ads-text-bycline[speedups]')
+    orjson = None
+
+# The app's default response class: orjson serializes dict responses several times faster
+# than the standard library encoder when it is installed.
+DefaultJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+class CardResponse(Response):
+    """Card Service JSON that is already serialized (see render_* in app.core.gws_cards)."""
+
+    media_type = "application/json"
@@ -0,0 +1,87 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _import_genai() -> None:
+    from google.genai import errors, types  # noqa: F401
+
+
+def _build_genai_client() -> None:
+    from app.services.ai_service import get_client, get_google_search_tool, get_safety_settings
+    get_client()
+    get_safety_settings()
+    get_google_search_tool()
+
+
+def _import_google_auth() -> None:
+    from google.auth.transport import requests  # noqa: F401
+    from google.oauth2 import id_token  # noqa: F401
+
+
+def _import_requests() -> None:
+    import requests  # noqa: F401
+
+
+def _load_prompt_templates() -> None:
+    from app.services.ai_service import (ROW_PROMPT_TEMPLATE,
+                                         load_prompt_template)
+    for name in ("ad_generation_system.txt", "ad_variants_system.txt", ROW_PROMPT_TEMPLATE):
+        load_prompt_template(name)
+
+
+# Work deferred out of module import, run once per process after startup.
+STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("import_genai", _import_genai),
+    ("genai_client", _build_genai_client),
+    ("import_google_auth", _import_google_auth),
+    ("import_requests", _import_requests),
+    ("prompt_templates", _load_prompt_templates),
+]
+
+
+class WarmupState:
+    """Progress of the startup warm-up, reported by the /ready endpoint."""
+
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.step_seconds: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def report(self) -> Dict[str, Any]:
+        report: Dict[str, Any] = {"ready": self.ready, "steps": dict(self.step_seconds)}
+        if self.ready:
+            report["warmup_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.errors:
+            report["errors"] = dict(self.errors)
+        return report
+
+
+state = WarmupState()
+
+
+def run_warmup() -> WarmupState:
+    """
+    Runs every warm-up step (blocking; call it in a thread). A failing step is logged and
+    reported but does not keep the worker from becoming ready: whatever it was meant to
+    preload is then simply loaded on first use.
+    """
+    state.started_at = time.perf_counter()
+    for name, step in STEPS:
+        step_started_at = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Warm-up step {name} failed: {e}")
+            state.errors[name] = str(e)
+        state.step_seconds[name] = round(time.perf_counter() - step_started_at, 3)
+    state.finished_at = time.perf_counter()
+    logger.info(f"Warm-up finished in {state.finished_at - state.started_at:.2f}s: {state.step_seconds}")
+    return state
@@ -1,9 +1,14 @@
-from typing import Any, Dict, List, Optional
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
+from sqlalchemy import func, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app.core.security import get_password_hash, verify_password
-from app.db.models import AdGeneration, Product, ScrapedData, User
+from app.db.models import (AdGeneration, IdempotencyRecord, Product,
+                           ScrapedData, SheetHeaderMapping, User)
 
 
 # User CRUD operations
@@ -19,8 +24,10 @@ def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
 
-def create_user(db: Session, username: str, email: str, password: str) -> User:
-    hashed_password = get_password_hash(password)
+def create_user(db: Session, username: str, email: str, password: Optional[str] = None,
+                password_hash: Optional[str] = None) -> User:
+    """Pass `password_hash` when the password was already hashed (off the request thread)."""
+    hashed_password = password_hash or get_password_hash(password)
     db_user = User(username=username, email=email, password_hash=hashed_password)
     db.add(db_user)
     db.commit()
@@ -28,15 +35,52 @@ def create_user(db: Session, username: str, email: str, password: str) -> User:
     return db_user
 
 
+def get_user_by_google_sub(db: Session, google_sub: str) -> Optional[User]:
+    return db.query(User).filter(User.google_sub == google_sub).first()
+
+
+def get_or_create_workspace_user(db: Session, google_sub: str, email: Optional[str] = None) -> User:
+    """
+    The user of a Google Workspace add-on request, keyed on the Google account ID (`sub`)
+    and created on first sight. Never linked to a registered account by email: registration
+    does not verify that the address is owned. `email` is stored unless another account has it.
+    """
+    user = get_user_by_google_sub(db, google_sub)
+    if user is not None:
+        return user
+    if email is not None and get_user_by_email(db, email) is not None:
+        email = None
+    db_user = User(username=f"google:{google_sub}", email=email, google_sub=google_sub)
+    db.add(db_user)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        user = get_user_by_google_sub(db, google_sub)  # Created concurrently by another request
+        if user is not None:
+            return user
+        # The username or email was taken in between by a registered account.
+        db_user = User(username=f"google:{google_sub}:{secrets.token_hex(4)}", google_sub=google_sub)
+        db.add(db_user)
+        db.commit()
+    db.refresh(db_user)
+    return db_user
+
+
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
     user = get_user_by_username(db, username)
-    if not user:
+    if not user or not user.password_hash:
         return None
     if not verify_password(password, user.password_hash):
         return None
     return user
 
 
+def update_user_password_hash(db: Session, user_id: int, password_hash: str) -> None:
+    db.query(User).filter(User.id == user_id).update({"password_hash": password_hash}, synchronize_session=False)
+    db.commit()
+
+
 # Product CRUD operations
 def get_product(db: Session, product_id: int) -> Optional[Product]:
     return db.query(Product).filter(Product.id == product_id).first()
@@ -97,9 +141,211 @@ def create_ad_generation(db: Session, user_id: int, product_id: int,
     return db_ad_generation
 
 
+def create_ad_generations(db: Session, generations: List[Dict[str, Any]]) -> int:
+    """Inserts many AdGeneration rows (dicts of column values) in one statement."""
+    if not generations:
+        return 0
+    db.bulk_insert_mappings(AdGeneration, generations)
+    db.commit()
+    return len(generations)
+
+
+def get_token_usage(db: Session, since: datetime, user_id: Optional[int] = None,
+                    spreadsheet_id: Optional[str] = None) -> Dict[str, int]:
+    """Token and generation totals since `since`, for one user and/or one spreadsheet."""
+    query = db.query(
+        func.count(AdGeneration.id),
+        func.coalesce(func.sum(AdGeneration.prompt_tokens), 0),
+        func.coalesce(func.sum(AdGeneration.output_tokens), 0),
+        func.coalesce(func.sum(AdGeneration.tool_tokens), 0),
+        func.coalesce(func.sum(AdGeneration.total_tokens), 0),
+    ).filter(AdGeneration.created_at >= since)
+    if user_id is not None:
+        query = query.filter(AdGeneration.user_id == user_id)
+    if spreadsheet_id is not None:
+        query = query.filter(AdGeneration.spreadsheet_id == spreadsheet_id)
+    generations, prompt_tokens, output_tokens, tool_tokens, total_tokens = query.one()
+    return {
+        "generations": int(generations),
+        "prompt_tokens": int(prompt_tokens),
+        "output_tokens": int(output_tokens),
+        "tool_tokens": int(tool_tokens),
+        "total_tokens": int(total_tokens),
+    }
+
+
+def get_token_usage_by_spreadsheet(db: Session, user_id: int, since: datetime) -> List[Dict[str, Any]]:
+    rows = db.query(
+        AdGeneration.spreadsheet_id,
+        func.count(AdGeneration.id),
+        func.coalesce(func.sum(AdGeneration.total_tokens), 0),
+    ).filter(
+        AdGeneration.user_id == user_id,
+        AdGeneration.created_at >= since
+    ).group_by(AdGeneration.spreadsheet_id).order_by(func.sum(AdGeneration.total_tokens).desc()).all()
+    return [
+        {"spreadsheet_id": spreadsheet_id, "generations": int(generations), "total_tokens": int(total_tokens)}
+        for spreadsheet_id, generations, total_tokens in rows
+    ]
+
+
+def get_average_tokens_per_generation(db: Session, user_id: Optional[int] = None, sample_size: int = 200) -> Optional[float]:
+    """Mean total_tokens over the most recent `sample_size` metered generations (of one user, or everyone's)."""
+    recent = db.query(AdGeneration.total_tokens).filter(AdGeneration.total_tokens > 0)
+    if user_id is not None:
+        recent = recent.filter(AdGeneration.user_id == user_id)
+    recent = recent.order_by(AdGeneration.created_at.desc()).limit(sample_size).subquery()
+    average = db.query(func.avg(recent.c.total_tokens)).scalar()
+    return float(average) if average is not None else None
+
+
 def get_ad_generations_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[AdGeneration]:
     return db.query(AdGeneration).filter(AdGeneration.user_id == user_id).offset(skip).limit(limit).all()
 
 
 def get_ad_generations_by_product(db: Session, product_id: int) -> List[AdGeneration]:
     return db.query(AdGeneration).filter(AdGeneration.product_id == product_id).all()
+
+
+def get_similarity_candidates(db: Session, user_id: int, platform: str, tone: str, max_length: int,
+                              embedding_model: str, limit: int) -> List[AdGeneration]:
+    """
+    The user's `limit` most recent generations for the same platform, tone and max length
+    that have a product text and an embedding from `embedding_model`.
+    """
+    return db.query(AdGeneration).filter(
+        AdGeneration.user_id == user_id,
+        AdGeneration.platform == platform,
+        AdGeneration.embedding_model == embedding_model,
+        AdGeneration.generation_params["tone"].as_string() == tone,
+        AdGeneration.generation_params["max_length"].as_integer() == max_length,
+        AdGeneration.product_text.isnot(None),
+        AdGeneration.product_text != "",
+        AdGeneration.embedding.isnot(None)
+    ).order_by(AdGeneration.created_at.desc()).limit(limit).all()
+
+
+NEAREST_AD_GENERATIONS_SQL = text("""
+    SELECT q.position, nearest.id, nearest.product_text, nearest.generated_text, 1 - nearest.distance AS score
+    FROM unnest(CAST(:positions AS integer[]), CAST(:embeddings AS text[])) AS q(position, embedding)
+    CROSS JOIN LATERAL (
+        SELECT g.id, g.product_text, g.generated_text, g.embedding <=> CAST(q.embedding AS vector) AS distance
+        FROM ad_generations AS g
+        WHERE g.user_id = :user_id
+          AND g.platform = :platform
+          AND g.embedding_model = :embedding_model
+          AND g.generation_params ->> 'tone' = :tone
+          AND CAST(g.generation_params ->> 'max_length' AS integer) = :max_length
+          AND g.embedding <=> CAST(q.embedding AS vector) >= :min_distance
+        ORDER BY distance
+        LIMIT 1
+    ) AS nearest
+""")
+
+
+def get_nearest_ad_generations(db: Session, user_id: int, platform: str, tone: str, max_length: int,
+                               embedding_model: str, embeddings: List[List[float]],
+                               max_score: float) -> Dict[int, Tuple[int, str, str, float]]:
+    """
+    For each of `embeddings`, the user's generation for the same platform, tone and max
+    length whose embedding is nearest by cosine similarity, ignoring any scoring above
+    `max_score`. One query for all of them. Returns {position in embeddings: (generation id,
+    product text, ad text, similarity)}; positions with no generation are left out. pgvector only.
+    """
+    if not embeddings:
+        return {}
+    rows = db.execute(NEAREST_AD_GENERATIONS_SQL, {
+        "positions": list(range(len(embeddings))),
+        "embeddings": ["[" + ",".join(map(str, embedding)) + "]" for embedding in embeddings],
+        "user_id": user_id,
+        "platform": platform,
+        "embedding_model": embedding_model,
+        "tone": tone,
+        "max_length": max_length,
+        "min_distance": 1.0 - max_score,
+    })
+    return {
+        position: (generation_id, product_text, generated_text, float(score))
+        for position, generation_id, product_text, generated_text, score in rows
+    }
+
+
+# SheetHeaderMapping CRUD operations
+def get_sheet_header_mapping(db: Session, spreadsheet_id: str, header_range: str) -> Optional[SheetHeaderMapping]:
+    return db.query(SheetHeaderMapping).filter(
+        SheetHeaderMapping.spreadsheet_id == spreadsheet_id,
+        SheetHeaderMapping.header_range == header_range
+    ).first()
+
+
+def get_latest_sheet_header_mapping(db: Session, spreadsheet_id: str) -> Optional[SheetHeaderMapping]:
+    return db.query(SheetHeaderMapping).filter(
+        SheetHeaderMapping.spreadsheet_id == spreadsheet_id
+    ).order_by(SheetHeaderMapping.updated_at.desc()).first()
+
+
+def upsert_sheet_header_mapping(db: Session, spreadsheet_id: str, header_range: str, sheet_name: Optional[str],
+                                header_row: int, headers: List[str], column_roles: Dict[str, int],
+                                last_data_range: Optional[str] = None) -> SheetHeaderMapping:
+    db_mapping = get_sheet_header_mapping(db, spreadsheet_id, header_range)
+    if db_mapping is None:
+        db_mapping = SheetHeaderMapping(spreadsheet_id=spreadsheet_id, header_range=header_range)
+        db.add(db_mapping)
+    db_mapping.sheet_name = sheet_name
+    db_mapping.header_row = header_row
+    db_mapping.headers = headers
+    db_mapping.column_roles = column_roles
+    if last_data_range:
+        db_mapping.last_data_range = last_data_range
+    db.commit()
+    db.refresh(db_mapping)
+    return db_mapping
+
+
+# IdempotencyRecord CRUD operations
+def get_idempotency_record(db: Session, key: str) -> Optional[IdempotencyRecord]:
+    return db.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).first()
+
+
+def claim_idempotency_key(db: Session, key: str, lease_seconds: float) -> bool:
+    """
+    Marks `key` as in progress for `lease_seconds`. Returns False if another request holds
+    an unexpired claim or a completed result for it. An expired record is taken over.
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=lease_seconds)
+    db.add(IdempotencyRecord(key=key, status="in_progress", expires_at=expires_at))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+    # The primary key already exists: only take it over if it expired (conditional, so one claimer wins).
+    taken_over = db.query(IdempotencyRecord).filter(
+        IdempotencyRecord.key == key,
+        IdempotencyRecord.expires_at < now
+    ).update({"status": "in_progress", "response": None, "expires_at": expires_at}, synchronize_session=False)
+    db.commit()
+    return taken_over == 1
+
+
+def complete_idempotency_key(db: Session, key: str, response: Dict[str, Any], replay_seconds: float) -> None:
+    db.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).update({
+        "status": "completed",
+        "response": response,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=replay_seconds),
+    }, synchronize_session=False)
+    db.commit()
+
+
+def release_idempotency_key(db: Session, key: str) -> None:
+    db.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).delete(synchronize_session=False)
+    db.commit()
+
+
+def delete_expired_idempotency_records(db: Session) -> int:
+    deleted = db.query(IdempotencyRecord).filter(
+        IdempotencyRecord.expires_at < datetime.now(timezone.utc)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
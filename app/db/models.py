@@ -1,12 +1,26 @@
 from sqlalchemy import (JSON, Boolean, Column, DateTime, Float, ForeignKey,
-                        Integer, String, Text)
+                        Index, Integer, LargeBinary, String, Text,
+                        UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
+from app.core.config import settings
+
 Base = declarative_base()
 
 
+def _embedding_type():
+    """
+    pgvector's vector type when SIMILARITY_INDEX_BACKEND is "pgvector" (needs the vector
+    extension in Postgres and the pgvector package), else float32 bytes.
+    """
+    if settings.SIMILARITY_INDEX_BACKEND == "pgvector":
+        from pgvector.sqlalchemy import Vector
+        return Vector(settings.VECTOR_DIMENSION)
+    return LargeBinary
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -18,6 +32,8 @@ class User(Base):
     is_superuser = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True), nullable=True)
+    token_budget = Column(Integer, nullable=True)  # Overrides USER_TOKEN_BUDGET for this user
+    google_sub = Column(String, unique=True, index=True, nullable=True)  # Google account ID of add-on users
 
     products = relationship("Product", back_populates="user")
     ad_generations = relationship("AdGeneration", back_populates="user")
@@ -54,14 +70,56 @@ class ScrapedData(Base):
 
 class AdGeneration(Base):
     __tablename__ = "ad_generations"
+    __table_args__ = (
+        Index("ix_ad_generations_user_created", "user_id", "created_at"),
+        Index("ix_ad_generations_spreadsheet_created", "spreadsheet_id", "created_at"),
+        Index("ix_ad_generations_similarity", "user_id", "platform", "embedding_model", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
+    spreadsheet_id = Column(String, nullable=True)  # Set for ads generated from a sheet
     generated_text = Column(Text)
     generation_params = Column(JSON)
     platform = Column(String, default="Facebook")
+    # Token usage and latency of the model call(s) behind this generation, from usage_metadata
+    model = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    tool_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    latency_seconds = Column(Float, nullable=True)
+    # The row's prompt JSON and its embedding, for reusing this ad on similar products (app.services.similarity)
+    product_text = Column(Text, nullable=True)
+    embedding = Column(_embedding_type(), nullable=True)
+    embedding_model = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="ad_generations")
     product = relationship("Product", back_populates="ad_generations")
+
+
+class SheetHeaderMapping(Base):
+    __tablename__ = "sheet_header_mappings"
+    __table_args__ = (UniqueConstraint("spreadsheet_id", "header_range", name="uq_sheet_header_mapping"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    spreadsheet_id = Column(String, index=True, nullable=False)
+    sheet_name = Column(String, nullable=True)
+    header_range = Column(String, nullable=False)
+    header_row = Column(Integer, nullable=False)
+    headers = Column(JSON, nullable=False)
+    column_roles = Column(JSON, nullable=False)  # role -> 0-indexed column within header_range
+    last_data_range = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+
+    key = Column(String(64), primary_key=True)  # sha256 of (user, spreadsheet, form inputs)
+    status = Column(String, nullable=False)  # "in_progress" or "completed"
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -1,19 +1,36 @@
+import asyncio
 import logging  # Import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 
 from app.api import gws_router  # Import the new GWS router
-from app.api import auth
-
-# from app.core.config import settings  # Commented out for now as unused
+from app.api import admin, auth, export
+from app.core import metrics, warmup
+from app.core.config import settings
+from app.core.profiling import ProfilingMiddleware
+from app.core.responses import DefaultJSONResponse
+from app.core.security import shutdown_hash_pool
 
 # Configure basic logging to show INFO level messages
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-app = FastAPI(title="Ads Text Generator")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy SDK imports and client construction happen off the event loop after the
+    # worker starts accepting connections; /ready reports when they are done.
+    warmup_task = asyncio.create_task(asyncio.to_thread(warmup.run_warmup))
+    yield
+    warmup_task.cancel()
+    shutdown_hash_pool()
+
+
+app = FastAPI(title="Ads Text Generator", lifespan=lifespan, default_response_class=DefaultJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -23,9 +40,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Cards are a few KB of JSON; gzip them for clients that accept it
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE_BYTES, compresslevel=settings.GZIP_COMPRESS_LEVEL)
+# Opt-in request profiler (PROFILER_ENABLED): stack samples of sampled requests, task snapshots of slow ones
+app.add_middleware(ProfilingMiddleware)
 
 # Include routers
 app.include_router(auth.router, prefix="/api/v1", tags=["auth"])
+app.include_router(admin.router, prefix="/api/v1", tags=["admin"])
+app.include_router(export.router, prefix="/api/v1", tags=["export"])
 app.include_router(gws_router.router)  # Add the GWS router
 
 
@@ -37,3 +60,14 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+
+@app.get("/ready")
+def readiness_check():
+    report = warmup.state.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,152 @@
+import logging
+import re
+from collections import Counter
+from typing import Dict, Optional
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# max_length is only a hint in the prompt and the model often overshoots it. Single-ad
+# responses are streamed so they can be cut short (StreamCutoff), and ads still over
+# length are fixed locally where possible (trim_to_sentences) before falling back to a
+# short repair call, instead of a full regenerate with search.
+
+SENTENCE_END = re.compile(r"[.!?](?:\s|$)")
+STRATEGY_LINE = re.compile(r"^\s*\**strategy\**\s*:.*\n", re.IGNORECASE | re.MULTILINE)
+CHARS_PER_TOKEN = 4  # Rough estimate for text the model never sent
+
+
+def within_length(text: str, max_length: int) -> bool:
+    """Ads up to AD_LENGTH_TOLERANCE x max_length count as the requested length."""
+    return len(text) <= max_length * settings.AD_LENGTH_TOLERANCE
+
+
+class StreamCutoff:
+    """
+    Watches a single-ad response as it streams in and says when the rest is not worth
+    waiting (and paying) for: the ad has run past AD_STREAM_OVERSHOOT_FACTOR x max_length
+    without reaching the separator, or the reference note after it is complete (its
+    "Strategy:" line has ended) or has reached AD_STREAM_REFERENCE_MAX_CHARS.
+    """
+
+    def __init__(self, max_length: int, separator: str):
+        self.max_length = max_length
+        self.separator = separator
+
+    def check(self, text: str) -> Optional[str]:
+        ad_text, separator, reference = text.partition(self.separator)
+        if not separator:
+            if len(ad_text.strip()) > self.max_length * settings.AD_STREAM_OVERSHOOT_FACTOR:
+                return "ad_too_long"
+            return None
+        if STRATEGY_LINE.search(reference):
+            return "reference_complete"
+        if len(reference.strip()) >= settings.AD_STREAM_REFERENCE_MAX_CHARS:
+            return "reference_too_long"
+        return None
+
+
+def finish_reference(reference: str) -> str:
+    """A reference note cut off by StreamCutoff, ending at its "Strategy:" line or last whole sentence."""
+    strategy_line = STRATEGY_LINE.search(reference)
+    if strategy_line:
+        return reference[:strategy_line.end()].strip()
+    return trim_to_sentences(reference, len(reference)) or reference.strip()
+
+
+def strip_partial_separator(text: str, separator: str) -> str:
+    """Drops the start of a separator left at the end of text by a stream cut mid-separator."""
+    for size in range(min(len(separator), len(text)), 0, -1):
+        if text.endswith(separator[:size]):
+            return text[:-size].rstrip()
+    return text
+
+
+def trim_to_sentences(text: str, max_length: int) -> Optional[str]:
+    """
+    The longest run of whole leading sentences that fits in max_length, if it keeps at
+    least AD_LOCAL_TRIM_MIN_RATIO of max_length (shorter would lose too much of the ad).
+    """
+    end = None
+    for match in SENTENCE_END.finditer(text):
+        if match.start() + 1 > max_length:
+            break
+        end = match.start() + 1
+    if end is None or end < max_length * settings.AD_LOCAL_TRIM_MIN_RATIO:
+        return None
+    return text[:end].strip()
+
+
+def truncate_at_word(text: str, max_length: int) -> str:
+    """Last resort: cuts at the last word boundary that leaves room for an ellipsis."""
+    if len(text) <= max_length:
+        return text
+    cut = text[:max_length - 1].rsplit(None, 1)[0] if " " in text[:max_length - 1] else text[:max_length - 1]
+    return cut.rstrip(" ,;:-") + "…"
+
+
+class StreamBaseline:
+    """Moving average of output tokens and seconds of streamed responses that ran to completion, per model."""
+
+    ALPHA = 0.1
+
+    def __init__(self) -> None:
+        self.output_tokens: Dict[str, float] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def record(self, model: str, output_tokens: float, seconds: float) -> None:
+        if model not in self.output_tokens:
+            self.output_tokens[model], self.seconds[model] = output_tokens, seconds
+            return
+        self.output_tokens[model] += self.ALPHA * (output_tokens - self.output_tokens[model])
+        self.seconds[model] += self.ALPHA * (seconds - self.seconds[model])
+
+
+baseline = StreamBaseline()
+
+
+class StreamStats:
+    """
+    Per-batch tally of streams cut short and ads repaired, with the output tokens and
+    seconds saved. Savings are estimates: a cut-short stream saved whatever a complete
+    response from the same model usually adds on top of what was received (StreamBaseline).
+    """
+
+    def __init__(self) -> None:
+        self.cutoffs: Counter = Counter()
+        self.repairs: Counter = Counter()
+        self.saved_output_tokens = 0.0
+        self.saved_seconds = 0.0
+
+    def record_stream(self, model: str, text: str, seconds: float, cutoff_reason: Optional[str]) -> None:
+        output_tokens = len(text) / CHARS_PER_TOKEN
+        if cutoff_reason is None:
+            baseline.record(model, output_tokens, seconds)
+            return
+        self.cutoffs[cutoff_reason] += 1
+        metrics.increment("ai_stream_cutoffs_total", model=model, reason=cutoff_reason)
+        if model in baseline.output_tokens:
+            saved_tokens = max(0.0, baseline.output_tokens[model] - output_tokens)
+            saved_seconds = max(0.0, baseline.seconds[model] - seconds)
+            self.saved_output_tokens += saved_tokens
+            self.saved_seconds += saved_seconds
+            metrics.increment("ai_stream_saved_output_tokens_total", saved_tokens, model=model)
+            metrics.increment("ai_stream_saved_seconds_total", saved_seconds, model=model)
+
+    def record_repair(self, method: str) -> None:
+        self.repairs[method] += 1
+        metrics.increment("ad_length_repairs_total", method=method)
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "cutoffs": dict(self.cutoffs),
+            "repairs": dict(self.repairs),
+            "saved_output_tokens": round(self.saved_output_tokens),
+            "saved_seconds": round(self.saved_seconds, 1),
+        }
+
+    def log_summary(self, prefix: Optional[str] = None) -> None:
+        if self.cutoffs or self.repairs:
+            logger.info(f"{prefix or 'Stream stats'}: {self.summary()}")
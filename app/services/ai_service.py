@@ -1,155 +1,959 @@
+import asyncio
 import json
 import logging
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import (TYPE_CHECKING, Any, Awaitable, Callable, Dict, List,
+                    Mapping, Optional, Tuple, TypeVar, Union)
 
-from google import genai
-from google.genai import types
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from app.core import metrics
 from app.core.config import settings
+from app.core.deadline import Deadline
+from app.services.ad_length import (StreamCutoff, StreamStats,
+                                    finish_reference, strip_partial_separator,
+                                    trim_to_sentences, truncate_at_word,
+                                    within_length)
+from app.services.batch_prediction import (BatchBackend, get_batch_backend,
+                                           run_batch_job)
+from app.services.fair_scheduler import priority_for, scheduler
+from app.services.gemini_resilience import CircuitOpenError, resilient_call
+from app.services.model_routing import (ModelRoute, RouteStats, choose_route,
+                                        get_route)
+from app.services.similarity import SimilarAd
+from app.services.usage import BatchUsage, CallUsage
+from app.utils.row_batch import RowBatch, RowView
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
 logger = logging.getLogger(__name__)
 
-client = genai.Client(api_key=settings.GEMINI_API_KEY)
+T = TypeVar("T")
+# Batch inputs: a columnar RowBatch, or the older list of {header: value} dicts.
+ProductRows = Union[RowBatch, List[Dict[str, str]]]
+
 PROMPT_DIR = Path(__file__).parent.parent / "prompts"
 
 
+@lru_cache(maxsize=None)
 def load_prompt_template(template_name: str) -> str:
     try:
         with open(PROMPT_DIR / template_name, "r", encoding="utf-8") as f:
             return f.read()
     except FileNotFoundError:
         logger.error(f"Prompt template '{template_name}' not found in {PROMPT_DIR}")
-        return "Error: Prompt template not found."
+        return TEMPLATE_NOT_FOUND
+
+
+# The google-genai SDK is slow to import, so it is loaded (and the client built) on first
+# use or by the startup warm-up (app/core/warmup.py), never at module import.
+@lru_cache(maxsize=None)
+def get_client() -> "genai.Client":
+    from google import genai
+    return genai.Client(api_key=settings.GEMINI_API_KEY)
+
 
+@lru_cache(maxsize=None)
+def get_safety_settings() -> List["types.SafetySetting"]:
+    from google.genai import types
+    return [
+        types.SafetySetting(category=category, threshold=types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE)
+        for category in (
+            types.HarmCategory.HARM_CATEGORY_HARASSMENT,
+            types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+            types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+            types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        )
+    ]
 
-SAFETY_SETTINGS = {
-    types.HarmCategory.HARM_CATEGORY_HARASSMENT: types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: types.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-}
 
-google_search_tool = types.Tool(google_search=types.GoogleSearch())
+@lru_cache(maxsize=None)
+def get_google_search_tool() -> "types.Tool":
+    from google.genai import types
+    return types.Tool(google_search=types.GoogleSearch())
 
 AD_TEXT_FALLBACK = "Could not generate ad text. Please check product details or try again later."
 REFERENCE_FALLBACK = "No reference strategy available."
 RESPONSE_SEPARATOR = "---REFERENCE_STRATEGY_SEPARATOR---"
+CIRCUIT_OPEN_REFERENCE = "Skipped: the AI service is temporarily unavailable. Please try again in a minute."
+TEMPLATE_NOT_FOUND = "Error: Prompt template not found."
+ROW_PROMPT_TEMPLATE = "ad_row_template.txt"  # The per-row part of every prompt: just the product JSON
+LENGTH_REPAIR_TEMPLATE = "ad_length_repair_system.txt"
+ADAPT_TEMPLATE = "ad_adapt_system.txt"
+ADAPT_ROW_TEMPLATE = "ad_adapt_row_template.txt"
+FAILURE_PREFIXES = ("Ad generation blocked:", "Ad generation failed:")  # See _empty_response_failure
+CHARS_PER_TOKEN = 4  # Rough estimate, only used to skip context caching for short prefixes
+
+
+class PromptPrefix:
+    """
+    The static part of a batch's prompt (instructions, platform, tone, length), sent as
+    the system instruction so each row only sends its product JSON. When the prefix is
+    long enough for Gemini's explicit context cache (PROMPT_CONTEXT_CACHE_MIN_TOKENS), it
+    is registered once per model as cached content and reused by every row; close()
+    deletes those caches when the batch ends. Also tallies prompt/cached token usage.
+    Routes without Google Search get `direct_instruction`, when given, which does not ask
+    for searches or search queries.
+    """
+
+    def __init__(self, system_instruction: str, use_context_cache: bool = False,
+                 direct_instruction: Optional[str] = None):
+        self.system_instruction = system_instruction
+        self.direct_instruction = direct_instruction
+        self.use_context_cache = use_context_cache and settings.PROMPT_CONTEXT_CACHE_ENABLED
+        self._cache_names: Dict[str, Optional[str]] = {}  # model -> cached content name (None: not cached)
+        self._cache_locks: Dict[str, asyncio.Lock] = {}
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def instruction_for(self, route: ModelRoute) -> str:
+        if not route.use_search and self.direct_instruction is not None:
+            return self.direct_instruction
+        return self.system_instruction
+
+    def _cacheable(self, route: ModelRoute) -> bool:
+        estimated_tokens = len(self.instruction_for(route)) / CHARS_PER_TOKEN
+        return self.use_context_cache and estimated_tokens >= settings.PROMPT_CONTEXT_CACHE_MIN_TOKENS
+
+    async def _cached_content_name(self, route: ModelRoute) -> Optional[str]:
+        # Cached content is bound to one model and carries the tools, so it is keyed per route.
+        lock = self._cache_locks.setdefault(route.name, asyncio.Lock())
+        async with lock:
+            if route.name not in self._cache_names:
+                from google.genai import types
+                try:
+                    cache = await get_client().aio.caches.create(
+                        model=f'models/{route.model}',
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=self.instruction_for(route),
+                            tools=[get_google_search_tool()] if route.use_search else None,
+                            ttl=f"{settings.PROMPT_CONTEXT_CACHE_TTL_SECONDS}s",
+                            display_name="ad-batch-prompt-prefix",
+                        )
+                    )
+                    logger.info(f"Registered prompt prefix as cached content {cache.name} for model {route.model}.")
+                    self._cache_names[route.name] = cache.name
+                except Exception as e:
+                    logger.warning(f"Context caching unavailable for model {route.model}, sending system instruction instead: {e}")
+                    self._cache_names[route.name] = None
+        return self._cache_names[route.name]
+
+    async def generation_config(self, route: ModelRoute) -> "types.GenerateContentConfig":
+        from google.genai import types
+        cache_name = await self._cached_content_name(route) if self._cacheable(route) else None
+        if cache_name:
+            # System instruction and tools live in the cache; the request may not repeat them.
+            return types.GenerateContentConfig(cached_content=cache_name, safety_settings=get_safety_settings())
+        return types.GenerateContentConfig(
+            system_instruction=self.instruction_for(route),
+            tools=[get_google_search_tool()] if route.use_search else None,
+            safety_settings=get_safety_settings()
+        )
+
+    def record_usage(self, response: "types.GenerateContentResponse", route: ModelRoute) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_token_count or 0
+        cached_tokens = usage.cached_content_token_count or 0  # Explicit or implicit cache hits
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        metrics.observe("ai_prompt_tokens", prompt_tokens, model=route.model)
+        metrics.observe("ai_cached_prompt_tokens", cached_tokens, model=route.model)
+
+    def log_summary(self, prefix: str) -> None:
+        if not self.calls:
+            return
+        logger.info(
+            f"{prefix}: {self.calls} calls, {self.prompt_tokens} prompt tokens, "
+            f"{self.cached_tokens} served from cache ({self.cached_tokens / self.calls:.0f} input tokens saved per row)."
+        )
+
+    async def close(self) -> None:
+        for cache_name in filter(None, self._cache_names.values()):
+            try:
+                await get_client().aio.caches.delete(name=cache_name)
+            except Exception as e:
+                # It expires on its own after PROMPT_CONTEXT_CACHE_TTL_SECONDS.
+                logger.warning(f"Could not delete cached content {cache_name}: {e}")
+        self._cache_names.clear()
+
+
+def _row_prompt(product_row_data: Mapping[str, str], product_data_dict_str: Optional[str]) -> str:
+    if product_data_dict_str is None:
+        product_data_dict_str = json.dumps(dict(product_row_data), indent=2)
+    return load_prompt_template(ROW_PROMPT_TEMPLATE).format(product_data_dict_str=product_data_dict_str)
+
+
+def ad_text_prompt_prefix(platform: str, tone: str, max_length: int, use_context_cache: bool = False) -> Optional[PromptPrefix]:
+    """The per-batch prefix for generate_ad_text_with_search; None if a template is missing."""
+    template = load_prompt_template("ad_generation_system.txt")
+    direct_template = load_prompt_template("ad_generation_direct_system.txt")
+    if TEMPLATE_NOT_FOUND in (template, direct_template):
+        return None
+    return PromptPrefix(
+        template.format(platform=platform, tone=tone, max_length=max_length), use_context_cache,
+        direct_instruction=direct_template.format(platform=platform, tone=tone, max_length=max_length)
+    )
+
+
+def ad_variants_prompt_prefix(
+    platforms: List[str], variants: int, tone: str, max_length: int, use_context_cache: bool = False
+) -> Optional[PromptPrefix]:
+    """The per-batch prefix for generate_ad_variants_with_search; None if a template is missing."""
+    template = load_prompt_template("ad_variants_system.txt")
+    direct_template = load_prompt_template("ad_variants_direct_system.txt")
+    if TEMPLATE_NOT_FOUND in (template, direct_template):
+        return None
+    fields = dict(platforms_list=", ".join(platforms), variants=variants, tone=tone, max_length=max_length)
+    return PromptPrefix(
+        template.format(**fields), use_context_cache, direct_instruction=direct_template.format(**fields)
+    )
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """Errors that mean Gemini itself is unhealthy (5xx, rate limiting, timeouts), not a bad request."""
+    from google.genai import errors
+    if isinstance(error, errors.ServerError):
+        return True
+    if isinstance(error, errors.APIError):
+        return error.code == 429
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+
+async def _call_model(
+    prompt: str,
+    route: ModelRoute,
+    prompt_prefix: PromptPrefix,
+    route_stats: Optional[RouteStats] = None,
+    usage: Optional[CallUsage] = None
+) -> "types.GenerateContentResponse":
+    """
+    Sends one row's prompt, after the batch's shared prefix, to the model/tool configuration
+    selected by `route`. Token counts and latency are added to `usage` when given.
+    """
+    generation_config = await prompt_prefix.generation_config(route)
+
+    started_at = time.perf_counter()
+    # Hedged against slow tails and guarded by a per-model circuit breaker; raises
+    # CircuitOpenError without calling Gemini while the model is failing.
+    response = await resilient_call(
+        lambda: get_client().aio.models.generate_content(
+            model=f'models/{route.model}',
+            contents=prompt,
+            config=generation_config
+        ),
+        name=route.model,
+        is_upstream_failure=_is_upstream_failure
+    )
+    _record_call(response, route, prompt_prefix, route_stats, usage, time.perf_counter() - started_at)
+    return response
+
+
+def _record_call(
+    response: Optional["types.GenerateContentResponse"],
+    route: ModelRoute,
+    prompt_prefix: PromptPrefix,
+    route_stats: Optional[RouteStats],
+    usage: Optional[CallUsage],
+    latency_seconds: float
+) -> None:
+    if route_stats is not None:
+        route_stats.record(route.name, latency_seconds)
+    if usage is not None:
+        usage.record(response, route.model, latency_seconds)
+    if response is not None:
+        prompt_prefix.record_usage(response, route)
+
+
+def _chunk_text(chunk: "types.GenerateContentResponse") -> str:
+    if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+        return "".join(part.text or "" for part in chunk.candidates[0].content.parts)
+    return ""
+
+
+async def _stream_model(
+    prompt: str, route: ModelRoute, generation_config: "types.GenerateContentConfig", cutoff: StreamCutoff
+) -> Tuple[Optional["types.GenerateContentResponse"], str, Optional[str]]:
+    """
+    Streams a response until it ends or `cutoff` says to stop, closing the stream early
+    in that case. Returns (last chunk, text so far, cutoff reason or None).
+    """
+    stream = await get_client().aio.models.generate_content_stream(
+        model=f'models/{route.model}',
+        contents=prompt,
+        config=generation_config
+    )
+    last_chunk, text, cutoff_reason = None, "", None
+    try:
+        async for chunk in stream:
+            last_chunk = chunk
+            text += _chunk_text(chunk)
+            cutoff_reason = cutoff.check(text)
+            if cutoff_reason:
+                break
+    finally:
+        await stream.aclose()  # Closes the HTTP stream, so the model stops generating
+    return last_chunk, text, cutoff_reason
+
+
+async def _call_model_streaming(
+    prompt: str,
+    route: ModelRoute,
+    prompt_prefix: PromptPrefix,
+    cutoff: StreamCutoff,
+    route_stats: Optional[RouteStats] = None,
+    usage: Optional[CallUsage] = None,
+    stream_stats: Optional[StreamStats] = None
+) -> Tuple[Optional["types.GenerateContentResponse"], str, Optional[str]]:
+    """
+    _call_model with a streamed response that `cutoff` can end early. Returns (last chunk,
+    which carries usage, finish reason and grounding metadata; full text; cutoff reason).
+    """
+    generation_config = await prompt_prefix.generation_config(route)
+
+    started_at = time.perf_counter()
+    last_chunk, text, cutoff_reason = await resilient_call(
+        lambda: _stream_model(prompt, route, generation_config, cutoff),
+        name=route.model,
+        is_upstream_failure=_is_upstream_failure
+    )
+    latency_seconds = time.perf_counter() - started_at
+    _record_call(last_chunk, route, prompt_prefix, route_stats, usage, latency_seconds)
+    if stream_stats is not None:
+        stream_stats.record_stream(route.model, text, latency_seconds, cutoff_reason)
+    return last_chunk, text, cutoff_reason
+
+
+async def _repair_length(
+    ad_text: str, max_length: int, platform: str, tone: str, usage: Optional[CallUsage]
+) -> Optional[str]:
+    """Asks AD_REPAIR_MODEL, without search, to shorten an ad. None if the call fails."""
+    template = load_prompt_template(LENGTH_REPAIR_TEMPLATE)
+    if template == TEMPLATE_NOT_FOUND:
+        return None
+    route = ModelRoute(name="length_repair", model=settings.AD_REPAIR_MODEL, use_search=False)
+    prompt_prefix = PromptPrefix(template.format(platform=platform, tone=tone, max_length=max_length))
+    try:
+        response = await _call_model(ad_text, route, prompt_prefix, usage=usage)
+    except Exception as e:
+        logger.warning(f"Length repair call failed: {e}")
+        return None
+    return _extract_response_text(response, "length repair") or None
+
+
+async def _fit_to_length(
+    ad_text: str,
+    max_length: int,
+    platform: str,
+    tone: str,
+    usage: Optional[CallUsage],
+    stream_stats: Optional[StreamStats],
+) -> str:
+    """
+    Brings an over-length ad within max_length: whole leading sentences when they keep
+    enough of it, else a repair call, else a cut at a word boundary.
+    """
+    if not settings.AD_LENGTH_REPAIR_ENABLED or within_length(ad_text, max_length):
+        return ad_text
+    method, fitted = "trim", trim_to_sentences(ad_text, max_length)
+    if fitted is None:
+        method, fitted = "model", await _repair_length(ad_text, max_length, platform, tone, usage)
+        if fitted is not None and not within_length(fitted, max_length):
+            fitted = trim_to_sentences(fitted, max_length) or truncate_at_word(fitted, max_length)
+    if fitted is None:
+        method, fitted = "truncate", truncate_at_word(ad_text, max_length)
+    if stream_stats is not None:
+        stream_stats.record_repair(method)
+    logger.info(f"Fitted a {len(ad_text)}-character ad to {len(fitted)} characters ({method}); limit {max_length}.")
+    return fitted
+
+
+def _extract_response_text(response: "types.GenerateContentResponse", product_name_for_log: str) -> str:
+    full_response_text = ""
+    if getattr(response, 'parts', None):
+        full_response_text = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
+    elif hasattr(response, 'text') and response.text:
+        full_response_text = response.text.strip()
+    else:
+        logger.warning(f"Primary text extraction failed for {product_name_for_log}. Checking candidates. Response: {response}")
+        if response.candidates and response.candidates[0].content.parts:
+            full_response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
+    return full_response_text
+
+
+def _empty_response_failure(response: "types.GenerateContentResponse", product_name_for_log: str) -> str:
+    """Logs why a response carried no text and returns the ad-text fallback to show the user."""
+    from google.genai import types
+    logger.error(f"Failed to generate ad text for {product_name_for_log}. Response: {response}")
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        reason_msg = response.prompt_feedback.block_reason_message or "Safety block"
+        logger.error(f"Prompt blocked for {product_name_for_log}. Reason: {reason_msg}")
+        return f"Ad generation blocked: {reason_msg}"
+    if response.candidates and response.candidates[0].finish_reason:
+        finish_reason_val = response.candidates[0].finish_reason
+        finish_reason_str = types.FinishReason(finish_reason_val).name if isinstance(finish_reason_val, int) else str(finish_reason_val)
+        logger.error(f"Generation finished for {product_name_for_log} with reason: {finish_reason_str}")
+        if finish_reason_val != types.FinishReason.STOP:
+            return f"Ad generation failed: {finish_reason_str}"
+    return AD_TEXT_FALLBACK
+
+
+def _log_grounding_metadata(response: "types.GenerateContentResponse", product_name_for_log: str) -> None:
+    if response.candidates and hasattr(response.candidates[0], 'grounding_metadata') and response.candidates[0].grounding_metadata:
+        metadata = response.candidates[0].grounding_metadata
+        if hasattr(metadata, 'web_search_queries') and metadata.web_search_queries:
+            logger.info(f"Grounding web_search_queries for {product_name_for_log}: {metadata.web_search_queries}")
+        elif hasattr(metadata, 'search_entry_point') and metadata.search_entry_point:
+            rendered_query = getattr(metadata.search_entry_point, 'rendered_query', 'N/A')
+            logger.info(f"Grounding search_entry_point query for {product_name_for_log}: {rendered_query}")
+
+
+def _as_row_batch(products_data: ProductRows) -> RowBatch:
+    return products_data if isinstance(products_data, RowBatch) else RowBatch.from_dicts(products_data)
+
+
+def _product_name_for_log(product_row_data: Mapping[str, str], default: str = "Unknown Product from Row") -> str:
+    """Uses the batch's resolved name column when available instead of guessing header names."""
+    if isinstance(product_row_data, RowView):
+        return product_row_data.role("name") or default
+    return product_row_data.get("Product Name", product_row_data.get("Name", default))
+
+
+def split_ad_response(full_response_text: str) -> Tuple[str, str]:
+    """Splits a response into (ad_text, reference_strategy) at RESPONSE_SEPARATOR."""
+    ad_text, separator, reference_strategy = full_response_text.partition(RESPONSE_SEPARATOR)
+    if not separator:
+        return full_response_text.strip(), REFERENCE_FALLBACK
+    return ad_text.strip(), reference_strategy.strip()
+
+
+def is_usable_ad(ad_text: str) -> bool:
+    """False for the fallback and failure texts returned in place of an ad."""
+    return ad_text != AD_TEXT_FALLBACK and not ad_text.startswith(FAILURE_PREFIXES)
+
+
+def adapt_prompt_prefix(platform: str, tone: str, max_length: int) -> Optional[PromptPrefix]:
+    """The per-batch prefix for adapt_similar_ad; None if the template is missing."""
+    template = load_prompt_template(ADAPT_TEMPLATE)
+    if template == TEMPLATE_NOT_FOUND or load_prompt_template(ADAPT_ROW_TEMPLATE) == TEMPLATE_NOT_FOUND:
+        return None
+    return PromptPrefix(template.format(platform=platform, tone=tone, max_length=max_length))
+
+
+async def adapt_similar_ad(
+    product_row_data: Mapping[str, str],
+    similar_ad: SimilarAd,
+    prompt_prefix: PromptPrefix,
+    platform: str,
+    tone: str,
+    max_length: int,
+    product_data_dict_str: Optional[str] = None,
+    usage: Optional[CallUsage] = None,
+    stream_stats: Optional[StreamStats] = None
+) -> Optional[Tuple[str, str]]:
+    """
+    Rewrites a similar past product's ad for this row with SIMILARITY_ADAPT_MODEL and no
+    search. Returns (ad_text, reference_strategy), or None if the call fails or comes back
+    empty, so the caller can fall back to a full generation.
+    """
+    product_name_for_log = _product_name_for_log(product_row_data)
+    prompt = load_prompt_template(ADAPT_ROW_TEMPLATE).format(
+        reference_product=similar_ad.product_text,
+        reference_ad=similar_ad.ad_text,
+        product_data_dict_str=product_data_dict_str or json.dumps(dict(product_row_data), indent=2)
+    )
+    route = ModelRoute(name="similar_adapt", model=settings.SIMILARITY_ADAPT_MODEL, use_search=False)
+    try:
+        response = await _call_model(prompt, route, prompt_prefix, usage=usage)
+    except Exception as e:
+        logger.warning(f"Adapting a similar product's ad for {product_name_for_log} failed: {e}")
+        return None
+    ad_text = _extract_response_text(response, product_name_for_log)
+    if not ad_text:
+        return None
+    ad_text = await _fit_to_length(ad_text, max_length, platform, tone, usage, stream_stats)
+    logger.info(f"Adapted ad for {product_name_for_log} from a similar product (similarity {similar_ad.score:.2f}): {ad_text}")
+    source = f"generation {similar_ad.generation_id}" if similar_ad.generation_id is not None else "a recent run"
+    return ad_text, f"Adapted from the ad of a similar product ({source}, similarity {similar_ad.score:.2f})."
 
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
 async def generate_ad_text_with_search(
-    product_row_data: Dict[str, str],  # Input is now just the row data
+    product_row_data: Mapping[str, str],  # Input is now just the row data
     tone: str = "Professional",
     max_length: int = 150,
-    platform: str = "Facebook"
+    platform: str = "Facebook",
+    route: Optional[ModelRoute] = None,
+    route_stats: Optional[RouteStats] = None,
+    product_data_dict_str: Optional[str] = None,  # Pre-serialized row JSON (see RowBatch.to_prompt_fragments)
+    prompt_prefix: Optional[PromptPrefix] = None,  # Shared by a batch; built for this call if omitted
+    usage: Optional[CallUsage] = None,  # Receives this row's token usage (usage_metadata) and latency
+    stream_stats: Optional[StreamStats] = None  # Receives stream cutoffs and length repairs
 ) -> Tuple[str, str]:
     # Try to find a product name for logging, otherwise use a generic placeholder
-    product_name_for_log = product_row_data.get("Product Name", product_row_data.get("Name", "Unknown Product from Row"))
+    product_name_for_log = _product_name_for_log(product_row_data)
 
     try:
-        product_data_dict_str = json.dumps(product_row_data, indent=2)
-
-        prompt_template_str = load_prompt_template("ad_generation_template.txt")
-        if "Error: Prompt template not found." in prompt_template_str:
+        prompt_prefix = prompt_prefix or ad_text_prompt_prefix(platform, tone, max_length)
+        if prompt_prefix is None:
             logger.error(f"Ad generation failed for {product_name_for_log}: prompt template not found.")
             return AD_TEXT_FALLBACK, REFERENCE_FALLBACK
 
-        prompt = prompt_template_str.format(
-            platform=platform,
-            tone=tone,
-            max_length=max_length,
-            product_data_dict_str=product_data_dict_str
-        )
+        prompt = _row_prompt(product_row_data, product_data_dict_str)
 
-        model_name_for_tools = 'gemini-1.5-flash-latest'  # Using a model known for tool use and good with grounding
+        # Default to search grounding when the caller did not route the row.
+        route = route or get_route(settings.AD_ROUTE_FOR_THIN_ROWS)
 
-        logger.info(f"Generating ad for: {product_name_for_log} using model {model_name_for_tools}. Prompt (first 300 chars): {prompt[:300]}")
-
-        generation_config = types.GenerateContentConfig(
-            tools=[google_search_tool],
-            safety_settings=SAFETY_SETTINGS
-        )
-
-        response = await client.aio.models.generate_content(
-            model=f'models/{model_name_for_tools}',
-            contents=prompt,
-            generation_config=generation_config
-        )
+        logger.info(f"Generating ad for: {product_name_for_log} using route '{route.name}' (model {route.model}). Prompt (first 300 chars): {prompt[:300]}")
 
-        full_response_text = ""
-        if response.parts:
-            full_response_text = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
-        elif hasattr(response, 'text') and response.text:
-            full_response_text = response.text.strip()
+        cutoff_reason = None
+        if settings.AD_STREAMING_ENABLED:
+            # Streamed so a runaway ad or reference note can be cut off instead of waited for.
+            response, full_response_text, cutoff_reason = await _call_model_streaming(
+                prompt, route, prompt_prefix, StreamCutoff(max_length, RESPONSE_SEPARATOR),
+                route_stats, usage, stream_stats
+            )
+            full_response_text = full_response_text.strip()
         else:
-            logger.warning(f"Primary text extraction failed for {product_name_for_log}. Checking candidates. Response: {response}")
-            if response.candidates and response.candidates[0].content.parts:
-                full_response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
-
+            response = await _call_model(prompt, route, prompt_prefix, route_stats, usage)
+            full_response_text = _extract_response_text(response, product_name_for_log)
         if not full_response_text:
-            logger.error(f"Failed to generate ad text for {product_name_for_log}. Response: {response}")
-            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                reason_msg = response.prompt_feedback.block_reason_message or "Safety block"
-                logger.error(f"Prompt blocked for {product_name_for_log}. Reason: {reason_msg}")
-                return f"Ad generation blocked: {reason_msg}", REFERENCE_FALLBACK
-            if response.candidates and response.candidates[0].finish_reason:
-                finish_reason_val = response.candidates[0].finish_reason
-                finish_reason_str = types.FinishReason(finish_reason_val).name if isinstance(finish_reason_val, int) else str(finish_reason_val)
-                logger.error(f"Generation finished for {product_name_for_log} with reason: {finish_reason_str}")
-                if finish_reason_val != types.FinishReason.STOP:
-                    return f"Ad generation failed: {finish_reason_str}", REFERENCE_FALLBACK
-            return AD_TEXT_FALLBACK, REFERENCE_FALLBACK
+            if response is None:
+                logger.error(f"Failed to generate ad text for {product_name_for_log}: empty response stream.")
+                return AD_TEXT_FALLBACK, REFERENCE_FALLBACK
+            return _empty_response_failure(response, product_name_for_log), REFERENCE_FALLBACK
 
-        if RESPONSE_SEPARATOR in full_response_text:
-            ad_text, reference_strategy = full_response_text.split(RESPONSE_SEPARATOR, 1)
-            ad_text = ad_text.strip()
-            reference_strategy = reference_strategy.strip()
-        else:
-            ad_text = full_response_text.strip()
-            reference_strategy = REFERENCE_FALLBACK
+        ad_text, reference_strategy = split_ad_response(full_response_text)
+        if cutoff_reason == "ad_too_long":
+            ad_text = strip_partial_separator(ad_text, RESPONSE_SEPARATOR)
+            logger.warning(f"Ad for {product_name_for_log} passed {len(ad_text)} characters (limit {max_length}); stream cut off before the reference note.")
+        elif cutoff_reason is not None:
+            reference_strategy = finish_reference(reference_strategy)
+        elif reference_strategy == REFERENCE_FALLBACK:
             logger.warning(f"Response for {product_name_for_log} did not contain separator. Full response used as ad text.")
+        ad_text = await _fit_to_length(ad_text, max_length, platform, tone, usage, stream_stats)
 
         logger.info(f"Generated ad for {product_name_for_log}: {ad_text}")
         logger.info(f"Reference/Strategy for {product_name_for_log}: {reference_strategy}")
 
-        if response.candidates and hasattr(response.candidates[0], 'grounding_metadata') and response.candidates[0].grounding_metadata:
-            metadata = response.candidates[0].grounding_metadata
-            if hasattr(metadata, 'web_search_queries') and metadata.web_search_queries:
-                logger.info(f"Grounding web_search_queries for {product_name_for_log}: {metadata.web_search_queries}")
-            elif hasattr(metadata, 'search_entry_point') and metadata.search_entry_point:
-                rendered_query = getattr(metadata.search_entry_point, 'rendered_query', 'N/A')
-                logger.info(f"Grounding search_entry_point query for {product_name_for_log}: {rendered_query}")
+        _log_grounding_metadata(response, product_name_for_log)
 
         return ad_text, reference_strategy
 
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping ad generation for {product_name_for_log}: {e}")
+        return AD_TEXT_FALLBACK, CIRCUIT_OPEN_REFERENCE
     except Exception as e:
         logger.error(f"Error in generate_ad_text_with_search for {product_name_for_log}: {e}", exc_info=True)
         return AD_TEXT_FALLBACK, f"Error during generation: {str(e)}"
 
 
-async def generate_batch_ads_with_search(
-    products_data: List[Dict[str, str]],  # List of product row data dicts
+def parse_variants_response(
+    full_response_text: str,
+    platforms: List[str],
+    variants: int
+) -> Tuple[List[str], str]:
+    """
+    Parses the JSON produced by ad_variants_system.txt into a flat list of ads ordered
+    platform-major (all variants for platforms[0], then platforms[1], ...) plus the reference note.
+    Missing platforms or variants are filled with AD_TEXT_FALLBACK so the list is always
+    len(platforms) * variants long.
+    """
+    text = full_response_text.strip()
+    # Models sometimes wrap JSON in a markdown code fence despite instructions.
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):] if "{" in text else text
+    json_start, json_end = text.find("{"), text.rfind("}")
+    parsed = json.loads(text[json_start:json_end + 1]) if json_start != -1 and json_end > json_start else {}
+
+    ads_by_platform = parsed.get("ads", {}) if isinstance(parsed, dict) else {}
+    # Match platform names case-insensitively; the model does not always echo them verbatim.
+    ads_by_platform = {str(name).strip().lower(): value for name, value in ads_by_platform.items()}
+
+    flat_ads = []
+    for platform in platforms:
+        platform_ads = ads_by_platform.get(platform.strip().lower(), [])
+        if isinstance(platform_ads, str):
+            platform_ads = [platform_ads]
+        platform_ads = [str(ad).strip() for ad in platform_ads if str(ad).strip()][:variants]
+        platform_ads += [AD_TEXT_FALLBACK] * (variants - len(platform_ads))
+        flat_ads.extend(platform_ads)
+
+    reference_strategy = str(parsed.get("reference", "")).strip() if isinstance(parsed, dict) else ""
+    return flat_ads, reference_strategy or REFERENCE_FALLBACK
+
+
+def _parse_variants_or_keep(
+    full_response_text: str, platforms: List[str], variants: int, product_name_for_log: str
+) -> Tuple[List[str], str]:
+    try:
+        return parse_variants_response(full_response_text, platforms, variants)
+    except ValueError as e:
+        # Not valid JSON: keep whatever the model wrote as the first ad rather than losing it.
+        logger.warning(f"Variant response for {product_name_for_log} was not valid JSON ({e}). Full response used as first ad.")
+        return [full_response_text] + [AD_TEXT_FALLBACK] * (len(platforms) * variants - 1), REFERENCE_FALLBACK
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+async def generate_ad_variants_with_search(
+    product_row_data: Mapping[str, str],
+    platforms: List[str],
+    variants: int = 1,
     tone: str = "Professional",
     max_length: int = 150,
-    platform: str = "Facebook"
-) -> List[Tuple[str, str]]:  # Returns a list of (ad_text, reference_strategy) tuples
-    results = []
-    for product_row in products_data:
+    route: Optional[ModelRoute] = None,
+    route_stats: Optional[RouteStats] = None,
+    product_data_dict_str: Optional[str] = None,
+    prompt_prefix: Optional[PromptPrefix] = None,
+    usage: Optional[CallUsage] = None
+) -> Tuple[List[str], str]:
+    """
+    Generates `variants` ads for each of `platforms` from a single model call.
+    Returns (ads, reference_strategy) with ads ordered platform-major; see parse_variants_response.
+    """
+    product_name_for_log = _product_name_for_log(product_row_data)
+    fallback_ads = [AD_TEXT_FALLBACK] * (len(platforms) * variants)
+
+    try:
+        prompt_prefix = prompt_prefix or ad_variants_prompt_prefix(platforms, variants, tone, max_length)
+        if prompt_prefix is None:
+            logger.error(f"Ad variant generation failed for {product_name_for_log}: prompt template not found.")
+            return fallback_ads, REFERENCE_FALLBACK
+
+        prompt = _row_prompt(product_row_data, product_data_dict_str)
+
+        route = route or get_route(settings.AD_ROUTE_FOR_THIN_ROWS)
+        logger.info(f"Generating {variants} variant(s) x {len(platforms)} platform(s) for: {product_name_for_log} using route '{route.name}' (model {route.model}).")
+
+        response = await _call_model(prompt, route, prompt_prefix, route_stats, usage)
+
+        full_response_text = _extract_response_text(response, product_name_for_log)
+        if not full_response_text:
+            failure_text = _empty_response_failure(response, product_name_for_log)
+            return [failure_text] * len(fallback_ads), REFERENCE_FALLBACK
+
+        ads, reference_strategy = _parse_variants_or_keep(full_response_text, platforms, variants, product_name_for_log)
+
+        _log_grounding_metadata(response, product_name_for_log)
+        return ads, reference_strategy
+
+    except CircuitOpenError as e:
+        logger.warning(f"Skipping ad variant generation for {product_name_for_log}: {e}")
+        return fallback_ads, CIRCUIT_OPEN_REFERENCE
+    except Exception as e:
+        logger.error(f"Error in generate_ad_variants_with_search for {product_name_for_log}: {e}", exc_info=True)
+        return fallback_ads, f"Error during generation: {str(e)}"
+
+
+async def _run_within_deadline(coro, deadline: Optional[Deadline], product_name_for_log: str):
+    """
+    Awaits `coro` with a timeout derived from the remaining deadline budget (keeping
+    DEADLINE_WRITE_RESERVE_SECONDS back for the sheet write). Returns None, without
+    starting the call, when there is no longer enough time for a model call, or when it times out.
+    """
+    if deadline is None:
+        return await coro
+    reserve = settings.DEADLINE_WRITE_RESERVE_SECONDS
+    if not deadline.has_time_for(settings.MIN_AI_CALL_SECONDS, reserve=reserve):
+        coro.close()
+        return None
+    try:
+        return await asyncio.wait_for(coro, timeout=deadline.timeout(reserve=reserve))
+    except asyncio.TimeoutError:
+        logger.warning(f"Deadline reached while generating ad for '{product_name_for_log}'; leaving row unfinished.")
+        return None
+
+
+async def _gather_rows(
+    products_data: RowBatch,
+    generate_row: Callable[[RowView, str], Awaitable[T]],
+    error_result: Callable[[Exception], T],
+    deadline: Optional[Deadline],
+    max_concurrency: int,
+    tenant: Optional[str] = None,
+) -> List[Optional[T]]:
+    """
+    Runs `generate_row(row, row_json)` for every row with at most `max_concurrency` rows
+    in flight, returning results in row order (None for rows the deadline cut off).
+    With a `tenant`, each row also waits for a slot from the fair scheduler, so one
+    tenant's large batch cannot starve other tenants' requests on this worker.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    use_scheduler = tenant is not None and settings.SCHEDULER_ENABLED
+    priority = priority_for(len(products_data))
+    # Serialize every row's prompt JSON column-wise in one pass.
+    fragments = products_data.to_prompt_fragments()
+
+    async def run_row_in_slot(product_row: RowView, product_data_dict_str: str, product_name_for_log_batch: str) -> Optional[T]:
+        if deadline is not None and deadline.expired:
+            return None
         try:
-            # For logging within generate_ad_text_with_search, it will try to find a name.
-            # No need to pass product_name_header_key anymore.
-            ad_text, reference_strategy = await generate_ad_text_with_search(
+            return await _run_within_deadline(generate_row(product_row, product_data_dict_str), deadline, product_name_for_log_batch)
+        except Exception as e:
+            logger.error(f"Failed to generate ad for product '{product_name_for_log_batch}' in batch: {e}", exc_info=True)
+            return error_result(e)
+
+    async def run_row(product_row: RowView, product_data_dict_str: str) -> Optional[T]:
+        product_name_for_log_batch = _product_name_for_log(product_row, "Unknown Product in Batch")
+        async with semaphore:
+            if not use_scheduler:
+                return await run_row_in_slot(product_row, product_data_dict_str, product_name_for_log_batch)
+            try:
+                # Queueing for a slot counts against the deadline like the call itself.
+                await asyncio.wait_for(scheduler.acquire(tenant, priority), timeout=deadline.timeout() if deadline else None)
+            except asyncio.TimeoutError:
+                return None
+            try:
+                return await run_row_in_slot(product_row, product_data_dict_str, product_name_for_log_batch)
+            finally:
+                scheduler.release(tenant)
+
+    return list(await asyncio.gather(*(
+        run_row(product_row, fragment) for product_row, fragment in zip(products_data, fragments)
+    )))
+
+
+async def generate_batch_ads_with_search(
+    products_data: ProductRows,  # RowBatch or list of product row data dicts
+    tone: str = "Professional",
+    max_length: int = 150,
+    platform: str = "Facebook",
+    deadline: Optional[Deadline] = None,
+    max_concurrency: int = 1,
+    tenant: Optional[str] = None,
+    usage: Optional[BatchUsage] = None,
+    similar_ads: Optional[List[Optional[SimilarAd]]] = None
+) -> List[Optional[Tuple[str, str]]]:  # Returns a list of (ad_text, reference_strategy) tuples
+    """
+    Generates one ad per row, in order. With a `deadline`, rows that could not be finished
+    in time are returned as None so the caller can write the finished rows and report the rest.
+    A `tenant` (e.g. the requesting user) shares model-call slots fairly with other tenants.
+    `usage` collects each row's token usage, keyed by row position. Rows with a
+    `similar_ads` entry (by row position; see similarity.find_similar) get that ad adapted
+    instead of a full generation, falling back to one if the adaptation fails.
+    """
+    products_data = _as_row_batch(products_data)
+    route_stats = RouteStats()
+    stream_stats = StreamStats()
+    # Instructions are built (and context-cached, if long enough) once; rows only send their JSON.
+    prompt_prefix = ad_text_prompt_prefix(platform, tone, max_length, use_context_cache=True)
+    if prompt_prefix is None:
+        return [(AD_TEXT_FALLBACK, REFERENCE_FALLBACK)] * len(products_data)
+    adapt_prefix = adapt_prompt_prefix(platform, tone, max_length) if similar_ads else None
+    adapted_count = 0
+
+    async def generate_row(product_row: RowView, product_data_dict_str: str) -> Tuple[str, str]:
+        nonlocal adapted_count
+        row_usage = usage.for_row(product_row.position) if usage is not None else None
+        similar_ad = similar_ads[product_row.position] if similar_ads and adapt_prefix else None
+        if similar_ad is not None:
+            adapted = await adapt_similar_ad(
+                product_row, similar_ad, adapt_prefix, platform, tone, max_length,
+                product_data_dict_str, row_usage, stream_stats
+            )
+            metrics.increment("similar_ads_adapted_total", outcome="adapted" if adapted else "fallback")
+            if adapted is not None:
+                adapted_count += 1
+                return adapted
+        # For logging within generate_ad_text_with_search, it will try to find a name.
+        return await generate_ad_text_with_search(
+            product_row_data=product_row,
+            tone=tone,
+            max_length=max_length,
+            platform=platform,
+            route=choose_route(product_row),  # Data-rich rows skip search grounding
+            route_stats=route_stats,
+            product_data_dict_str=product_data_dict_str,
+            prompt_prefix=prompt_prefix,
+            usage=row_usage,
+            stream_stats=stream_stats
+        )
+
+    try:
+        results = await _gather_rows(
+            products_data,
+            generate_row,
+            lambda e: (AD_TEXT_FALLBACK, f"Batch processing error: {str(e)}"),
+            deadline,
+            max_concurrency,
+            tenant
+        )
+    finally:
+        await prompt_prefix.close()
+    route_stats.log_summary(f"Batch of {len(products_data)} rows, route stats")
+    prompt_prefix.log_summary(f"Batch of {len(products_data)} rows, prompt tokens")
+    stream_stats.log_summary(f"Batch of {len(products_data)} rows, streaming and length repair")
+    if adapted_count:
+        logger.info(f"Batch of {len(products_data)} rows: {adapted_count} ads adapted from similar products without search.")
+    return results
+
+
+async def generate_batch_ad_variants_with_search(
+    products_data: ProductRows,
+    platforms: List[str],
+    variants: int = 1,
+    tone: str = "Professional",
+    max_length: int = 150,
+    deadline: Optional[Deadline] = None,
+    max_concurrency: int = 1,
+    tenant: Optional[str] = None,
+    usage: Optional[BatchUsage] = None
+) -> List[Optional[Tuple[List[str], str]]]:  # Returns a list of (ads, reference_strategy), ads ordered platform-major
+    """Like generate_batch_ads_with_search, but each row yields len(platforms) * variants ads."""
+    products_data = _as_row_batch(products_data)
+    route_stats = RouteStats()
+    prompt_prefix = ad_variants_prompt_prefix(platforms, variants, tone, max_length, use_context_cache=True)
+    if prompt_prefix is None:
+        return [([AD_TEXT_FALLBACK] * (len(platforms) * variants), REFERENCE_FALLBACK)] * len(products_data)
+    try:
+        results = await _gather_rows(
+            products_data,
+            lambda product_row, product_data_dict_str: generate_ad_variants_with_search(
                 product_row_data=product_row,
+                platforms=platforms,
+                variants=variants,
                 tone=tone,
                 max_length=max_length,
-                platform=platform
-            )
-            results.append((ad_text, reference_strategy))
-        except Exception as e:
-            # Attempt to get a product name for logging, if possible from the row data
-            product_name_for_log_batch = product_row.get("Product Name", product_row.get("Name", "Unknown Product in Batch"))
-            logger.error(f"Failed to generate ad for product '{product_name_for_log_batch}' in batch: {e}", exc_info=True)
-            results.append((AD_TEXT_FALLBACK, f"Batch processing error: {str(e)}"))
+                route=choose_route(product_row),  # Data-rich rows skip search grounding
+                route_stats=route_stats,
+                product_data_dict_str=product_data_dict_str,
+                prompt_prefix=prompt_prefix,
+                usage=usage.for_row(product_row.position) if usage is not None else None
+            ),
+            lambda e: ([AD_TEXT_FALLBACK] * (len(platforms) * variants), f"Batch processing error: {str(e)}"),
+            deadline,
+            max_concurrency,
+            tenant
+        )
+    finally:
+        await prompt_prefix.close()
+    route_stats.log_summary(f"Variant batch of {len(products_data)} rows, route stats")
+    prompt_prefix.log_summary(f"Variant batch of {len(products_data)} rows, prompt tokens")
+    return results
+
+
+def select_backend(row_count: int, requested: str = "auto") -> str:
+    """
+    "online" (one generate_content call per row) or "batch" (one batch prediction job per
+    model: cheaper and outside the online quotas, but finishing in minutes to hours).
+    "auto" picks batch from BATCH_PREDICTION_MIN_ROWS rows.
+    """
+    if requested in ("online", "batch"):
+        return requested
+    return "batch" if row_count >= settings.BATCH_PREDICTION_MIN_ROWS else "online"
+
+
+def _batch_request(prompt: str, prompt_prefix: PromptPrefix, route: ModelRoute) -> Dict[str, Any]:
+    """A row's GenerateContentRequest in the REST JSON form batch input lines carry."""
+    request: Dict[str, Any] = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "system_instruction": {"parts": [{"text": prompt_prefix.instruction_for(route)}]},
+        "safety_settings": [
+            {"category": setting.category.value, "threshold": setting.threshold.value}
+            for setting in get_safety_settings()
+        ],
+    }
+    if route.use_search:
+        request["tools"] = [{"google_search": {}}]
+    return request
+
+
+def _batch_response_text(response: Dict[str, Any]) -> Tuple[str, bool]:
+    """(text, True) for a batch result with text, else (the failure message to show, False)."""
+    candidates = response.get("candidates") or []
+    parts = (candidates[0].get("content") or {}).get("parts", []) if candidates else []
+    text = "".join(part.get("text", "") for part in parts).strip()
+    if text:
+        return text, True
+    block_reason = (response.get("promptFeedback") or {}).get("blockReason")
+    if block_reason:
+        return f"Ad generation blocked: {block_reason}", False
+    finish_reason = candidates[0].get("finishReason") if candidates else None
+    if finish_reason and finish_reason != "STOP":
+        return f"Ad generation failed: {finish_reason}", False
+    return AD_TEXT_FALLBACK, False
+
+
+async def _generate_with_batch_jobs(
+    products_data: RowBatch,
+    prompt_prefix: PromptPrefix,
+    parse_text: Callable[[str, str], T],
+    failure_result: Callable[[str], T],
+    usage: Optional[BatchUsage],
+    backend: Optional[BatchBackend],
+) -> List[Optional[T]]:
+    """
+    Sends every row as one line of a batch prediction job (one job per model route), waits
+    for the jobs and maps their output back to row order by key, the row's position.
+    `parse_text(text, product_name)` turns a response into the row's result and
+    `failure_result(message)` stands in for a failed request. Rows whose job did not
+    succeed, or that are missing from its output, are returned as None.
+    """
+    backend = backend or get_batch_backend()
+    lines_by_route: Dict[str, Tuple[ModelRoute, List[Dict[str, Any]]]] = {}
+    for product_row, fragment in zip(products_data, products_data.to_prompt_fragments()):
+        route = choose_route(product_row)  # Data-rich rows skip search grounding
+        lines_by_route.setdefault(route.name, (route, []))[1].append({
+            "key": str(product_row.position),
+            "request": _batch_request(_row_prompt(product_row, fragment), prompt_prefix, route),
+        })
+
+    started_at = time.perf_counter()
+    outputs = await asyncio.gather(*(
+        run_batch_job(backend, route.model, lines, display_name=f"ad-batch-{route.name}-{len(lines)}-rows")
+        for route, lines in lines_by_route.values()
+    ))
+    # Every row of a job waited for the whole job, which is what its latency is recorded as.
+    latency_seconds = time.perf_counter() - started_at
+
+    results: List[Optional[T]] = [None] * len(products_data)
+    for (route, _), output in zip(lines_by_route.values(), outputs):
+        for line in output or []:
+            position = int(line["key"])
+            product_name_for_log = _product_name_for_log(products_data[position], "Unknown Product in Batch")
+            response = line.get("response")
+            if response is None:
+                logger.error(f"Batch request for '{product_name_for_log}' failed: {line.get('error') or line.get('status')}")
+                results[position] = failure_result(f"Batch request error: {line.get('error') or line.get('status')}")
+                continue
+            if usage is not None:
+                usage.for_row(position).record_json(response, route.model, latency_seconds)
+            text, ok = _batch_response_text(response)
+            results[position] = parse_text(text, product_name_for_log) if ok else failure_result(text)
+    unfinished = sum(result is None for result in results)
+    logger.info(f"Batch prediction of {len(products_data)} rows done in {latency_seconds:.0f}s; {unfinished} row(s) without a result.")
     return results
+
+
+async def generate_batch_ads_via_batch_job(
+    products_data: ProductRows,
+    tone: str = "Professional",
+    max_length: int = 150,
+    platform: str = "Facebook",
+    usage: Optional[BatchUsage] = None,
+    backend: Optional[BatchBackend] = None
+) -> List[Optional[Tuple[str, str]]]:
+    """
+    generate_batch_ads_with_search through batch prediction jobs rather than one online
+    call per row; for large runs that can wait. Rows without a result are None.
+    """
+    products_data = _as_row_batch(products_data)
+    prompt_prefix = ad_text_prompt_prefix(platform, tone, max_length)
+    if prompt_prefix is None:
+        return [(AD_TEXT_FALLBACK, REFERENCE_FALLBACK)] * len(products_data)
+    return await _generate_with_batch_jobs(
+        products_data,
+        prompt_prefix,
+        lambda text, product_name_for_log: split_ad_response(text),
+        lambda message: (message, REFERENCE_FALLBACK),
+        usage,
+        backend
+    )
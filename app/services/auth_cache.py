@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+from app.db.models import User
+from app.utils.ttl_cache import TTLCache
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The User columns authentication needs, detached from any DB session so it can be cached."""
+
+    id: int
+    username: str
+    email: Optional[str]
+    password_hash: Optional[str]
+    is_active: bool
+    is_superuser: bool
+    token_budget: Optional[int]
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            password_hash=user.password_hash,
+            is_active=bool(user.is_active),
+            is_superuser=bool(user.is_superuser),
+            token_budget=user.token_budget,
+        )
+
+
+# Per worker process. Entries are short-lived, so a deactivated user or changed password
+# is seen by other workers within the TTL.
+users_by_token: TTLCache[CachedUser] = TTLCache(settings.AUTH_TOKEN_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+users_by_username: TTLCache[CachedUser] = TTLCache(settings.AUTH_USER_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Gemini batch prediction: a job takes a JSONL file of {"key", "request"} lines (each request
+# a GenerateContentRequest), runs asynchronously at a discount and outside the online
+# quotas, and produces a JSONL file of {"key", "response"} or {"key", "error"} lines, in no
+# particular order. Jobs can take minutes to hours, so they only suit runs that can wait
+# (the bulk CLI), never an add-on action with its request deadline.
+
+SUCCEEDED = "JOB_STATE_SUCCEEDED"
+TERMINAL_STATES = {SUCCEEDED, "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+@dataclass
+class BatchJob:
+    name: str
+    state: str  # A JOB_STATE_* name
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in TERMINAL_STATES
+
+    @property
+    def succeeded(self) -> bool:
+        return self.state == SUCCEEDED
+
+
+class BatchBackend(ABC):
+    """Submits, polls and collects batch prediction jobs."""
+
+    @abstractmethod
+    async def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str) -> BatchJob:
+        ...
+
+    @abstractmethod
+    async def get(self, name: str) -> BatchJob:
+        ...
+
+    @abstractmethod
+    async def results(self, name: str) -> List[Dict[str, Any]]:
+        """The output lines of a succeeded job."""
+
+    @abstractmethod
+    async def cancel(self, name: str) -> None:
+        ...
+
+
+def _state_name(state: Any) -> str:
+    return getattr(state, "name", None) or str(state)
+
+
+class GeminiBatchBackend(BatchBackend):
+    """The Gemini Batch API, through the SDK's Files and Batches services (blocking calls run in threads)."""
+
+    def _client(self):
+        from app.services.ai_service import get_client
+        return get_client()
+
+    def _submit(self, model: str, lines: List[Dict[str, Any]], display_name: str) -> BatchJob:
+        from google.genai import types
+        client = self._client()
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+        try:
+            uploaded = client.files.upload(
+                file=f.name, config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl")
+            )
+        finally:
+            os.unlink(f.name)
+        job = client.batches.create(
+            model=f"models/{model}", src=uploaded.name, config=types.CreateBatchJobConfig(display_name=display_name)
+        )
+        return BatchJob(job.name, _state_name(job.state))
+
+    def _get(self, name: str) -> BatchJob:
+        job = self._client().batches.get(name=name)
+        return BatchJob(job.name, _state_name(job.state), str(job.error) if job.error else None)
+
+    def _results(self, name: str) -> List[Dict[str, Any]]:
+        client = self._client()
+        job = client.batches.get(name=name)
+        if job.dest is None or not job.dest.file_name:
+            raise ValueError(f"Batch job {name} has no result file.")
+        # Input and result files expire from the Files API on their own after 48 hours.
+        content = client.files.download(file=job.dest.file_name)
+        return [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+
+    async def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str) -> BatchJob:
+        return await asyncio.to_thread(self._submit, model, lines, display_name)
+
+    async def get(self, name: str) -> BatchJob:
+        return await asyncio.to_thread(self._get, name)
+
+    async def results(self, name: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._results, name)
+
+    async def cancel(self, name: str) -> None:
+        await asyncio.to_thread(self._client().batches.cancel, name=name)
+
+
+def _local_response(request: Dict[str, Any]) -> str:
+    prompt = "".join(part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", []))
+    return f"Local batch ad ({len(prompt)} prompt characters)"
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Offline stand-in for the Batch API with the same job lifecycle: a job is PENDING when
+    submitted, RUNNING for `running_polls` polls, then SUCCEEDED (or FAILED with
+    `fail_job`). Each request is answered by `respond(request) -> text`; keys in
+    `fail_keys` get an error line instead, and keys in `drop_keys` no line at all.
+    Output lines come back in reverse order, as the real API does not keep input order.
+    """
+
+    def __init__(
+        self,
+        respond: Callable[[Dict[str, Any]], str] = _local_response,
+        running_polls: int = 1,
+        fail_job: bool = False,
+        fail_keys: Optional[set] = None,
+        drop_keys: Optional[set] = None,
+    ):
+        self.respond = respond
+        self.running_polls = running_polls
+        self.fail_job = fail_job
+        self.fail_keys = fail_keys or set()
+        self.drop_keys = drop_keys or set()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+
+    async def submit(self, model: str, lines: List[Dict[str, Any]], display_name: str) -> BatchJob:
+        name = f"batches/local-{len(self.jobs) + 1}"
+        # Round-trip through JSON like the uploaded file, so non-serializable requests fail here too.
+        self.jobs[name] = {"model": model, "lines": json.loads(json.dumps(lines)), "polls": 0, "state": "JOB_STATE_PENDING"}
+        return BatchJob(name, "JOB_STATE_PENDING")
+
+    async def get(self, name: str) -> BatchJob:
+        job = self.jobs[name]
+        if job["state"] not in TERMINAL_STATES:
+            job["polls"] += 1
+            if job["polls"] > self.running_polls:
+                job["state"] = "JOB_STATE_FAILED" if self.fail_job else SUCCEEDED
+            else:
+                job["state"] = "JOB_STATE_RUNNING"
+        return BatchJob(name, job["state"], "Simulated job failure" if job["state"] == "JOB_STATE_FAILED" else None)
+
+    async def results(self, name: str) -> List[Dict[str, Any]]:
+        job = self.jobs[name]
+        if job["state"] != SUCCEEDED:
+            raise ValueError(f"Batch job {name} has no result file.")
+        output = []
+        for line in reversed(job["lines"]):
+            key = line["key"]
+            if key in self.drop_keys:
+                continue
+            if key in self.fail_keys:
+                output.append({"key": key, "error": {"code": 500, "message": "Simulated request failure"}})
+                continue
+            text = self.respond(line["request"])
+            prompt_chars = len(json.dumps(line["request"]))
+            output.append({"key": key, "response": {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_chars // 4,
+                    "candidatesTokenCount": len(text) // 4,
+                    "totalTokenCount": prompt_chars // 4 + len(text) // 4,
+                },
+                "modelVersion": job["model"],
+            }})
+        return output
+
+    async def cancel(self, name: str) -> None:
+        self.jobs[name]["state"] = "JOB_STATE_CANCELLED"
+
+
+@lru_cache(maxsize=None)
+def get_batch_backend() -> BatchBackend:
+    """The backend named by BATCH_PREDICTION_BACKEND ("gemini" or "local")."""
+    if settings.BATCH_PREDICTION_BACKEND == "local":
+        return LocalBatchBackend()
+    return GeminiBatchBackend()
+
+
+async def run_batch_job(
+    backend: BatchBackend,
+    model: str,
+    lines: List[Dict[str, Any]],
+    display_name: str,
+    poll_interval: Optional[float] = None,
+    max_wait: Optional[float] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Submits `lines` as one job, polls every `poll_interval` seconds until it finishes and
+    returns its output lines. Returns None if the job failed, expired or was cancelled,
+    or is cancelled here after `max_wait` seconds.
+    """
+    poll_interval = settings.BATCH_POLL_INTERVAL_SECONDS if poll_interval is None else poll_interval
+    max_wait = settings.BATCH_MAX_WAIT_SECONDS if max_wait is None else max_wait
+    started_at = time.monotonic()
+    job = await backend.submit(model, lines, display_name)
+    logger.info(f"Submitted batch job {job.name} ({len(lines)} requests, model {model}).")
+    while not job.done:
+        if time.monotonic() - started_at >= max_wait:
+            logger.error(f"Batch job {job.name} still {job.state} after {max_wait:.0f}s; cancelling it.")
+            await backend.cancel(job.name)
+            metrics.increment("batch_jobs_total", model=model, state="TIMED_OUT")
+            return None
+        await asyncio.sleep(poll_interval)
+        job = await backend.get(job.name)
+    elapsed = time.monotonic() - started_at
+    metrics.increment("batch_jobs_total", model=model, state=job.state)
+    if not job.succeeded:
+        logger.error(f"Batch job {job.name} ended {job.state} after {elapsed:.0f}s: {job.error}")
+        return None
+    logger.info(f"Batch job {job.name} succeeded after {elapsed:.0f}s.")
+    return await backend.results(job.name)
@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app.core import metrics
+from app.core.config import settings
+from app.db.models import AdGeneration, Product
+from app.db.session import SessionLocal
+
+try:
+    import orjson
+except ImportError:  # Optional speedup (pip install 'gsheet-ads-text-bycline[speedups]')
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# A user's generation history can run to millions of rows, so exports never load it as a
+# list: rows come off a server-side cursor EXPORT_BATCH_ROWS at a time (yield_per, which
+# also turns on stream_results) and each batch is written out as one chunk of the response
+# before the next is fetched. Memory stays flat whatever the history size.
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+# One row per generation, with its product's fields when it has one (sheet runs do not).
+# The embedding is left out: it is only meaningful to app.services.similarity.
+EXPORT_COLUMNS = [
+    AdGeneration.id,
+    AdGeneration.created_at,
+    AdGeneration.spreadsheet_id,
+    AdGeneration.platform,
+    AdGeneration.generated_text,
+    AdGeneration.generation_params,
+    AdGeneration.model,
+    AdGeneration.prompt_tokens,
+    AdGeneration.output_tokens,
+    AdGeneration.tool_tokens,
+    AdGeneration.total_tokens,
+    AdGeneration.latency_seconds,
+    AdGeneration.product_text,
+    AdGeneration.product_id,
+    Product.name.label("product_name"),
+    Product.description.label("product_description"),
+    Product.specifications.label("product_specifications"),
+    Product.cta_link.label("product_cta_link"),
+]
+
+
+@dataclass
+class ExportFilters:
+    created_from: Optional[datetime] = None  # Inclusive
+    created_to: Optional[datetime] = None  # Exclusive
+    spreadsheet_id: Optional[str] = None
+    platform: Optional[str] = None
+
+
+def export_statement(user_id: int, filters: ExportFilters) -> Select:
+    """The user's generations matching `filters`, oldest first (served by ix_ad_generations_user_created)."""
+    statement = select(*EXPORT_COLUMNS).outerjoin(Product, AdGeneration.product_id == Product.id).where(
+        AdGeneration.user_id == user_id
+    )
+    if filters.created_from is not None:
+        statement = statement.where(AdGeneration.created_at >= filters.created_from)
+    if filters.created_to is not None:
+        statement = statement.where(AdGeneration.created_at < filters.created_to)
+    if filters.spreadsheet_id is not None:
+        statement = statement.where(AdGeneration.spreadsheet_id == filters.spreadsheet_id)
+    if filters.platform is not None:
+        statement = statement.where(AdGeneration.platform == filters.platform)
+    return statement.order_by(AdGeneration.created_at, AdGeneration.id)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot export {type(value).__name__} as JSON")
+
+
+def _ndjson_chunk(columns: List[str]) -> Callable[[Sequence[Sequence[Any]]], bytes]:
+    if orjson is not None:
+        return lambda rows: b"".join(orjson.dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+    return lambda rows: "".join(
+        json.dumps(dict(zip(columns, row)), default=_json_default) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+def _csv_header(columns: List[str]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _csv_chunk(columns: List[str]) -> Callable[[Sequence[Sequence[Any]]], bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Only these columns need converting; every other value is written as it is.
+    datetime_columns = [columns.index("created_at")]
+    json_columns = [columns.index("generation_params")]
+
+    def render(rows: Sequence[Sequence[Any]]) -> bytes:
+        for row in rows:
+            row = list(row)
+            for index in datetime_columns:
+                row[index] = row[index].isoformat() if row[index] is not None else None
+            for index in json_columns:
+                row[index] = json.dumps(row[index]) if row[index] is not None else None
+            writer.writerow(row)
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk.encode("utf-8")
+    return render
+
+
+def stream_generations(
+    user_id: int,
+    filters: ExportFilters,
+    export_format: str = "ndjson",
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> Iterator[bytes]:
+    """
+    Yields the user's generations matching `filters` as NDJSON lines or CSV (with a header
+    row), one chunk per EXPORT_BATCH_ROWS rows. Uses its own session rather than the
+    request's: a streamed body is sent after the request's dependencies have closed theirs.
+    """
+    statement = export_statement(user_id, filters)
+    columns = list(statement.selected_columns.keys())
+    render = _csv_chunk(columns) if export_format == "csv" else _ndjson_chunk(columns)
+    if export_format == "csv":
+        yield _csv_header(columns)  # Sent before the query has even run
+
+    db = session_factory()
+    exported = 0
+    try:
+        result = db.execute(statement.execution_options(yield_per=settings.EXPORT_BATCH_ROWS))
+        for partition in result.partitions():
+            exported += len(partition)
+            yield render(partition)
+    finally:
+        db.close()
+        metrics.increment("export_rows_total", exported, format=export_format)
+        logger.info(f"Exported {exported} generations of user {user_id} as {export_format}.")
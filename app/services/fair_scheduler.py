@@ -0,0 +1,129 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.core import metrics
+from app.core.config import settings
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+@dataclass
+class _Waiter:
+    tenant: str
+    priority: str
+    start_tag: float
+    future: "asyncio.Future[None]"
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of model calls across tenants (users or spreadsheets).
+
+    At most `max_concurrent` calls run at once, and at most `tenant_max_concurrent` per
+    tenant. When a slot frees up it goes to the waiting tenant whose next call has the
+    smallest virtual start tag (start-time fair queuing): each call advances its tenant's
+    tag by 1 / weight, so a tenant with thousands of queued rows does not hold up a tenant
+    that just arrived, and INTERACTIVE calls (weight `interactive_weight`) advance their
+    tenant's tag more slowly than BULK calls. Within a tenant, calls run in FIFO order.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        tenant_max_concurrent: int,
+        interactive_weight: float = 4.0,
+        bulk_weight: float = 1.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.tenant_max_concurrent = tenant_max_concurrent
+        self.weights = {INTERACTIVE: interactive_weight, BULK: bulk_weight}
+        self._available = max_concurrent
+        self._virtual_time = 0.0
+        self._last_finish_tag: Dict[str, float] = defaultdict(float)
+        self._queues: Dict[str, Deque[_Waiter]] = defaultdict(deque)
+        self._running: Dict[str, int] = defaultdict(int)
+
+    def queue_depth(self, tenant: Optional[str] = None) -> int:
+        if tenant is not None:
+            return len(self._queues.get(tenant, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, tenant: str, priority: str = INTERACTIVE) -> None:
+        start_tag = max(self._virtual_time, self._last_finish_tag[tenant])
+        self._last_finish_tag[tenant] = start_tag + 1.0 / self.weights[priority]
+        waiter = _Waiter(tenant, priority, start_tag, asyncio.get_running_loop().create_future())
+        self._queues[tenant].append(waiter)
+        metrics.observe("scheduler_queue_depth", self.queue_depth())
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(tenant)  # Granted just as we were cancelled: hand the slot on
+            else:
+                self._remove(waiter)
+            raise
+        metrics.observe("scheduler_wait_seconds", time.perf_counter() - waiter.enqueued_at, priority=priority)
+
+    def release(self, tenant: str) -> None:
+        self._available += 1
+        self._running[tenant] -= 1
+        if not self._running[tenant]:
+            del self._running[tenant]
+            # An idle tenant whose tag the virtual clock has passed needs no state kept.
+            if tenant not in self._queues and self._last_finish_tag[tenant] <= self._virtual_time:
+                del self._last_finish_tag[tenant]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, priority: str = INTERACTIVE) -> AsyncIterator[None]:
+        await self.acquire(tenant, priority)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.tenant)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.tenant]
+
+    def _dispatch(self) -> None:
+        while self._available > 0:
+            eligible = [
+                queue for tenant, queue in self._queues.items()
+                if self._running.get(tenant, 0) < self.tenant_max_concurrent
+            ]
+            if not eligible:
+                return
+            queue = min(eligible, key=lambda q: q[0].start_tag)
+            waiter = queue.popleft()
+            if not queue:
+                del self._queues[waiter.tenant]
+            if waiter.future.done():  # Cancelled while queued
+                continue
+            self._available -= 1
+            self._running[waiter.tenant] += 1
+            self._virtual_time = max(self._virtual_time, waiter.start_tag)
+            waiter.future.set_result(None)
+
+
+def priority_for(row_count: int) -> str:
+    """Small requests are interactive; large ones are bulk runs."""
+    return INTERACTIVE if row_count <= settings.SCHEDULER_INTERACTIVE_MAX_ROWS else BULK
+
+
+scheduler = FairScheduler(
+    max_concurrent=settings.SCHEDULER_MAX_CONCURRENT_CALLS,
+    tenant_max_concurrent=settings.SCHEDULER_TENANT_MAX_CONCURRENT_CALLS,
+    interactive_weight=settings.SCHEDULER_INTERACTIVE_WEIGHT,
+    bulk_weight=settings.SCHEDULER_BULK_WEIGHT,
+)
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while its circuit breaker is open."""
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies, used to pick the hedge delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency_seconds: float) -> None:
+        self._samples.append(latency_seconds)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the primary call before hedging: the configured percentile of recent latencies."""
+        if len(self._samples) < settings.HEDGE_MIN_SAMPLES:
+            return settings.HEDGE_DEFAULT_DELAY_SECONDS
+        observed = metrics.percentile(list(self._samples), settings.HEDGE_PERCENTILE)
+        return max(settings.HEDGE_MIN_DELAY_SECONDS, observed)
+
+
+class HedgeBudget:
+    """
+    Caps hedged requests at `ratio` of primary requests. Each primary call earns `ratio`
+    tokens (up to `max_tokens`) and each hedge spends one, so a slow upstream can never
+    more than (1 + ratio)x the request volume.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_primary(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the error rate over the last `window` calls reaches `error_rate`
+    (once at least `min_requests` were seen). Open rejects calls for `open_seconds`, then
+    half-opens and lets `half_open_calls` trial calls through: a success closes the
+    circuit, a failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_requests: int,
+        error_rate: float,
+        open_seconds: float,
+        half_open_calls: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=window)  # True = failure
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_in_flight = 0
+            logger.info(f"Circuit '{self.name}' half-open: allowing {self.half_open_calls} trial call(s).")
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        metrics.increment("ai_circuit_opened_total", circuit=self.name)
+        logger.warning(f"Circuit '{self.name}' opened; failing fast for {self.open_seconds}s.")
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._half_open_in_flight < self.half_open_calls:
+                self._half_open_in_flight += 1
+                return True
+            return False
+
+    def release_trial(self) -> None:
+        """
+        Frees the half-open slot of a trial call that ended without an outcome (it was
+        cancelled, e.g. by a deadline), so the next call can be the trial instead.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_in_flight > 0:
+                self._half_open_in_flight -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                logger.info(f"Circuit '{self.name}' closed after successful trial call.")
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(False)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(True)
+            if len(self._outcomes) >= self.min_requests and sum(self._outcomes) / len(self._outcomes) >= self.error_rate:
+                self._open()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latency_trackers: Dict[str, LatencyTracker] = {}
+hedge_budget = HedgeBudget(ratio=settings.HEDGE_BUDGET_RATIO)
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name=name,
+            window=settings.CIRCUIT_BREAKER_WINDOW,
+            min_requests=settings.CIRCUIT_BREAKER_MIN_REQUESTS,
+            error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+            open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+            half_open_calls=settings.CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+        )
+    return _breakers[name]
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    return _latency_trackers.setdefault(name, LatencyTracker())
+
+
+async def resilient_call(
+    make_call: Callable[[], Awaitable[T]],
+    name: str,
+    is_upstream_failure: Callable[[BaseException], bool] = lambda e: True,
+    breaker: Optional[CircuitBreaker] = None,
+    latency_tracker: Optional[LatencyTracker] = None,
+    budget: Optional[HedgeBudget] = None,
+) -> T:
+    """
+    Runs `make_call()` behind the circuit breaker for `name`, hedging it with a second
+    identical call if the first has not finished after the tracked latency percentile
+    (and the hedge budget allows). The first successful result wins and the other call
+    is cancelled. Raises CircuitOpenError without calling when the circuit is open.
+    """
+    breaker = breaker or get_circuit_breaker(name)
+    latency_tracker = latency_tracker or get_latency_tracker(name)
+    budget = budget or hedge_budget
+
+    if not breaker.allow_request():
+        metrics.increment("ai_circuit_rejected_total", circuit=name)
+        raise CircuitOpenError(f"Circuit for '{name}' is open.")
+
+    budget.on_primary()
+    started_at: Dict["asyncio.Future[T]", float] = {}
+    hedge_tasks = set()
+
+    def start() -> "asyncio.Future[T]":
+        task = asyncio.ensure_future(make_call())
+        started_at[task] = time.perf_counter()
+        return task
+
+    pending = {start()}
+    last_error: Optional[BaseException] = None
+    recorded = False  # Whether the breaker has seen this call's outcome
+    try:
+        if settings.HEDGE_ENABLED:
+            done, pending = await asyncio.wait(pending, timeout=latency_tracker.hedge_delay())
+            if not done and breaker.state == CircuitBreaker.CLOSED and budget.try_spend():
+                metrics.increment("ai_hedged_requests_total", circuit=name)
+                hedge_task = start()
+                hedge_tasks.add(hedge_task)
+                pending.add(hedge_task)
+            else:
+                pending |= done
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    latency = time.perf_counter() - started_at[task]
+                    latency_tracker.record(latency)
+                    breaker.record_success()
+                    recorded = True
+                    if task in hedge_tasks:
+                        metrics.increment("ai_hedge_wins_total", circuit=name)
+                    return task.result()
+                last_error = error
+                recorded = True
+                if is_upstream_failure(error):
+                    breaker.record_failure()
+                else:
+                    # The upstream answered (e.g. rejected a bad request), so it is healthy.
+                    breaker.record_success()
+        assert last_error is not None
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+        if not recorded:
+            # Cancelled before any call finished: a half-open trial must not hold its slot forever.
+            breaker.release_trial()
@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.db import crud
+from app.utils.sheets_utils import (get_sheet_name_and_columns_from_range,
+                                    infer_column_roles)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HeaderMapping:
+    """A sheet's header row and the semantic column roles inferred from it."""
+
+    spreadsheet_id: str
+    header_range: str
+    header_row: int
+    headers: List[str]
+    column_roles: Dict[str, int]  # role -> 0-indexed column within header_range
+    sheet_name: Optional[str] = None
+    last_data_range: Optional[str] = None
+    cached_at: float = field(default_factory=time.time)  # When the headers were last read and matched
+
+
+# In-memory LRU keyed by (spreadsheet_id, header_range); Postgres backs it across workers/restarts.
+_memory_cache: "OrderedDict[Tuple[str, str], HeaderMapping]" = OrderedDict()
+
+
+def _remember(mapping: HeaderMapping) -> None:
+    key = (mapping.spreadsheet_id, mapping.header_range)
+    _memory_cache[key] = mapping
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > settings.HEADER_CACHE_MAX_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+
+def _from_db_row(db_mapping) -> HeaderMapping:
+    return HeaderMapping(
+        spreadsheet_id=db_mapping.spreadsheet_id,
+        header_range=db_mapping.header_range,
+        header_row=db_mapping.header_row,
+        headers=list(db_mapping.headers),
+        column_roles=dict(db_mapping.column_roles),
+        sheet_name=db_mapping.sheet_name,
+        last_data_range=db_mapping.last_data_range,
+        cached_at=db_mapping.updated_at.timestamp() if db_mapping.updated_at else 0.0,
+    )
+
+
+def get_header_mapping(db: Session, spreadsheet_id: str, header_range: str) -> Optional[HeaderMapping]:
+    """The cached mapping for a header range, checking memory then Postgres. Not validated: see resolve."""
+    key = (spreadsheet_id, header_range)
+    mapping = _memory_cache.get(key)
+    if mapping is not None:
+        _memory_cache.move_to_end(key)
+        return mapping
+    try:
+        db_mapping = crud.get_sheet_header_mapping(db, spreadsheet_id, header_range)
+    except SQLAlchemyError as e:
+        logger.error(f"Header cache lookup failed for {spreadsheet_id} {header_range}: {e}")
+        db.rollback()
+        return None
+    if db_mapping is None:
+        return None
+    mapping = _from_db_row(db_mapping)
+    _remember(mapping)
+    return mapping
+
+
+def resolve(
+    db: Session,
+    spreadsheet_id: str,
+    header_range: str,
+    header_row: int,
+    headers: List[str],
+    data_range: Optional[str] = None,
+) -> HeaderMapping:
+    """
+    The mapping for a header row as just read: the cached one while the headers are
+    unchanged, else a new one with the column roles inferred again. Callers read the row
+    through the Drive-versioned values cache, so an unchanged spreadsheet costs no Sheets read.
+    """
+    mapping = get_header_mapping(db, spreadsheet_id, header_range)
+    if mapping is None or mapping.headers != headers:
+        metrics.increment("header_cache_misses_total")
+        return store_header_mapping(db, spreadsheet_id, header_range, header_row, headers, data_range)
+    metrics.increment("header_cache_hits_total")
+    mapping.cached_at = time.time()
+    if data_range:
+        _remember_data_range(db, mapping, data_range)
+    return mapping
+
+
+def get_latest_mapping(db: Session, spreadsheet_id: str) -> Optional[HeaderMapping]:
+    """Most recently used mapping for a spreadsheet, regardless of age (used to prefill the form)."""
+    in_memory = [m for (sid, _), m in _memory_cache.items() if sid == spreadsheet_id]
+    if in_memory:
+        return max(in_memory, key=lambda m: m.cached_at)
+    try:
+        db_mapping = crud.get_latest_sheet_header_mapping(db, spreadsheet_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Header cache lookup failed for {spreadsheet_id}: {e}")
+        db.rollback()
+        return None
+    return _from_db_row(db_mapping) if db_mapping is not None else None
+
+
+def store_header_mapping(
+    db: Session,
+    spreadsheet_id: str,
+    header_range: str,
+    header_row: int,
+    headers: List[str],
+    data_range: Optional[str] = None,
+) -> HeaderMapping:
+    """Infers column roles for freshly read headers and caches them in memory and Postgres."""
+    previous = _memory_cache.get((spreadsheet_id, header_range))
+    if previous is not None and previous.headers != headers:
+        logger.info(f"Headers changed for {spreadsheet_id} {header_range}; replacing cached mapping.")
+        metrics.increment("header_cache_invalidations_total")
+
+    parsed_range = get_sheet_name_and_columns_from_range(header_range)
+    mapping = HeaderMapping(
+        spreadsheet_id=spreadsheet_id,
+        header_range=header_range,
+        header_row=header_row,
+        headers=headers,
+        column_roles=infer_column_roles(headers),
+        sheet_name=parsed_range[0] if parsed_range else None,
+        last_data_range=data_range or (previous.last_data_range if previous else None),
+    )
+    _remember(mapping)
+    _persist(db, mapping)
+    return mapping
+
+
+def _remember_data_range(db: Session, mapping: HeaderMapping, data_range: str) -> None:
+    """Records the last data range used with a mapping, for prefilling the form next time."""
+    if mapping.last_data_range == data_range:
+        return
+    mapping.last_data_range = data_range
+    _persist(db, mapping)
+
+
+def _persist(db: Session, mapping: HeaderMapping) -> None:
+    try:
+        crud.upsert_sheet_header_mapping(
+            db,
+            spreadsheet_id=mapping.spreadsheet_id,
+            header_range=mapping.header_range,
+            sheet_name=mapping.sheet_name,
+            header_row=mapping.header_row,
+            headers=mapping.headers,
+            column_roles=mapping.column_roles,
+            last_data_range=mapping.last_data_range,
+        )
+    except SQLAlchemyError as e:
+        # The in-memory cache still works; Postgres only adds sharing across workers.
+        logger.error(f"Could not persist header mapping for {mapping.spreadsheet_id} {mapping.header_range}: {e}")
+        db.rollback()
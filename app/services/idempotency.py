@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.db import crud
+
+logger = logging.getLogger(__name__)
+
+Response = Dict[str, Any]
+
+ALREADY_RUNNING_RESPONSE: Response = {
+    "action": {
+        "notification": {
+            "text": "This request is already running. The ads will appear in the sheet when it finishes."
+        }
+    }
+}
+
+# Per-worker state: runs in flight on this worker, and recently finished responses.
+_in_flight: Dict[str, "asyncio.Future[Response]"] = {}
+_completed: "OrderedDict[str, Tuple[Response, float]]" = OrderedDict()
+_MAX_COMPLETED = 1024
+_last_purge = 0.0  # time.monotonic() of this worker's last purge of expired records
+
+
+def make_key(user: str, spreadsheet_id: Optional[str], form_inputs: Dict[str, Any]) -> str:
+    """Identity of a submission: same user, spreadsheet and form inputs (which include the data range)."""
+    canonical = json.dumps([user, spreadsheet_id, form_inputs], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_success(response: Response) -> bool:
+    """Error notifications ("Error: ...") are not replayed: a retry should run again."""
+    text = response.get("action", {}).get("notification", {}).get("text", "")
+    return not text.startswith("Error")
+
+
+def _completed_response(key: str) -> Optional[Response]:
+    entry = _completed.get(key)
+    if entry is None:
+        return None
+    response, expires_at = entry
+    if time.monotonic() >= expires_at:
+        del _completed[key]
+        return None
+    return response
+
+
+def _remember_completed(key: str, response: Response) -> None:
+    _completed[key] = (response, time.monotonic() + settings.IDEMPOTENCY_REPLAY_SECONDS)
+    _completed.move_to_end(key)
+    while len(_completed) > _MAX_COMPLETED:
+        _completed.popitem(last=False)
+
+
+def _claim(db: Session, key: str) -> bool:
+    try:
+        return crud.claim_idempotency_key(db, key, settings.IDEMPOTENCY_LEASE_SECONDS)
+    except SQLAlchemyError as e:
+        # Without Postgres we still collapse duplicates that land on this worker.
+        logger.error(f"Idempotency claim failed for {key[:12]}: {e}")
+        db.rollback()
+        return True
+
+
+async def _wait_for_other_worker(db: Session, key: str, deadline: Deadline) -> Optional[Response]:
+    """Polls Postgres for the result of a run claimed by another worker, until the deadline."""
+    while deadline.has_time_for(settings.IDEMPOTENCY_POLL_INTERVAL_SECONDS):
+        await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL_SECONDS)
+        db.expire_all()
+        try:
+            record = crud.get_idempotency_record(db, key)
+        except SQLAlchemyError as e:
+            logger.error(f"Idempotency lookup failed for {key[:12]}: {e}")
+            db.rollback()
+            return None
+        if record is None:
+            return None  # The other run failed and released its claim
+        if record.status == "completed":
+            return record.response
+    return None
+
+
+async def run_once(
+    db: Session,
+    key: str,
+    deadline: Deadline,
+    run: Callable[[], Awaitable[Response]],
+) -> Response:
+    """
+    Runs `run()` once per idempotency key. Identical submissions that arrive while it is
+    running wait for and share its response (on this worker via an in-process future,
+    on other workers by polling the Postgres record). Those arriving shortly after it
+    succeeded get the same response replayed; after an error notification the key is
+    released so a retry runs again. If the original run outlasts the duplicate's
+    deadline, the duplicate gets an "already running" notification.
+    """
+    in_flight = _in_flight.get(key)
+    if in_flight is not None:
+        metrics.increment("idempotency_duplicates_total", source="in_flight")
+        logger.info(f"Duplicate submission {key[:12]} attached to the run in flight on this worker.")
+        try:
+            return await asyncio.wait_for(asyncio.shield(in_flight), timeout=deadline.timeout(reserve=0.5))
+        except asyncio.TimeoutError:
+            return ALREADY_RUNNING_RESPONSE
+
+    replayed = _completed_response(key)
+    if replayed is not None:
+        metrics.increment("idempotency_duplicates_total", source="replayed")
+        return replayed
+
+    if not _claim(db, key):
+        metrics.increment("idempotency_duplicates_total", source="other_worker")
+        logger.info(f"Duplicate submission {key[:12]} is claimed elsewhere; waiting for its result.")
+        response = await _wait_for_other_worker(db, key, deadline)
+        return response if response is not None else ALREADY_RUNNING_RESPONSE
+
+    future: "asyncio.Future[Response]" = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        response = await run()
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved: duplicates are optional listeners
+        _release(db, key)
+        raise
+    finally:
+        _in_flight.pop(key, None)
+
+    future.set_result(response)  # Duplicates that were waiting share it either way
+    if not is_success(response):
+        _release(db, key)
+        return response
+    _remember_completed(key, response)
+    try:
+        crud.complete_idempotency_key(db, key, response, settings.IDEMPOTENCY_REPLAY_SECONDS)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not record idempotent response for {key[:12]}: {e}")
+        db.rollback()
+    _maybe_purge(db)
+    return response
+
+
+def _maybe_purge(db: Session) -> None:
+    """Deletes expired records, at most once per IDEMPOTENCY_PURGE_INTERVAL_SECONDS per worker."""
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    try:
+        deleted = crud.delete_expired_idempotency_records(db)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not purge expired idempotency records: {e}")
+        db.rollback()
+        return
+    if deleted:
+        logger.info(f"Purged {deleted} expired idempotency records.")
+
+
+def _release(db: Session, key: str) -> None:
+    """Drops the claim after a failed run so an identical retry can start fresh."""
+    try:
+        crud.release_idempotency_key(db, key)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not release idempotency key {key[:12]}: {e}")
+        db.rollback()
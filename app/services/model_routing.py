@@ -0,0 +1,97 @@
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.core import metrics
+from app.core.config import settings
+from app.utils.row_batch import RowView
+
+logger = logging.getLogger(__name__)
+
+# How much each semantic column contributes to a row's information score, and
+# how many characters make that column count as "fully populated".
+ROLE_WEIGHTS: Dict[str, float] = {
+    "name": 0.2,
+    "description": 0.35,
+    "specifications": 0.3,
+    "cta_link": 0.15,
+}
+ROLE_FULL_LENGTH: Dict[str, int] = {
+    "name": 3,
+    "description": 80,
+    "specifications": 40,
+    "cta_link": 8,
+}
+# Used when no header could be mapped to a role: rows are judged on raw text volume only,
+# and can never score above UNMAPPED_MAX_SCORE (so they keep search grounding by default).
+UNMAPPED_FULL_LENGTH = 250
+UNMAPPED_MAX_SCORE = 0.5
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    name: str
+    model: str
+    use_search: bool
+
+
+def get_route(route_name: str) -> ModelRoute:
+    """Looks up a route from settings.AD_MODEL_ROUTES. Raises KeyError for unknown routes."""
+    route_config = settings.AD_MODEL_ROUTES[route_name]
+    return ModelRoute(
+        name=route_name,
+        model=route_config["model"],
+        use_search=bool(route_config.get("use_search", True)),
+    )
+
+
+def score_row(product_row: RowView) -> float:
+    """
+    Scores a row's information content between 0 and 1 from its populated columns,
+    reading role columns by the index resolved on its RowBatch.
+    """
+    column_roles = product_row.batch.column_roles
+    if not column_roles:
+        total_chars = sum(len(value.strip()) for value in product_row.values())
+        return min(1.0, total_chars / UNMAPPED_FULL_LENGTH) * UNMAPPED_MAX_SCORE
+
+    score = 0.0
+    for role, column_index in column_roles.items():
+        value_length = len(product_row.value_at(column_index).strip())
+        if value_length:
+            score += ROLE_WEIGHTS[role] * min(1.0, value_length / ROLE_FULL_LENGTH[role])
+    return min(1.0, score)
+
+
+def choose_route(product_row: RowView) -> ModelRoute:
+    """Data-rich rows skip search grounding; thin rows keep it."""
+    if score_row(product_row) >= settings.AD_ROUTE_RICH_ROW_MIN_SCORE:
+        return get_route(settings.AD_ROUTE_FOR_RICH_ROWS)
+    return get_route(settings.AD_ROUTE_FOR_THIN_ROWS)
+
+
+class RouteStats:
+    """Per-batch request counts and latencies, keyed by route name."""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, route_name: str, latency_seconds: float) -> None:
+        self.latencies[route_name].append(latency_seconds)
+        metrics.increment("ai_route_requests_total", route=route_name)
+        metrics.observe("ai_route_latency_seconds", latency_seconds, route=route_name)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            route_name: {
+                "count": len(values),
+                "mean_ms": round(1000 * sum(values) / len(values), 1),
+                "p95_ms": round(1000 * metrics.percentile(values, 95), 1),
+            }
+            for route_name, values in self.latencies.items()
+            if values
+        }
+
+    def log_summary(self, prefix: Optional[str] = None) -> None:
+        logger.info(f"{prefix or 'Route stats'}: {self.summary()}")
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional, Set
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.services import ai_service, header_cache
+from app.utils.google_api_clients import (get_sheet_values_cached,
+                                         get_spreadsheet_version, get_user_info)
+from app.utils.google_auth_request import warm_certs
+from app.utils.sheets_quota import user_key
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Speculative prefetch: the user spends several seconds on the generate form between
+# /gws/generateAdsForm and /gws/generateAndWriteAds. When the form opens, the ranges it is
+# prefilled with (the spreadsheet's last header and data range) are read in the background,
+# along with the Gemini client, Google's ID token certs and the user's OAuth userinfo.
+# The ranges land in the Drive-versioned values cache, so the submit still checks the
+# spreadsheet version and sees edits made while the form was open. Prefetches are per
+# process: a submit served by another worker reads the ranges itself.
+
+
+@dataclass
+class Prefetch:
+    header_range: Optional[str]
+    data_range: Optional[str]
+    task: asyncio.Task
+
+
+# Keyed by (user_key(token), spreadsheet_id), so a prefetch is only ever consumed by the user who started it.
+_prefetches: TTLCache[Prefetch] = TTLCache(settings.PREFETCH_TTL_SECONDS, settings.PREFETCH_MAX_ENTRIES)
+_background_tasks: Set[asyncio.Task] = set()
+
+
+async def _read_ranges(token: str, spreadsheet_id: str, mapping: header_cache.HeaderMapping) -> None:
+    """Reads the header row and the last data range into the values cache, against one Drive version lookup."""
+    version = await get_spreadsheet_version(token, spreadsheet_id)
+    ranges = [mapping.header_range] + ([mapping.last_data_range] if mapping.last_data_range else [])
+    await asyncio.gather(*(get_sheet_values_cached(token, spreadsheet_id, range_a1, version=version) for range_a1 in ranges))
+
+
+async def _run(token: str, spreadsheet_id: str, mapping: Optional[header_cache.HeaderMapping]) -> None:
+    steps = {
+        "genai_client": asyncio.to_thread(ai_service.get_client),
+        "id_token_certs": asyncio.to_thread(warm_certs),
+        "userinfo": get_user_info(token),
+    }
+    if mapping is not None and settings.SHEETS_VALUES_CACHE_ENABLED:
+        steps["sheet_ranges"] = _read_ranges(token, spreadsheet_id, mapping)
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for name, result in zip(steps, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Prefetch of {name} for spreadsheet {spreadsheet_id} failed: {result}")
+
+
+def schedule(token: str, spreadsheet_id: str, mapping: Optional[header_cache.HeaderMapping]) -> None:
+    """
+    Starts prefetching, off the request path, what a submit of the form prefilled from
+    `mapping` will read. A prefetch of the same ranges started within PREFETCH_TTL_SECONDS
+    is not repeated.
+    """
+    if not settings.PREFETCH_ENABLED:
+        return
+    header_range = mapping.header_range if mapping else None
+    data_range = mapping.last_data_range if mapping else None
+    key = (user_key(token), spreadsheet_id)
+    existing = _prefetches.get(key)
+    if existing is not None and (existing.header_range, existing.data_range) == (header_range, data_range):
+        return
+    task = asyncio.create_task(_run(token, spreadsheet_id, mapping))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    _prefetches.put(key, Prefetch(header_range, data_range, task))
+    metrics.increment("prefetch_started_total")
+
+
+async def wait_for(token: str, spreadsheet_id: str, header_range: str, data_range: str, deadline: Deadline) -> bool:
+    """
+    Waits (at most PREFETCH_MAX_WAIT_SECONDS) for this user's prefetch of the spreadsheet
+    when it covers the submitted ranges. Returns whether a matching prefetch was found.
+    """
+    key = (user_key(token), spreadsheet_id)
+    existing = _prefetches.get(key)
+    if existing is None or (existing.header_range, existing.data_range) != (header_range, data_range):
+        metrics.increment("prefetch_misses_total")
+        return False
+    _prefetches.pop(key)
+    if not existing.task.done():
+        try:
+            # Shielded: giving up on waiting must not cancel the reads for the caches.
+            await asyncio.wait_for(asyncio.shield(existing.task), deadline.timeout(cap=settings.PREFETCH_MAX_WAIT_SECONDS))
+        except asyncio.TimeoutError:
+            logger.info(f"Prefetch for spreadsheet {spreadsheet_id} still running; reading the sheet directly.")
+    metrics.increment("prefetch_hits_total")
+    return True
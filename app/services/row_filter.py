@@ -0,0 +1,96 @@
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.utils.row_batch import RowBatch
+
+T = TypeVar("T")
+
+VALID = "valid"
+EMPTY = "empty"
+MISSING_FIELDS = "missing_fields"
+DUPLICATE = "duplicate"
+
+# Written to the output cells of rows that were not sent to the model.
+SKIP_MARKERS: Dict[str, str] = {
+    EMPTY: "Skipped: empty row",
+    MISSING_FIELDS: "Skipped: missing required fields",
+}
+
+
+@dataclass
+class RowFilterResult:
+    """Per-row classification of a batch, and how to map unique-row results back to every row."""
+
+    statuses: List[str]
+    # Position in the unique (model-bound) batch whose result each row takes; None for skipped rows.
+    result_index: List[Optional[int]]
+    unique_positions: List[int] = field(default_factory=list)
+
+    def count(self, status: str) -> int:
+        return self.statuses.count(status)
+
+    def expand(self, unique_results: List[Optional[T]], skipped: Callable[[str], T]) -> List[Optional[T]]:
+        """
+        Re-expands results for the unique rows to every original row position: duplicates
+        share their first occurrence's result, skipped rows get `skipped(status)`.
+        """
+        return [
+            unique_results[index] if index is not None else skipped(status)
+            for status, index in zip(self.statuses, self.result_index)
+        ]
+
+
+def _normalized(cells: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(" ".join(cell.split()).casefold() for cell in cells)
+
+
+def filter_rows(batch: RowBatch) -> RowFilterResult:
+    """
+    Classifies each row as EMPTY (under ROW_FILTER_MIN_CHARS of content), MISSING_FIELDS
+    (a role in ROW_FILTER_REQUIRED_ROLES maps to a blank cell), DUPLICATE (same content,
+    ignoring case and whitespace, as an earlier valid row) or VALID.
+    Only VALID rows need a model call.
+    """
+    required_columns = [
+        batch.column_roles[role] for role in settings.ROW_FILTER_REQUIRED_ROLES if role in batch.column_roles
+    ]
+    statuses: List[str] = []
+    result_index: List[Optional[int]] = []
+    unique_positions: List[int] = []
+    first_seen: Dict[Tuple[str, ...], int] = {}
+
+    rows = zip(*batch.columns) if batch.columns else (() for _ in range(len(batch)))
+    for position, cells in enumerate(rows):
+        if sum(len(cell.strip()) for cell in cells) < settings.ROW_FILTER_MIN_CHARS:
+            statuses.append(EMPTY)
+            result_index.append(None)
+        elif any(not cells[column].strip() for column in required_columns):
+            statuses.append(MISSING_FIELDS)
+            result_index.append(None)
+        else:
+            key = _normalized(cells)
+            if key in first_seen:
+                statuses.append(DUPLICATE)
+                result_index.append(first_seen[key])
+            else:
+                first_seen[key] = len(unique_positions)
+                statuses.append(VALID)
+                result_index.append(len(unique_positions))
+                unique_positions.append(position)
+
+    return RowFilterResult(statuses=statuses, result_index=result_index, unique_positions=unique_positions)
+
+
+def disabled(batch: RowBatch) -> RowFilterResult:
+    """Every row VALID and sent as is (ROW_FILTER_ENABLED=false)."""
+    positions = list(range(len(batch)))
+    return RowFilterResult(statuses=[VALID] * len(batch), result_index=list(positions), unique_positions=positions)
+
+
+def prefilter(batch: RowBatch) -> Tuple[RowBatch, RowFilterResult]:
+    """Returns the batch of rows to send to the model and the mapping back to all rows."""
+    result = filter_rows(batch) if settings.ROW_FILTER_ENABLED else disabled(batch)
+    if len(result.unique_positions) == len(batch):
+        return batch, result
+    return batch.take(result.unique_positions), result
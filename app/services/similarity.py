@@ -0,0 +1,311 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core import metrics
+from app.core.config import settings
+from app.db import crud
+from app.db.session import SessionLocal
+from app.utils.row_batch import RowBatch
+from app.utils.ttl_cache import TTLCache
+
+try:
+    import numpy as np
+except ImportError:  # Optional (pip install 'gsheet-ads-text-bycline[similarity]'); the memory index needs it
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Catalogs are full of near-duplicate products (size and colour variants) that row_filter's
+# exact duplicate check does not catch. Generated ads are stored with an embedding of their
+# row, and before a single-ad run every row is embedded and matched against the user's past
+# products for the same platform, tone and max length. Rows whose nearest neighbour scores at
+# least SIMILARITY_THRESHOLD get that neighbour's ad adapted by a small model without search
+# (ai_service.adapt_similar_ad) instead of a full search-grounded generation.
+
+WORD = re.compile(r"\w+")
+QUERY_CHUNK_ROWS = 256  # Rows scored per matrix product, bounding its size to 256 x SIMILARITY_INDEX_MAX_ROWS
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+
+class Embedder(ABC):
+    """Turns texts into unit-length vectors of VECTOR_DIMENSION floats."""
+
+    name: str  # Stored with each embedding; vectors are only compared with vectors of the same name
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+
+@lru_cache(maxsize=65536)
+def _feature_slot(feature: str, dimension: int) -> Tuple[int, float]:
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimension, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local, deterministic stand-in for an embedding model: words and the character trigrams
+    of words, hashed into signed buckets with log-scaled counts. It measures surface overlap,
+    which is what the variants of one product share, and needs no API call.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed_one(self, text: str) -> List[float]:
+        features: Counter = Counter()
+        for word in WORD.findall(text.casefold()):
+            features["w:" + word] += 1
+            padded = f"<{word}>"
+            features.update("c:" + padded[i:i + 3] for i in range(len(padded) - 2))
+        vector = [0.0] * self.dimension
+        for feature, count in features.items():
+            index, sign = _feature_slot(feature, self.dimension)
+            vector[index] += sign * (1.0 + math.log(count))
+        return _unit(vector)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(lambda: [self.embed_one(text) for text in texts])
+
+
+class GeminiEmbedder(Embedder):
+    """SIMILARITY_EMBEDDING_MODEL through the Gemini API, at VECTOR_DIMENSION dimensions."""
+
+    BATCH_SIZE = 100  # Texts per embed_content request
+
+    def __init__(self, model: str, dimension: int):
+        self.model = model
+        self.dimension = dimension
+        self.name = f"{model}-{dimension}"
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        from google.genai import types
+
+        from app.services.ai_service import get_client
+        config = types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY", output_dimensionality=self.dimension)
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.BATCH_SIZE):
+            response = await get_client().aio.models.embed_content(
+                model=self.model, contents=texts[start:start + self.BATCH_SIZE], config=config
+            )
+            # Only full-size embeddings come back normalized.
+            vectors.extend(_unit(list(embedding.values)) for embedding in response.embeddings)
+        return vectors
+
+
+@lru_cache(maxsize=None)
+def get_embedder() -> Embedder:
+    """The embedder named by SIMILARITY_EMBEDDER ("hashing" or "gemini")."""
+    if settings.SIMILARITY_EMBEDDER == "gemini":
+        return GeminiEmbedder(settings.SIMILARITY_EMBEDDING_MODEL, settings.VECTOR_DIMENSION)
+    return HashingEmbedder(settings.VECTOR_DIMENSION)
+
+
+@dataclass(frozen=True)
+class Scope:
+    """Past ads are only reused for the same user, platform, tone and max length."""
+
+    user_id: int
+    platform: str
+    tone: str
+    max_length: int
+
+
+@dataclass
+class SimilarAd:
+    score: float  # Cosine similarity to the row
+    product_text: str  # The neighbour's row JSON
+    ad_text: str
+    generation_id: Optional[int] = None  # None for ads this worker added to its index since loading it
+
+
+# (generation id, row JSON, ad text) of one indexed product
+Entry = Tuple[Optional[int], str, str]
+
+
+class MemoryIndex:
+    """
+    A scope's past products as rows of one float32 matrix of unit vectors, searched
+    exactly: a chunk of queries is scored against every product in one matrix product.
+    """
+
+    def __init__(self, dimension: int):
+        # Swapped as a whole, so a search running in a thread sees a consistent snapshot.
+        self._data: Tuple["np.ndarray", List[Entry]] = (np.empty((0, dimension), dtype=np.float32), [])
+
+    def __len__(self) -> int:
+        return len(self._data[1])
+
+    def add(self, vectors: "np.ndarray", entries: List[Entry]) -> None:
+        """Appends products; past SIMILARITY_INDEX_MAX_ROWS, the oldest are dropped."""
+        keep = settings.SIMILARITY_INDEX_MAX_ROWS
+        matrix, indexed = self._data
+        self._data = (np.vstack([matrix, vectors])[-keep:], (indexed + entries)[-keep:])
+
+    def search(self, queries: "np.ndarray", threshold: float, max_score: float) -> List[Optional[SimilarAd]]:
+        """
+        The nearest product to each query among those scoring at most `max_score`, or None
+        where it scores under `threshold`.
+        """
+        matrix, indexed = self._data
+        if not indexed:
+            return [None] * len(queries)
+        matches: List[Optional[SimilarAd]] = []
+        for start in range(0, len(queries), QUERY_CHUNK_ROWS):
+            scores = queries[start:start + QUERY_CHUNK_ROWS] @ matrix.T
+            scores[scores > max_score] = -np.inf
+            nearest = scores.argmax(axis=1)
+            for row, column in enumerate(nearest):
+                score = float(scores[row, column])
+                generation_id, product_text, ad_text = indexed[column]
+                matches.append(SimilarAd(score, product_text, ad_text, generation_id) if score >= threshold else None)
+        return matches
+
+
+_indexes: TTLCache[MemoryIndex] = TTLCache(settings.SIMILARITY_INDEX_TTL_SECONDS, settings.SIMILARITY_INDEX_MAX_SCOPES)
+
+
+def _load_index(scope: Scope, embedder_name: str) -> MemoryIndex:
+    """The scope's index, loaded from its most recent generations. Blocking: run it in a thread."""
+    db = SessionLocal()
+    try:
+        candidates = crud.get_similarity_candidates(
+            db, scope.user_id, scope.platform, scope.tone, scope.max_length, embedder_name,
+            settings.SIMILARITY_INDEX_MAX_ROWS
+        )
+    finally:
+        db.close()
+    index = MemoryIndex(settings.VECTOR_DIMENSION)
+    candidates = candidates[::-1]  # Oldest first, as the index appends
+    if candidates:
+        index.add(
+            np.vstack([np.frombuffer(generation.embedding, dtype=np.float32) for generation in candidates]),
+            [(generation.id, generation.product_text, generation.generated_text) for generation in candidates]
+        )
+    return index
+
+
+async def _search_memory(scope: Scope, embedder_name: str, embeddings: List[List[float]]) -> List[Optional[SimilarAd]]:
+    key = (scope, embedder_name)
+    index = _indexes.get(key)
+    if index is None:
+        index = await asyncio.to_thread(_load_index, scope, embedder_name)
+        _indexes.put(key, index)
+    return await asyncio.to_thread(
+        index.search, np.asarray(embeddings, dtype=np.float32), settings.SIMILARITY_THRESHOLD, settings.SIMILARITY_MAX_SCORE
+    )
+
+
+def _search_db(scope: Scope, embedder_name: str, embeddings: List[List[float]]) -> List[Optional[SimilarAd]]:
+    """Nearest neighbours of all rows in one pgvector query. Blocking: run it in a thread."""
+    db = SessionLocal()
+    try:
+        nearest = crud.get_nearest_ad_generations(
+            db, scope.user_id, scope.platform, scope.tone, scope.max_length, embedder_name, embeddings,
+            settings.SIMILARITY_MAX_SCORE
+        )
+    finally:
+        db.close()
+    matches: List[Optional[SimilarAd]] = [None] * len(embeddings)
+    for position, (generation_id, product_text, ad_text, score) in nearest.items():
+        if score >= settings.SIMILARITY_THRESHOLD:
+            matches[position] = SimilarAd(score, product_text, ad_text, generation_id)
+    return matches
+
+
+def _encode(embedding: List[float]) -> Any:
+    if settings.SIMILARITY_INDEX_BACKEND == "pgvector":
+        return embedding
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+@dataclass
+class SimilarityLookup:
+    """A batch's row embeddings and, by row position, the past ad to adapt (None: generate in full)."""
+
+    scope: Scope
+    embedder_name: str
+    product_texts: List[str]
+    embeddings: List[List[float]]
+    matches: List[Optional[SimilarAd]]
+
+
+def available() -> bool:
+    if not settings.SIMILARITY_REUSE_ENABLED:
+        return False
+    if settings.SIMILARITY_INDEX_BACKEND == "memory" and np is None:
+        logger.warning("Similar-product reuse needs NumPy for SIMILARITY_INDEX_BACKEND=memory; it is disabled.")
+        return False
+    return True
+
+
+async def find_similar(
+    user_id: int, batch: RowBatch, platform: str, tone: str, max_length: int
+) -> Optional[SimilarityLookup]:
+    """
+    Embeds the batch's rows and finds each row's nearest past product in the scope that
+    scores at least SIMILARITY_THRESHOLD (and at most SIMILARITY_MAX_SCORE). None if reuse
+    is disabled or the rows could not be embedded.
+    """
+    if not batch or not available():
+        return None
+    scope = Scope(user_id, platform, tone, max_length)
+    embedder = get_embedder()
+    try:
+        # Cell values only: the headers are the same for every row and would only add to every score.
+        embeddings = await embedder.embed([" ".join(value for value in row.values() if value.strip()) for row in batch])
+    except Exception as e:
+        logger.warning(f"Could not embed {len(batch)} rows for the similar-product search: {e}")
+        return None
+
+    matches: List[Optional[SimilarAd]] = [None] * len(batch)
+    try:
+        if settings.SIMILARITY_INDEX_BACKEND == "pgvector":
+            matches = await asyncio.to_thread(_search_db, scope, embedder.name, embeddings)
+        else:
+            matches = await _search_memory(scope, embedder.name, embeddings)
+    except SQLAlchemyError as e:
+        logger.warning(f"Similar-product search failed for user {user_id}: {e}")
+
+    found = sum(match is not None for match in matches)
+    metrics.increment("similar_products_found_total", found)
+    logger.info(f"Found a similar past product for {found} of {len(batch)} rows (threshold {settings.SIMILARITY_THRESHOLD}).")
+    return SimilarityLookup(scope, embedder.name, batch.to_prompt_fragments(), embeddings, matches)
+
+
+def remember(lookup: SimilarityLookup, ads: Dict[int, str]) -> Dict[int, Dict[str, Any]]:
+    """
+    The AdGeneration column values that make the batch's new ads (by row position) findable
+    by later runs. They are also added to this worker's cached index for the scope.
+    """
+    columns = {
+        position: {
+            "product_text": lookup.product_texts[position],
+            "embedding": _encode(lookup.embeddings[position]),
+            "embedding_model": lookup.embedder_name,
+        }
+        for position in ads
+    }
+    index = _indexes.get((lookup.scope, lookup.embedder_name)) if settings.SIMILARITY_INDEX_BACKEND == "memory" else None
+    if index is not None and ads:
+        index.add(
+            np.asarray([lookup.embeddings[position] for position in ads], dtype=np.float32),
+            [(None, lookup.product_texts[position], ad_text) for position, ad_text in ads.items()]
+        )
+    return columns
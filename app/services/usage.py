@@ -0,0 +1,218 @@
+import logging
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.db import crud
+from app.db.models import User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CallUsage:
+    """Tokens and latency of the model call(s) made for one row (retries add up)."""
+
+    model: Optional[str] = None
+    calls: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    tool_tokens: int = 0  # Prompt tokens added by tool use, e.g. search grounding results
+    thinking_tokens: int = 0
+    cached_tokens: int = 0  # Included in prompt_tokens
+    total_tokens: int = 0
+    latency_seconds: float = 0.0
+
+    def record(self, response: Any, model: str, latency_seconds: float) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        self.model = model
+        self.calls += 1
+        self.latency_seconds += latency_seconds
+        if usage is None:
+            return
+        self._add_tokens(
+            model,
+            prompt_tokens=usage.prompt_token_count or 0,
+            output_tokens=usage.candidates_token_count or 0,
+            tool_tokens=getattr(usage, "tool_use_prompt_token_count", None) or 0,
+            thinking_tokens=getattr(usage, "thoughts_token_count", None) or 0,
+            cached_tokens=usage.cached_content_token_count or 0,
+            total_tokens=usage.total_token_count or 0,
+        )
+
+    def record_json(self, response: Dict[str, Any], model: str, latency_seconds: float) -> None:
+        """Like record, for a response in its REST JSON form (batch prediction results)."""
+        usage = response.get("usageMetadata") or {}
+        self.model = model
+        self.calls += 1
+        self.latency_seconds += latency_seconds
+        self._add_tokens(
+            model,
+            prompt_tokens=usage.get("promptTokenCount", 0),
+            output_tokens=usage.get("candidatesTokenCount", 0),
+            tool_tokens=usage.get("toolUsePromptTokenCount", 0),
+            thinking_tokens=usage.get("thoughtsTokenCount", 0),
+            cached_tokens=usage.get("cachedContentTokenCount", 0),
+            total_tokens=usage.get("totalTokenCount", 0),
+        )
+
+    def _add_tokens(
+        self, model: str, prompt_tokens: int, output_tokens: int, tool_tokens: int,
+        thinking_tokens: int, cached_tokens: int, total_tokens: int
+    ) -> None:
+        self.prompt_tokens += prompt_tokens
+        self.output_tokens += output_tokens
+        self.tool_tokens += tool_tokens
+        self.thinking_tokens += thinking_tokens
+        self.cached_tokens += cached_tokens
+        self.total_tokens += total_tokens or (prompt_tokens + output_tokens + tool_tokens + thinking_tokens)
+        metrics.increment("ai_tokens_total", prompt_tokens, model=model, kind="prompt")
+        metrics.increment("ai_tokens_total", output_tokens, model=model, kind="output")
+        metrics.increment("ai_tokens_total", tool_tokens, model=model, kind="tool")
+
+
+class BatchUsage:
+    """Per-row CallUsage for a batch, keyed by the row's position in the batch sent to the model."""
+
+    def __init__(self) -> None:
+        self.rows: Dict[int, CallUsage] = {}
+
+    def for_row(self, position: int) -> CallUsage:
+        return self.rows.setdefault(position, CallUsage())
+
+    def totals(self) -> Dict[str, Any]:
+        totals = CallUsage()
+        for row_usage in self.rows.values():
+            for name in ("calls", "prompt_tokens", "output_tokens", "tool_tokens",
+                         "thinking_tokens", "cached_tokens", "total_tokens", "latency_seconds"):
+                setattr(totals, name, getattr(totals, name) + getattr(row_usage, name))
+        summary = asdict(totals)
+        del summary["model"]
+        summary["rows"] = len(self.rows)
+        return summary
+
+
+@dataclass
+class BudgetCheck:
+    """How many of a run's rows fit in the remaining token budget."""
+
+    requested_rows: int
+    allowed_rows: int
+    tokens_per_row: float
+    remaining_tokens: Optional[int] = None  # None: no budget applies
+
+    @property
+    def capped(self) -> bool:
+        return self.allowed_rows < self.requested_rows
+
+    @property
+    def estimated_tokens(self) -> int:
+        return int(self.requested_rows * self.tokens_per_row)
+
+
+def _window_start() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=settings.TOKEN_BUDGET_WINDOW_HOURS)
+
+
+def estimate_tokens_per_row(db: Session, user_id: Optional[int]) -> float:
+    """The user's recent average, else everyone's, else TOKEN_ESTIMATE_DEFAULT_PER_ROW."""
+    for scope in ((user_id,) if user_id is not None else ()) + (None,):
+        average = crud.get_average_tokens_per_generation(db, scope, settings.TOKEN_ESTIMATE_SAMPLE_SIZE)
+        if average:
+            return average
+    return float(settings.TOKEN_ESTIMATE_DEFAULT_PER_ROW)
+
+
+def _remaining_tokens(db: Session, user: Optional[User], spreadsheet_id: Optional[str]) -> Optional[int]:
+    since = _window_start()
+    remaining: List[int] = []
+    if user is not None:
+        user_budget = user.token_budget if user.token_budget is not None else settings.USER_TOKEN_BUDGET
+        if user_budget:
+            remaining.append(user_budget - crud.get_token_usage(db, since, user_id=user.id)["total_tokens"])
+    if spreadsheet_id and settings.SPREADSHEET_TOKEN_BUDGET:
+        used = crud.get_token_usage(db, since, spreadsheet_id=spreadsheet_id)["total_tokens"]
+        remaining.append(settings.SPREADSHEET_TOKEN_BUDGET - used)
+    return max(0, min(remaining)) if remaining else None
+
+
+def check_budget(db: Session, user: Optional[User], spreadsheet_id: Optional[str], row_count: int) -> BudgetCheck:
+    """
+    Estimates a run's token cost up front and caps its rows to what the remaining user and
+    spreadsheet budgets allow (0 rows: refuse the run). Fails open if usage cannot be read.
+    """
+    if not settings.TOKEN_BUDGET_ENABLED or not row_count:
+        return BudgetCheck(row_count, row_count, 0.0)
+    try:
+        tokens_per_row = estimate_tokens_per_row(db, user.id if user else None)
+        remaining = _remaining_tokens(db, user, spreadsheet_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not read token usage, running without a budget check: {e}")
+        db.rollback()
+        return BudgetCheck(row_count, row_count, 0.0)
+    if remaining is None:
+        return BudgetCheck(row_count, row_count, tokens_per_row)
+    allowed_rows = min(row_count, int(remaining // tokens_per_row))
+    if allowed_rows < row_count:
+        metrics.increment("token_budget_capped_runs_total", refused=allowed_rows == 0)
+    return BudgetCheck(row_count, allowed_rows, tokens_per_row, remaining)
+
+
+def record_generations(
+    db: Session,
+    user_id: Optional[int],
+    spreadsheet_id: Optional[str],
+    batch_usage: BatchUsage,
+    rows: List[Tuple[int, Optional[int], List[str]]],
+    platform: str,
+    generation_params: Dict[str, Any],
+    row_columns: Optional[Dict[int, Dict[str, Any]]] = None,
+) -> None:
+    """
+    Persists one AdGeneration, with its token usage, per generated row. `rows` holds
+    (batch position, sheet row number, ads); `generation_params` is shared by the run.
+    `row_columns` adds column values to some rows, by batch position (see similarity.remember).
+    """
+    generations = []
+    for position, sheet_row, ads in rows:
+        row_usage = batch_usage.rows.get(position, CallUsage())
+        generations.append({
+            **(row_columns or {}).get(position, {}),
+            "user_id": user_id,
+            "spreadsheet_id": spreadsheet_id,
+            "generated_text": "\n\n".join(ads),
+            "generation_params": {
+                **generation_params,
+                "sheet_row": sheet_row,
+                "calls": row_usage.calls,
+                "cached_tokens": row_usage.cached_tokens,
+                "thinking_tokens": row_usage.thinking_tokens,
+            },
+            "platform": platform,
+            "model": row_usage.model,
+            "prompt_tokens": row_usage.prompt_tokens,
+            "output_tokens": row_usage.output_tokens,
+            "tool_tokens": row_usage.tool_tokens,
+            "total_tokens": row_usage.total_tokens,
+            "latency_seconds": round(row_usage.latency_seconds, 3),
+        })
+    try:
+        crud.create_ad_generations(db, generations)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not record {len(generations)} ad generations for spreadsheet {spreadsheet_id}: {e}")
+        db.rollback()
+
+
+def usage_summary(db: Session, user_id: int) -> Dict[str, Any]:
+    """The user's usage over the budget window, overall and per spreadsheet."""
+    since = _window_start()
+    return {
+        "window_hours": settings.TOKEN_BUDGET_WINDOW_HOURS,
+        "totals": crud.get_token_usage(db, since, user_id=user_id),
+        "spreadsheets": crud.get_token_usage_by_spreadsheet(db, user_id, since),
+    }
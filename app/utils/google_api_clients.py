@@ -1,66 +1,265 @@
+import asyncio
+import json
 import logging
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Dict, List, Optional, Set
 
 import aiohttp
 
+try:
+    import orjson
+except ImportError:  # Optional speedup (pip install 'gsheet-ads-text-bycline[speedups]')
+    orjson = None
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.utils.sheet_values_cache import values_cache
+from app.utils.sheets_quota import (READ, WRITE, QuotaExceeded, backoff_delay,
+                                    parse_retry_after, quota_manager, user_key)
+from app.utils.ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+_background_tasks: Set[asyncio.Task] = set()
+# OAuth userinfo by user_key(token); tokens themselves are never stored.
+_user_info_cache: TTLCache[Dict[str, Any]] = TTLCache(settings.USER_INFO_CACHE_TTL_SECONDS, settings.AUTH_CACHE_MAX_ENTRIES)
+
 GOOGLE_SHEETS_API_BASE_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+GOOGLE_DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+GOOGLE_USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+# Google APIs only gzip responses when the User-Agent also contains "gzip".
+COMPRESSION_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "gsheet-ads-text-bycline/0.1 (gzip)",
+}
+
+
+def _client_timeout(deadline: Optional[Deadline]) -> aiohttp.ClientTimeout:
+    """Per-call timeout: the configured cap, shortened to whatever is left of the request deadline."""
+    if deadline is None:
+        return aiohttp.ClientTimeout(total=settings.SHEETS_REQUEST_TIMEOUT_SECONDS)
+    # aiohttp treats total=0 as "no timeout", so an exhausted deadline still gets a tiny positive value.
+    return aiohttp.ClientTimeout(total=max(0.01, deadline.timeout(cap=settings.SHEETS_REQUEST_TIMEOUT_SECONDS)))
+
+
+def _api_headers(token: str, **extra: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}", "Accept": "application/json", **COMPRESSION_HEADERS, **extra}
+
+
+async def _read_json(response: aiohttp.ClientResponse, api: str) -> Dict[str, Any]:
+    """Decodes a JSON response body (orjson when installed) and records wire size and decode time."""
+    body = await response.read()  # aiohttp has already gunzipped it
+    wire_bytes = response.content_length if response.content_length is not None else len(body)
+    metrics.observe("google_api_response_bytes", wire_bytes, api=api, encoding=response.headers.get("Content-Encoding", "identity"))
+    started_at = time.perf_counter()
+    data = orjson.loads(body) if orjson is not None else json.loads(body)
+    metrics.observe("google_api_decode_seconds", time.perf_counter() - started_at, api=api)
+    return data
+
+
+async def _send_with_quota(
+    method: str,
+    url: str,
+    token: str,
+    kind: str,
+    deadline: Optional[Deadline] = None,
+    **request_kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Sends one Sheets API request through the quota manager: waits for a project and
+    per-user quota slot, then retries 429 and 5xx responses with jittered exponential
+    backoff (at least the server's Retry-After) while the deadline allows.
+    Raises QuotaExceeded, aiohttp.ClientError or asyncio.TimeoutError when it gives up.
+    """
+    attempt = 0
+    async with aiohttp.ClientSession() as session:
+        while True:
+            wait = quota_manager.reserve(token, kind, max_wait=deadline.timeout() if deadline else None)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with session.request(method, url, timeout=_client_timeout(deadline), **request_kwargs) as response:
+                if response.status != 429 and response.status < 500:
+                    response.raise_for_status()  # Raises an exception for other HTTP errors 4xx
+                    return await _read_json(response, api=f"sheets_{kind}")
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = backoff_delay(attempt, retry_after)
+                metrics.increment("sheets_retryable_errors_total", kind=kind, status=response.status)
+                if response.status == 429:
+                    quota_manager.on_rate_limited(token, kind, delay)
+                out_of_time = deadline is not None and not deadline.has_time_for(delay)
+                if attempt == settings.SHEETS_MAX_RETRIES or out_of_time:
+                    response.raise_for_status()
+                logger.warning(
+                    f"Sheets API returned {response.status} for {method} {url}; "
+                    f"retry {attempt + 1}/{settings.SHEETS_MAX_RETRIES} in {delay:.1f}s."
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
 
 
 async def get_sheet_values(
-    token: str, spreadsheet_id: str, range_a1: str
+    token: str, spreadsheet_id: str, range_a1: str, deadline: Optional[Deadline] = None
 ) -> Optional[List[List[Any]]]:
     """
     Fetches values from a Google Sheet range using the Sheets API.
     """
     url = f"{GOOGLE_SHEETS_API_BASE_URL}/{spreadsheet_id}/values/{range_a1}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
+    params = {
+        "majorDimension": "ROWS",
+        "valueRenderOption": "FORMATTED_VALUE",
+        "fields": "values",  # Skip echoing back range/majorDimension
     }
     logger.info(f"Fetching sheet values from URL: {url}")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()  # Raises an exception for HTTP errors 4xx/5xx
-                data = await response.json()
-                logger.info(f"Successfully fetched sheet values for range {range_a1}. Values: {data.get('values')}")
-                return data.get("values")
+        data = await _send_with_quota("GET", url, token, READ, deadline, headers=_api_headers(token), params=params)
+        logger.info(f"Successfully fetched sheet values for range {range_a1}. Rows: {len(data.get('values') or [])}")
+        return data.get("values")
+    except QuotaExceeded as e:
+        logger.error(f"Not fetching sheet values for range {range_a1}: {e}")
     except aiohttp.ClientError as e:
         logger.error(f"AIOHTTP client error fetching sheet values for range {range_a1}: {e}", exc_info=True)
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out fetching sheet values for range {range_a1}.")
     except Exception as e:
         logger.error(f"Unexpected error fetching sheet values for range {range_a1}: {e}", exc_info=True)
     return None
 
 
 async def update_sheet_values(
-    token: str, spreadsheet_id: str, range_a1: str, values: List[List[Any]]
+    token: str, spreadsheet_id: str, range_a1: str, values: List[List[Any]],
+    deadline: Optional[Deadline] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Updates values in a Google Sheet range using the Sheets API.
+    None cells are sent as JSON null, which the API skips (the existing cell is left as is).
     """
-    url = f"{GOOGLE_SHEETS_API_BASE_URL}/{spreadsheet_id}/values/{range_a1}?valueInputOption=USER_ENTERED"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json",
+    url = f"{GOOGLE_SHEETS_API_BASE_URL}/{spreadsheet_id}/values/{range_a1}"
+    params = {
+        "valueInputOption": "USER_ENTERED",
+        "includeValuesInResponse": "false",
+        "fields": "updatedRange,updatedRows,updatedCells",
     }
     body = {
         "range": range_a1,
         "majorDimension": "ROWS",
         "values": values,
     }
-    logger.info(f"Updating sheet values at URL: {url} with body: {body}")
+    logger.info(f"Updating sheet values at URL: {url} ({len(values)} rows)")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.put(url, headers=headers, json=body) as response:
-                response.raise_for_status()
-                result = await response.json()
-                logger.info(f"Successfully updated sheet values for range {range_a1}. Result: {result}")
-                return result
+        result = await _send_with_quota(
+            "PUT", url, token, WRITE, deadline,
+            headers=_api_headers(token, **{"Content-Type": "application/json"}), params=params, json=body
+        )
+        logger.info(f"Successfully updated sheet values for range {range_a1}. Result: {result}")
+        return result
+    except QuotaExceeded as e:
+        logger.error(f"Not updating sheet values for range {range_a1}: {e}")
     except aiohttp.ClientError as e:
         logger.error(f"AIOHTTP client error updating sheet values for range {range_a1}: {e}", exc_info=True)
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out updating sheet values for range {range_a1}.")
     except Exception as e:
         logger.error(f"Unexpected error updating sheet values for range {range_a1}: {e}", exc_info=True)
     return None
+
+
+async def get_spreadsheet_version(
+    token: str, spreadsheet_id: str, deadline: Optional[Deadline] = None
+) -> Optional[str]:
+    """
+    Returns the spreadsheet's Drive file version, which increases on every change to
+    its content. A few hundred bytes instead of the values themselves, so it is a cheap
+    "has anything changed" check. Returns None if Drive metadata is not accessible.
+    """
+    url = f"{GOOGLE_DRIVE_FILES_URL}/{spreadsheet_id}"
+    params = {"fields": "version,modifiedTime", "supportsAllDrives": "true"}
+    try:
+        async with aiohttp.ClientSession(timeout=_client_timeout(deadline)) as session:
+            async with session.get(url, headers=_api_headers(token), params=params) as response:
+                response.raise_for_status()
+                data = await _read_json(response, api="drive_version")
+                return data.get("version") or data.get("modifiedTime")
+    except aiohttp.ClientError as e:
+        logger.warning(f"Could not read Drive version of spreadsheet {spreadsheet_id}: {e}")
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out reading Drive version of spreadsheet {spreadsheet_id}.")
+    return None
+
+
+async def get_user_info(token: str) -> Optional[Dict[str, Any]]:
+    """
+    The OAuth userinfo (email, name) of a token's user, cached per token for
+    USER_INFO_CACHE_TTL_SECONDS. Returns None if it cannot be read.
+    """
+    key = user_key(token)
+    user_info = _user_info_cache.get(key)
+    if user_info is not None:
+        return user_info
+    try:
+        async with aiohttp.ClientSession(timeout=_client_timeout(None)) as session:
+            async with session.get(GOOGLE_USERINFO_URL, headers=_api_headers(token)) as response:
+                response.raise_for_status()
+                user_info = await _read_json(response, api="userinfo")
+    except aiohttp.ClientError as e:
+        logger.warning(f"Could not read userinfo: {e}")
+        return None
+    except asyncio.TimeoutError:
+        logger.warning("Timed out reading userinfo.")
+        return None
+    _user_info_cache.put(key, user_info)
+    return user_info
+
+
+async def get_sheet_values_cached(
+    token: str, spreadsheet_id: str, range_a1: str, deadline: Optional[Deadline] = None,
+    version: Optional[str] = None
+) -> Optional[List[List[Any]]]:
+    """
+    get_sheet_values, served from memory when the spreadsheet's Drive version matches the
+    version the range was last read at. The version is checked with the caller's own token,
+    so cached values are only returned to users who can still open the file. Pass the
+    `version` the caller just read with that token to read several ranges against one
+    Drive lookup; otherwise it is looked up here. Falls back to a plain read when caching
+    is disabled or the version is unavailable.
+    """
+    if not settings.SHEETS_VALUES_CACHE_ENABLED:
+        return await get_sheet_values(token, spreadsheet_id, range_a1, deadline=deadline)
+
+    if version is None:
+        version = await get_spreadsheet_version(token, spreadsheet_id, deadline=deadline)
+    if version is not None:
+        cached_values = values_cache.get(spreadsheet_id, range_a1, version)
+        if cached_values is not None:
+            logger.info(f"Serving {range_a1} from cache (spreadsheet version {version} unchanged).")
+            return cached_values
+
+    values = await get_sheet_values(token, spreadsheet_id, range_a1, deadline=deadline)
+    if version is not None and values is not None:
+        values_cache.put(spreadsheet_id, range_a1, version, values)
+    return values
+
+
+async def _restamp_cached_ranges(token: str, spreadsheet_id: str, version_before_write: str, written_range: str) -> None:
+    version_after_write = await get_spreadsheet_version(token, spreadsheet_id)
+    if version_after_write is None:
+        values_cache.invalidate(spreadsheet_id)
+        return
+    kept = values_cache.restamp(spreadsheet_id, version_before_write, version_after_write, written_range)
+    logger.info(f"Kept {kept} cached range(s) of {spreadsheet_id} valid across our write to {written_range}.")
+
+
+def schedule_cache_restamp(token: str, spreadsheet_id: str, version_before_write: Optional[str], written_range: str) -> None:
+    """
+    Our own writes bump the spreadsheet version too, which would make the next Generate
+    click re-read the unchanged input range. Given the version the run read its ranges at,
+    re-stamps cached ranges the write did not touch with the new version, off the request
+    path. An edit landing between that read and the write can slip through.
+    """
+    if version_before_write is None:
+        values_cache.invalidate(spreadsheet_id)
+        return
+    task = asyncio.create_task(_restamp_cached_ranges(token, spreadsheet_id, version_before_write, written_range))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
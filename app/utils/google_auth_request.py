@@ -0,0 +1,52 @@
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# google.oauth2.id_token downloads Google's public certs on every verification unless the
+# transport caches them. The certs response carries Cache-Control: max-age (several hours,
+# shorter than Google's key rotation), so honouring it makes most verifications pure CPU.
+GOOGLE_OAUTH2_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class CachingRequest:
+    """
+    A google.auth transport Request that serves repeated GETs of the same URL from memory
+    for as long as the response's Cache-Control max-age allows. The underlying
+    google.auth.transport.requests.Request is built on first use, keeping its imports
+    out of module load (see app.core.warmup).
+    """
+
+    def __init__(self) -> None:
+        self._inner: Optional[Any] = None
+        self._responses: Dict[str, Tuple[Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url: str, method: str = "GET", body: Any = None, headers: Any = None, **kwargs: Any) -> Any:
+        if method != "GET" or body is not None:
+            return self._send(url, method=method, body=body, headers=headers, **kwargs)
+        with self._lock:
+            entry = self._responses.get(url)
+        if entry is not None and time.monotonic() < entry[1]:
+            return entry[0]
+        response = self._send(url, method=method, headers=headers, **kwargs)
+        max_age = MAX_AGE.search(response.headers.get("cache-control", "")) if response.status == 200 else None
+        if max_age and int(max_age.group(1)) > 0:
+            with self._lock:
+                self._responses[url] = (response, time.monotonic() + int(max_age.group(1)))
+        return response
+
+    def _send(self, url: str, **kwargs: Any) -> Any:
+        if self._inner is None:
+            from google.auth.transport import requests as google_auth_requests
+            self._inner = google_auth_requests.Request()
+        return self._inner(url, **kwargs)
+
+
+auth_request = CachingRequest()
+
+
+def warm_certs() -> None:
+    """Fetches Google's ID token certs into auth_request's cache (blocking; run it in a thread)."""
+    auth_request(GOOGLE_OAUTH2_CERTS_URL)
@@ -0,0 +1,156 @@
+from collections.abc import Mapping
+from itertools import zip_longest
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from app.utils.sheets_utils import infer_column_roles
+
+
+class RowBatch:
+    """
+    Columnar storage for sheet rows sharing one header schema.
+
+    Instead of one {header: value} dict per row, each column is a single list of strings
+    and rows are exposed as lightweight RowView mappings. Headers are stored once, and
+    prompt serialization encodes each header key once per batch rather than once per row.
+    Row semantics match build_row_dicts: values are str()-ed, short rows are padded with ""
+    and for duplicate headers the last column wins (keeping the first header position).
+
+    `column_roles` maps semantic roles (name, description, specifications, cta_link) to
+    column positions in this batch, so downstream stages read e.g. a row's name by index.
+    """
+
+    __slots__ = ("headers", "columns", "column_roles", "_header_index", "_row_count")
+
+    def __init__(
+        self,
+        headers: Sequence[str],
+        columns: List[List[str]],
+        row_count: Optional[int] = None,
+        column_roles: Optional[Dict[str, int]] = None,
+    ):
+        if len(headers) != len(columns):
+            raise ValueError("RowBatch needs exactly one column per header.")
+        self.headers: List[str] = list(headers)
+        self.columns = columns
+        self._row_count = row_count if row_count is not None else (len(columns[0]) if columns else 0)
+        self._header_index: Dict[str, int] = {header: i for i, header in enumerate(self.headers)}
+        self.column_roles: Dict[str, int] = (
+            column_roles if column_roles is not None else infer_column_roles(self.headers)
+        )
+
+    @classmethod
+    def from_values(
+        cls,
+        headers: Sequence[str],
+        rows: Sequence[Sequence[Any]],
+        column_roles: Optional[Dict[str, int]] = None,
+    ) -> "RowBatch":
+        """
+        Builds a batch from Sheets-style row lists (as returned by values.get).
+        `column_roles` (role -> index into `headers`, e.g. from the header mapping cache)
+        skips re-inferring roles from the header names.
+        """
+        # Same key semantics as a dict: first position, last value.
+        source_index: Dict[str, int] = {}
+        for i, header in enumerate(headers):
+            source_index[header] = i
+
+        # Transpose once; ragged rows are padded with "".
+        transposed = list(zip_longest(*rows, fillvalue="")) if rows else []
+        empty_column = [""] * len(rows)
+        columns = []
+        for i in source_index.values():
+            if i < len(transposed):
+                columns.append(list(map(str, transposed[i])))
+            else:
+                columns.append(empty_column)
+        del transposed  # Only the string columns are kept
+
+        schema = list(source_index)
+        batch_roles = None
+        if column_roles is not None:
+            # Re-point roles at batch positions (they differ from sheet positions if headers repeat).
+            schema_index = {header: i for i, header in enumerate(schema)}
+            batch_roles = {
+                role: schema_index[headers[index]]
+                for role, index in column_roles.items()
+                if index < len(headers)
+            }
+        return cls(schema, columns, row_count=len(rows), column_roles=batch_roles)
+
+    @classmethod
+    def from_dicts(cls, rows: Sequence[Dict[str, str]]) -> "RowBatch":
+        """Builds a batch from {header: value} dicts sharing the first row's keys."""
+        headers = list(rows[0].keys()) if rows else []
+        columns = [[str(row.get(header, "")) for row in rows] for header in headers]
+        return cls(headers, columns, row_count=len(rows))
+
+    def __len__(self) -> int:
+        return self._row_count
+
+    def __getitem__(self, index: int) -> "RowView":
+        if not -len(self) <= index < len(self):
+            raise IndexError("RowBatch index out of range")
+        return RowView(self, index % len(self))
+
+    def __iter__(self) -> Iterator["RowView"]:
+        return (RowView(self, i) for i in range(len(self)))
+
+    def take(self, positions: Sequence[int]) -> "RowBatch":
+        """A new batch holding only the rows at `positions` (same headers and column roles)."""
+        columns = [[column[i] for i in positions] for column in self.columns]
+        return RowBatch(self.headers, columns, row_count=len(positions), column_roles=self.column_roles)
+
+    def to_prompt_fragments(self) -> List[str]:
+        """
+        Serializes every row as the JSON object the prompt embeds, byte-for-byte equal to
+        json.dumps(row_dict, indent=2), without building per-row dicts.
+        """
+        if not self.headers:
+            return ["{}"] * len(self)
+        prefixes = ["  " + encode_basestring_ascii(header) + ": " for header in self.headers]
+        encode = encode_basestring_ascii
+        return [
+            "{\n" + ",\n".join([prefix + encode(value) for prefix, value in zip(prefixes, cells)]) + "\n}"
+            for cells in zip(*self.columns)
+        ]
+
+
+class RowView(Mapping):
+    """Read-only {header: value} view of one row of a RowBatch."""
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: RowBatch, index: int):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, header: str) -> str:
+        return self._batch.columns[self._batch._header_index[header]][self._index]
+
+    def value_at(self, column_index: int) -> str:
+        return self._batch.columns[column_index][self._index]
+
+    def role(self, role: str, default: str = "") -> str:
+        """Value of the column mapped to `role` (e.g. "name"), or `default` if no column has that role."""
+        column_index = self._batch.column_roles.get(role)
+        return default if column_index is None else self._batch.columns[column_index][self._index]
+
+    @property
+    def batch(self) -> RowBatch:
+        return self._batch
+
+    @property
+    def position(self) -> int:
+        """Index of this row within its batch."""
+        return self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._batch.headers)
+
+    def __len__(self) -> int:
+        return len(self._batch.headers)
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self)!r})"
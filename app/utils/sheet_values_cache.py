@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from app.core import metrics
+from app.core.config import settings
+from app.utils.sheets_utils import col_to_num, get_sheet_name_and_columns_from_range
+
+CacheKey = Tuple[str, str]  # (spreadsheet_id, range_a1)
+
+
+def ranges_may_overlap(range_a: str, range_b: str) -> bool:
+    """
+    Conservative column-level overlap test for two A1 ranges: False only when they are
+    on different named sheets or their column spans are disjoint.
+    """
+    parsed_a = get_sheet_name_and_columns_from_range(range_a)
+    parsed_b = get_sheet_name_and_columns_from_range(range_b)
+    if parsed_a is None or parsed_b is None:
+        return True
+    sheet_a, start_a, end_a = parsed_a
+    sheet_b, start_b, end_b = parsed_b
+    if sheet_a and sheet_b and sheet_a != sheet_b:
+        return False
+    return col_to_num(start_a) <= col_to_num(end_b) and col_to_num(start_b) <= col_to_num(end_a)
+
+
+class SheetValuesCache:
+    """
+    LRU cache of range values, each stored with the spreadsheet version it was read at.
+    A lookup only hits when the caller's current version matches, so any edit to the
+    spreadsheet (which bumps its Drive version) invalidates every range cached for it.
+    Bounded both by entry count and by total cell count.
+    """
+
+    def __init__(self, max_entries: int, max_cells: int):
+        self.max_entries = max_entries
+        self.max_cells = max_cells
+        self._entries: "OrderedDict[CacheKey, Tuple[str, List[List[Any]], int]]" = OrderedDict()
+        self._cells = 0
+        self._lock = threading.Lock()
+
+    def get(self, spreadsheet_id: str, range_a1: str, version: str) -> Optional[List[List[Any]]]:
+        key = (spreadsheet_id, range_a1)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._drop(key)  # Stale: the spreadsheet changed since this range was read
+                metrics.increment("sheets_values_cache_misses_total")
+                return None
+            self._entries.move_to_end(key)
+        metrics.increment("sheets_values_cache_hits_total")
+        return entry[1]
+
+    def put(self, spreadsheet_id: str, range_a1: str, version: str, values: List[List[Any]]) -> None:
+        cells = sum(len(row) for row in values)
+        if cells > self.max_cells:
+            return
+        key = (spreadsheet_id, range_a1)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, values, cells)
+            self._cells += cells
+            while len(self._entries) > self.max_entries or self._cells > self.max_cells:
+                self._drop(next(iter(self._entries)))
+
+    def restamp(self, spreadsheet_id: str, from_version: str, to_version: str, written_range: str) -> int:
+        """
+        Carries ranges cached at `from_version` over to `to_version` after our own write
+        to `written_range`, which bumped the version without touching them. Ranges that
+        may overlap the write are dropped. Returns the number of ranges kept.
+        """
+        kept = 0
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == spreadsheet_id]:
+                version, values, cells = self._entries[key]
+                if version != from_version or ranges_may_overlap(key[1], written_range):
+                    self._drop(key)
+                else:
+                    self._entries[key] = (to_version, values, cells)
+                    kept += 1
+        return kept
+
+    def invalidate(self, spreadsheet_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == spreadsheet_id]:
+                self._drop(key)
+
+    def _drop(self, key: CacheKey) -> None:
+        _, _, cells = self._entries.pop(key)
+        self._cells -= cells
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+values_cache = SheetValuesCache(
+    max_entries=settings.SHEETS_VALUES_CACHE_MAX_ENTRIES,
+    max_cells=settings.SHEETS_VALUES_CACHE_MAX_CELLS,
+)
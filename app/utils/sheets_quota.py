@@ -0,0 +1,151 @@
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Tuple
+
+from app.core import metrics
+from app.core.config import settings
+
+# Sheets API quotas are per minute, counted separately for read and write requests,
+# both per project and per user. Requests reserve a slot in the project bucket and in
+# the caller's user bucket before they are sent; when a bucket is empty the request
+# waits for its slot instead of being sent and rejected with a 429.
+
+READ = "read"
+WRITE = "write"
+
+
+class QuotaExceeded(Exception):
+    """Raised when a request would have to wait past its deadline for a quota slot."""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_second` up to `capacity`.
+
+    `reserve()` always takes a token, letting the balance go negative, and returns how
+    long the caller must wait for it. Later callers queue behind earlier ones, so a
+    burst is spread out at the refill rate in arrival order (FIFO) rather than rejected.
+    """
+
+    def __init__(self, capacity: float, rate_per_second: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate_per_second = rate_per_second
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1.0
+            wait = max(0.0, -self._tokens / self.rate_per_second, self._blocked_until - now)
+            return wait
+
+    def cancel(self) -> None:
+        """Returns a reserved token (the caller gave up before using it)."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1.0)
+
+    def block_for(self, seconds: float) -> None:
+        """Holds every new reservation back for `seconds` (after a 429 with Retry-After)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+def _per_minute_bucket(requests_per_minute: float) -> TokenBucket:
+    # Capacity of a few seconds' worth of requests: small bursts go straight through.
+    rate = requests_per_minute / 60.0
+    return TokenBucket(capacity=max(1.0, rate * settings.SHEETS_QUOTA_BURST_SECONDS), rate_per_second=rate)
+
+
+def user_key(token: str) -> str:
+    """Stable, non-reversible identity for an OAuth token (tokens themselves are never stored)."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+class SheetsQuotaManager:
+    """Project-wide and per-user token buckets for Sheets read and write requests."""
+
+    def __init__(self) -> None:
+        self._project_buckets = {
+            READ: _per_minute_bucket(settings.SHEETS_PROJECT_READS_PER_MINUTE),
+            WRITE: _per_minute_bucket(settings.SHEETS_PROJECT_WRITES_PER_MINUTE),
+        }
+        self._user_buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, token: str, kind: str) -> TokenBucket:
+        key = (user_key(token), kind)
+        with self._lock:
+            bucket = self._user_buckets.get(key)
+            if bucket is None:
+                per_minute = (
+                    settings.SHEETS_USER_READS_PER_MINUTE if kind == READ else settings.SHEETS_USER_WRITES_PER_MINUTE
+                )
+                bucket = self._user_buckets[key] = _per_minute_bucket(per_minute)
+            self._user_buckets.move_to_end(key)
+            while len(self._user_buckets) > settings.SHEETS_QUOTA_MAX_USERS:
+                self._user_buckets.popitem(last=False)
+            return bucket
+
+    def reserve(self, token: str, kind: str, max_wait: Optional[float] = None) -> float:
+        """
+        Reserves one request slot in both the project and the user bucket and returns the
+        seconds to wait before sending. Raises QuotaExceeded (returning the slots) if that
+        wait is longer than `max_wait`.
+        """
+        buckets = (self._project_buckets[kind], self._user_bucket(token, kind))
+        wait = max(bucket.reserve() for bucket in buckets)
+        if max_wait is not None and wait > max_wait:
+            for bucket in buckets:
+                bucket.cancel()
+            metrics.increment("sheets_quota_rejected_total", kind=kind)
+            raise QuotaExceeded(f"Sheets {kind} quota would need a {wait:.1f}s wait (limit {max_wait:.1f}s).")
+        metrics.observe("sheets_quota_wait_seconds", wait, kind=kind)
+        return wait
+
+    def on_rate_limited(self, token: str, kind: str, retry_after: float) -> None:
+        """After a 429, hold back this user's other requests until the quota window resets."""
+        self._user_bucket(token, kind).block_for(retry_after)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date); None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Delay before retry number `attempt` (0-based): full-jitter exponential backoff,
+    but never shorter than the server's Retry-After.
+    """
+    ceiling = min(settings.SHEETS_RETRY_MAX_DELAY_SECONDS, settings.SHEETS_RETRY_BASE_DELAY_SECONDS * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+quota_manager = SheetsQuotaManager()
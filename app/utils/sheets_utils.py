@@ -1,6 +1,6 @@
 import logging
 import re
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -92,3 +92,63 @@ def construct_header_range(data_range_a1: str, header_row_number: int) -> Option
     if sheet_name:
         return f"'{sheet_name}'!{header_range_str}"
     return header_range_str
+
+
+# Keywords used to infer what a header column means. Roles are checked in this
+# order so that e.g. "Product Description" is a description, not a name.
+COLUMN_ROLE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "description": ("description", "desc", "details", "summary", "about"),
+    "specifications": ("specification", "specs", "spec", "features", "attributes"),
+    "cta_link": ("cta", "link", "url", "landing page", "website"),
+    "name": ("name", "title", "product"),
+}
+
+
+def infer_column_roles(headers: List[str]) -> Dict[str, int]:
+    """
+    Infers semantic roles (name, description, specifications, cta_link) from header names.
+    Returns a dict mapping role -> 0-indexed column position. The first matching column wins
+    and each column is assigned at most one role; roles with no matching header are omitted.
+    e.g., ['Product Name', 'Description', 'Link'] -> {'name': 0, 'description': 1, 'cta_link': 2}
+    """
+    roles: Dict[str, int] = {}
+    for index, header in enumerate(headers):
+        normalized = str(header).strip().lower()
+        if not normalized:
+            continue
+        for role, keywords in COLUMN_ROLE_KEYWORDS.items():
+            if any(keyword in normalized for keyword in keywords):
+                roles.setdefault(role, index)
+                break
+    return roles
+
+
+def group_row_spans(row_numbers: List[int]) -> List[Tuple[int, int]]:
+    """
+    Groups row numbers into contiguous inclusive (first, last) spans.
+    e.g., [5, 6, 7, 10, 12, 13] -> [(5, 7), (10, 10), (12, 13)]
+    """
+    spans: List[Tuple[int, int]] = []
+    for row_number in sorted(row_numbers):
+        if spans and row_number == spans[-1][1] + 1:
+            spans[-1] = (spans[-1][0], row_number)
+        else:
+            spans.append((row_number, row_number))
+    return spans
+
+
+def build_row_dicts(headers: List[str], rows: List[List[Any]]) -> List[Dict[str, str]]:
+    """
+    Turns raw row values into {header: value} dicts, as the AI service expects.
+    Values are stringified; rows with fewer cells than headers are padded with "".
+    """
+    products = []
+    for row_values in rows:
+        product_data = {}
+        for i, header_name in enumerate(headers):
+            if i < len(row_values):
+                product_data[header_name] = str(row_values[i])  # Ensure value is string
+            else:
+                product_data[header_name] = ""  # Handle rows with fewer cells than headers
+        products.append(product_data)
+    return products
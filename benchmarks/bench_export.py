@@ -0,0 +1,123 @@
+"""
+Exporting a user's generation history from a seeded local Postgres (DATABASE_URL): the
+list-based path (get_ad_generations_by_user loading every row, then serializing) vs the
+streaming export (server-side cursor, EXPORT_BATCH_ROWS per chunk). Reports time to first
+byte, total time, rows/s and the process's peak RSS. Each mode runs in its own
+subprocess, so peak RSS is that mode's alone.
+
+The first run seeds a benchmark user with --rows generations (one INSERT ... SELECT over
+generate_series); later runs reuse them unless --reseed is given.
+
+    docker-compose up -d db
+    python benchmarks/bench_export.py --rows 1000000
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import text  # noqa: E402
+
+from app.db import crud  # noqa: E402
+from app.db.models import Base  # noqa: E402
+from app.db.session import SessionLocal, engine  # noqa: E402
+from app.services import export  # noqa: E402
+
+BENCH_GOOGLE_SUB = "export-bench"
+BENCH_EMAIL = "export-bench@example.com"
+MODES = ("list", "ndjson", "csv")
+
+SEED_SQL = text("""
+    INSERT INTO ad_generations (
+        user_id, spreadsheet_id, generated_text, generation_params, platform, model,
+        prompt_tokens, output_tokens, tool_tokens, total_tokens, latency_seconds, created_at
+    )
+    SELECT
+        :user_id,
+        'sheet-' || (g % 50),
+        'Discover product ' || g || ': comfortable, durable and made to last. Order today and get free shipping!',
+        json_build_object('source', 'sheet', 'tone', 'Professional', 'max_length', 150, 'sheet_row', g % 5000 + 2),
+        CASE WHEN g % 3 = 0 THEN 'Instagram' ELSE 'Facebook' END,
+        'gemini-1.5-flash-latest',
+        420, 60, 0, 480, 1.25,
+        now() - make_interval(secs => :rows - g)
+    FROM generate_series(1, :rows) AS g
+""")
+
+
+def bench_user_id(reseed: bool, rows: int) -> int:
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    try:
+        user = crud.get_or_create_workspace_user(db, BENCH_GOOGLE_SUB, BENCH_EMAIL)
+        seeded = db.execute(text("SELECT count(*) FROM ad_generations WHERE user_id = :user_id"), {"user_id": user.id}).scalar()
+        if reseed or seeded != rows:
+            print(f"Seeding {rows:,} generations for user {user.id}...", flush=True)
+            started_at = time.perf_counter()
+            db.execute(text("DELETE FROM ad_generations WHERE user_id = :user_id"), {"user_id": user.id})
+            db.execute(SEED_SQL, {"user_id": user.id, "rows": rows})
+            db.commit()
+            db.execute(text("ANALYZE ad_generations"))
+            print(f"Seeded in {time.perf_counter() - started_at:.1f}s", flush=True)
+        return user.id
+    finally:
+        db.close()
+
+
+def export_as_list(user_id: int, rows: int):
+    """The pre-export way to pull history: every row as an ORM object, then serialized."""
+    db = SessionLocal()
+    try:
+        generations = crud.get_ad_generations_by_user(db, user_id, skip=0, limit=rows)
+        columns = [column.name for column in generations[0].__table__.columns if column.name != "embedding"] if generations else []
+        for generation in generations:
+            yield (json.dumps({name: getattr(generation, name) for name in columns}, default=str) + "\n").encode("utf-8")
+    finally:
+        db.close()
+
+
+def run_mode(mode: str, user_id: int, rows: int) -> None:
+    started_at = time.perf_counter()
+    first_byte, total_bytes = None, 0
+    chunks = export_as_list(user_id, rows) if mode == "list" else export.stream_generations(user_id, export.ExportFilters(), mode)
+    for chunk in chunks:
+        if first_byte is None and chunk:
+            first_byte = time.perf_counter() - started_at
+        total_bytes += len(chunk)
+    elapsed = time.perf_counter() - started_at
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(json.dumps({"first_byte_s": first_byte, "elapsed_s": elapsed, "bytes": total_bytes, "peak_rss_mb": peak_rss_mb}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--reseed", action="store_true", help="Delete and re-insert the benchmark user's generations.")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)  # One mode, in a subprocess
+    parser.add_argument("--user-id", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.user_id, args.rows)
+        return
+
+    user_id = bench_user_id(args.reseed, args.rows)
+    print(f"\nExporting {args.rows:,} generations")
+    print(f"{'mode':<12}{'first byte (ms)':>16}{'total (s)':>12}{'rows/s':>12}{'MB out':>10}{'peak RSS (MB)':>16}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--user-id", str(user_id), "--rows", str(args.rows)],
+            check=True, capture_output=True, text=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{mode:<12}{(result['first_byte_s'] or 0) * 1000:>16.1f}{result['elapsed_s']:>12.2f}"
+              f"{args.rows / result['elapsed_s']:>12,.0f}{result['bytes'] / 1e6:>10.1f}{result['peak_rss_mb']:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
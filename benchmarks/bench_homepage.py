@@ -0,0 +1,103 @@
+"""
+Requests/sec and response bytes for POST /gws/homepage, driven straight through the
+ASGI app (no sockets, no HTTP client): the old response path (card dict built per
+request, serialized by JSONResponse, no compression) vs app.main.app (cached card
+bytes, orjson default response class, GZipMiddleware). Google ID token verification
+and the DB session are overridden, and the event carries no OAuth token, so only the
+app's own work is timed.
+
+    python benchmarks/bench_homepage.py --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import Depends, FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.api.gws_router import verify_google_id_token  # noqa: E402
+from app.core.gws_cards import homepage_card  # noqa: E402
+from app.db.session import get_db  # noqa: E402
+from app.main import app  # noqa: E402
+
+EVENT = json.dumps({
+    "commonEventObject": {"hostApp": "SHEETS", "platform": "WEB"},
+    "sheets": {"addonHasFileScopePermission": True},
+}).encode("utf-8")
+
+
+def legacy_app() -> FastAPI:
+    """The homepage route as it was: a fresh card dict per request through JSONResponse."""
+    legacy = FastAPI(default_response_class=JSONResponse)
+
+    @legacy.post("/gws/homepage")
+    async def on_homepage(request_body: Dict[Any, Any], request: Request, jwt: Dict = Depends(verify_google_id_token)):
+        return homepage_card.create_homepage_card(f"{request.url.scheme}://{request.url.hostname}")
+    return legacy
+
+
+async def call(asgi_app, headers: List[Tuple[bytes, bytes]]) -> Tuple[int, int]:
+    """POSTs EVENT to /gws/homepage; returns (status, response body bytes)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "https", "path": "/gws/homepage", "raw_path": b"/gws/homepage", "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"addon.example.com"), (b"content-type", b"application/json")] + headers,
+        "client": ("127.0.0.1", 50000), "server": ("addon.example.com", 443),
+    }
+    received = False
+    status, size = 0, 0
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.sleep(3600)  # Only reached if the app waits for a disconnect
+        received = True
+        return {"type": "http.request", "body": EVENT, "more_body": False}
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await asgi_app(scope, receive, send)
+    return status, size
+
+
+async def measure(asgi_app, headers: List[Tuple[bytes, bytes]], requests: int) -> Tuple[float, int]:
+    status, size = await call(asgi_app, headers)  # Warm-up (builds the middleware stack and fills the card cache)
+    assert status == 200, status
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await call(asgi_app, headers)
+    return requests / (time.perf_counter() - started_at), size
+
+
+async def run(requests: int) -> None:
+    legacy = legacy_app()
+    for asgi_app in (app, legacy):
+        asgi_app.dependency_overrides[verify_google_id_token] = lambda: {"email": "bench@example.com"}
+        asgi_app.dependency_overrides[get_db] = lambda: None
+
+    print(f"{requests} requests to POST /gws/homepage")
+    print(f"{'response path':<28}{'Accept-Encoding':<18}{'req/s':>10}{'bytes':>10}")
+    for name, asgi_app in (("dict + JSONResponse", legacy), ("cached bytes + gzip", app)):
+        for encoding in ("identity", "gzip"):
+            rate, size = await measure(asgi_app, [(b"accept-encoding", encoding.encode())], requests)
+            print(f"{name:<28}{encoding:<18}{rate:>10.0f}{size:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # The route logs every request body
+    asyncio.run(run(args.requests))
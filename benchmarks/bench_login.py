@@ -0,0 +1,120 @@
+"""
+Login throughput and threadpool starvation, before and after moving bcrypt out of the
+request threadpool. A burst of logins is verified either in a 40-thread pool shared
+with (simulated) sync DB calls, as the sync endpoint did, or in the dedicated password
+hashing process pool. Meanwhile a probe runs short "DB calls" in the threadpool and
+records how long they wait for a thread. Also times resolving a bearer token to a user:
+JWT decode + DB lookup vs the token cache.
+
+    python benchmarks/bench_login.py --logins 200 --concurrency 50 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DB_CALL_SECONDS = 0.002
+THREADPOOL_SIZE = 40  # anyio's default, which FastAPI runs sync endpoints and dependencies in
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+
+from app.core import security  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.utils.ttl_cache import TTLCache  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def db_call() -> None:
+    time.sleep(DB_CALL_SECONDS)
+
+
+async def probe_db_waits(threadpool, stop: asyncio.Event, waits):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await loop.run_in_executor(threadpool, db_call)
+        waits.append(time.perf_counter() - started_at - DB_CALL_SECONDS)
+        await asyncio.sleep(0.01)
+
+
+async def login_burst(verify, threadpool, password_hash):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def login():
+        async with semaphore:
+            await loop.run_in_executor(threadpool, db_call)  # get_user_by_username
+            valid, _ = await verify(PASSWORD, password_hash)
+            assert valid
+
+    stop, waits = asyncio.Event(), []
+    probe = asyncio.create_task(probe_db_waits(threadpool, stop, waits))
+    started_at = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - started_at
+    stop.set()
+    await probe
+    return args.logins / elapsed, waits
+
+
+async def run():
+    password_hash = security.get_password_hash(PASSWORD)
+    threadpool = ThreadPoolExecutor(max_workers=THREADPOOL_SIZE)
+
+    async def verify_in_threadpool(password, hashed):
+        return await asyncio.get_running_loop().run_in_executor(threadpool, security.verify_and_update_password, password, hashed)
+
+    await security.verify_and_update_password_async(PASSWORD, password_hash)  # Start the worker processes
+    print(f"bcrypt rounds {settings.BCRYPT_ROUNDS}, {args.logins} logins, concurrency {args.concurrency}, "
+          f"{settings.PASSWORD_HASH_WORKERS} hashing processes")
+    print(f"{'bcrypt runs in':<20}{'logins/s':>10}{'DB wait p50 (ms)':>18}{'DB wait p95 (ms)':>18}")
+    for name, verify in (("threadpool", verify_in_threadpool), ("process pool", security.verify_and_update_password_async)):
+        rate, waits = await login_burst(verify, threadpool, password_hash)
+        waits.sort()
+        p95 = waits[int(0.95 * (len(waits) - 1))] if waits else 0.0
+        print(f"{name:<20}{rate:>10.1f}{statistics.median(waits) * 1000 if waits else 0:>18.1f}{p95 * 1000:>18.1f}")
+    security.shutdown_hash_pool()
+    threadpool.shutdown()
+
+
+def bench_token_resolution(repeat: int = 500) -> None:
+    from jose import jwt
+    token = security.create_access_token(subject=42)
+    cache = TTLCache(60, 1000)
+
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        db_call()
+    uncached = (time.perf_counter() - started_at) / repeat
+
+    cache.put(token, object())
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        cache.get(token)
+    cached = (time.perf_counter() - started_at) / repeat
+    print(f"\nToken -> user: decode + DB lookup {uncached * 1e6:.1f} us, token cache hit {cached * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
+    bench_token_resolution()
@@ -0,0 +1,91 @@
+"""
+Memory and throughput of preparing sheet rows for the AI service:
+the list-of-dicts path (build_row_dicts + json.dumps per row) vs RowBatch.
+
+    python benchmarks/bench_row_batch.py --rows 50000 --cols 30
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.utils.row_batch import RowBatch  # noqa: E402
+from app.utils.sheets_utils import build_row_dicts  # noqa: E402
+
+
+def make_sheet(rows: int, cols: int):
+    headers = [f"Column {c}" for c in range(cols)]
+    # Every 7th row is short, as Sheets omits trailing empty cells.
+    values = [
+        [f"value {r}-{c} lorem ipsum" for c in range(cols if r % 7 else cols // 2)]
+        for r in range(rows)
+    ]
+    return headers, values
+
+
+def dict_path(headers, values):
+    products = build_row_dicts(headers, values)
+    return products, [json.dumps(product, indent=2) for product in products]
+
+
+def row_batch_path(headers, values):
+    batch = RowBatch.from_values(headers, values)
+    return batch, batch.to_prompt_fragments()
+
+
+def dict_rows_only(headers, values):
+    return build_row_dicts(headers, values)
+
+
+def row_batch_rows_only(headers, values):
+    return RowBatch.from_values(headers, values)
+
+
+def measure(fn, headers, values):
+    gc.collect()
+    start = time.perf_counter()
+    fn(headers, values)
+    elapsed = time.perf_counter() - start
+
+    # Memory is measured separately: tracemalloc slows allocation-heavy code down.
+    gc.collect()
+    tracemalloc.start()
+    result = fn(headers, values)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, current, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--cols", type=int, default=30)
+    args = parser.parse_args()
+
+    headers, values = make_sheet(args.rows, args.cols)
+    _, dict_fragments = dict_path(headers, values)
+    _, batch_fragments = row_batch_path(headers, values)
+    assert dict_fragments == batch_fragments, "RowBatch prompt fragments differ from json.dumps output"
+    del dict_fragments, batch_fragments
+
+    print(f"{args.rows} rows x {args.cols} columns")
+    print(f"{'path':<12}{'time (s)':>10}{'rows/s':>12}{'retained (MB)':>15}{'peak (MB)':>12}")
+    cases = (
+        ("dict rows", dict_rows_only),
+        ("batch rows", row_batch_rows_only),
+        ("dict+json", dict_path),
+        ("batch+json", row_batch_path),
+    )
+    for name, fn in cases:
+        elapsed, current, peak = measure(fn, headers, values)
+        print(f"{name:<12}{elapsed:>10.3f}{args.rows / elapsed:>12,.0f}{current / 1e6:>15.1f}{peak / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
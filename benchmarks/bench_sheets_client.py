@@ -0,0 +1,159 @@
+"""
+Bytes over the wire and JSON decode time for Sheets values reads and writes,
+against a local stub of the Sheets API: the old request shape (no gzip, no field
+masks, full update response, json.loads) vs what app.utils.google_api_clients sends.
+
+    python benchmarks/bench_sheets_client.py --rows 20000 --cols 20
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# The stub is hit back to back by one token; keep the quota manager out of the timings.
+os.environ.setdefault("SHEETS_USER_READS_PER_MINUTE", "1000000")
+os.environ.setdefault("SHEETS_USER_WRITES_PER_MINUTE", "1000000")
+os.environ.setdefault("SHEETS_PROJECT_READS_PER_MINUTE", "1000000")
+os.environ.setdefault("SHEETS_PROJECT_WRITES_PER_MINUTE", "1000000")
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from app.utils import google_api_clients  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RANGE = "Sheet1!A2:T20001"
+
+
+def make_values(rows: int, cols: int):
+    return [[f"value {r}-{c} lorem ipsum" for c in range(cols)] for r in range(rows)]
+
+
+def build_stub(values, wire_bytes):
+    """Sheets values endpoints honouring gzip, `fields=values` and includeValuesInResponse."""
+
+    def respond(request, payload):
+        body = json.dumps(payload).encode()
+        gzip_ok = "gzip" in request.headers.get("Accept-Encoding", "") and "gzip" in request.headers.get("User-Agent", "")
+        headers = {"Content-Type": "application/json"}
+        if gzip_ok:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        wire_bytes.append(len(body))
+        return web.Response(body=body, headers=headers)
+
+    async def get_values(request):
+        payload = {"range": RANGE, "majorDimension": "ROWS", "values": values}
+        if request.query.get("fields") == "values":
+            payload = {"values": values}
+        return respond(request, payload)
+
+    async def put_values(request):
+        sent = await request.json()
+        payload = {
+            "spreadsheetId": "stub",
+            "updatedRange": sent["range"],
+            "updatedRows": len(sent["values"]),
+            "updatedColumns": max(len(row) for row in sent["values"]),
+            "updatedCells": sum(len(row) for row in sent["values"]),
+        }
+        if request.query.get("includeValuesInResponse", "false") == "true":
+            payload["updatedData"] = {"range": sent["range"], "majorDimension": "ROWS", "values": sent["values"]}
+        if "fields" in request.query:
+            payload = {key: payload[key] for key in request.query["fields"].split(",") if key in payload}
+        return respond(request, payload)
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_get("/v4/spreadsheets/{sid}/values/{range}", get_values)
+    app.router.add_put("/v4/spreadsheets/{sid}/values/{range}", put_values)
+    return app
+
+
+async def baseline_read(base_url):
+    """The request shape before field masks and gzip: plain GET, aiohttp's json()."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/stub/values/{RANGE}", headers={"Accept-Encoding": "identity"}) as response:
+            return await response.json()
+
+
+async def baseline_write(base_url, values):
+    url = f"{base_url}/stub/values/{RANGE}?valueInputOption=USER_ENTERED&includeValuesInResponse=true"
+    body = {"range": RANGE, "majorDimension": "ROWS", "values": values}
+    async with aiohttp.ClientSession() as session:
+        async with session.put(url, json=body, headers={"Accept-Encoding": "identity"}) as response:
+            return await response.json()
+
+
+async def timed(coro):
+    started_at = time.perf_counter()
+    await coro
+    return time.perf_counter() - started_at
+
+
+def decode_times(values, repeat):
+    body = json.dumps({"values": values}).encode()
+    results = {"json": min(_time(json.loads, body) for _ in range(repeat))}
+    if orjson is not None:
+        results["orjson"] = min(_time(orjson.loads, body) for _ in range(repeat))
+    return len(body), results
+
+
+def _time(fn, arg):
+    started_at = time.perf_counter()
+    fn(arg)
+    return time.perf_counter() - started_at
+
+
+async def run(args):
+    values = make_values(args.rows, args.cols)
+    output = [[f"ad text for row {r}", f"reference {r}"] for r in range(args.rows)]
+    wire_bytes = []
+    runner = web.AppRunner(build_stub(values, wire_bytes))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/v4/spreadsheets"
+    google_api_clients.GOOGLE_SHEETS_API_BASE_URL = base_url
+
+    cases = (
+        ("read (before)", lambda: baseline_read(base_url)),
+        ("read (now)", lambda: google_api_clients.get_sheet_values("token", "stub", RANGE)),
+        ("write (before)", lambda: baseline_write(base_url, output)),
+        ("write (now)", lambda: google_api_clients.update_sheet_values("token", "stub", RANGE, output)),
+    )
+    print(f"{args.rows} rows x {args.cols} columns, orjson {'installed' if orjson else 'not installed'}")
+    print(f"{'case':<16}{'response bytes':>16}{'time (s)':>10}")
+    try:
+        for name, make_call in cases:
+            wire_bytes.clear()
+            elapsed = min([await timed(make_call()) for _ in range(args.repeat)])
+            print(f"{name:<16}{wire_bytes[-1]:>16,}{elapsed:>10.3f}")
+    finally:
+        await runner.cleanup()
+
+    body_size, decoders = decode_times(values, args.repeat)
+    print(f"\nDecoding a {body_size / 1e6:.1f} MB values response:")
+    for name, seconds in decoders.items():
+        print(f"{name:<16}{seconds * 1000:>10.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Microbenchmarks of the CPU-bound hot paths of a sheet run, with JSON baselines and
+regression gating:
+
+    python benchmarks/hotpaths.py                      # run and print
+    python benchmarks/hotpaths.py --save               # record the baseline
+    python benchmarks/hotpaths.py --check --threshold 0.25
+
+--check exits 1 when any benchmark's median time per call is more than `threshold`
+(a fraction) slower than in the baseline. Baselines are per machine: record them on
+the machine (or CI runner class) that checks against them. `make bench`, `make
+bench-save` and `make bench-check` wrap these.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.gws_cards import generate_ads_card, homepage_card  # noqa: E402
+from app.services.ai_service import (RESPONSE_SEPARATOR, _row_prompt,  # noqa: E402
+                                     parse_variants_response,
+                                     split_ad_response)
+from app.utils.row_batch import RowBatch  # noqa: E402
+from app.utils.sheets_utils import (build_row_dicts, col_to_num,  # noqa: E402
+                                    construct_header_range,
+                                    get_sheet_name_and_columns_from_range,
+                                    infer_column_roles, num_to_col)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "hotpaths.json"
+SIZES = {
+    "small": (1_000, 10),
+    "large": (50_000, 30),
+}
+MAX_COLUMN = 18_278  # ZZZ: every one-, two- and three-letter column
+
+
+def make_sheet(rows: int, cols: int) -> Tuple[List[str], List[List[str]]]:
+    headers = ["Product Name", "Description", "Specifications", "Link"] + [f"Attribute {c}" for c in range(4, cols)]
+    # Every 7th row is short, as Sheets omits trailing empty cells.
+    values = [
+        [f"value {r}-{c} lorem ipsum" for c in range(cols if r % 7 else cols // 2)]
+        for r in range(rows)
+    ]
+    return headers[:cols], values
+
+
+def make_ranges(count: int) -> List[str]:
+    return [f"'Sheet {i % 5}'!{num_to_col(i % 40)}{i + 2}:{num_to_col(i % 40 + 29)}{i + 50_000}" for i in range(count)]
+
+
+# Each setup builds its inputs (untimed) and returns the callable to time.
+Setup = Callable[[int, int], Callable[[], Any]]
+
+
+def bench_parse_ranges(rows: int, cols: int) -> Callable[[], Any]:
+    ranges = make_ranges(rows)
+    return lambda: [get_sheet_name_and_columns_from_range(a1) for a1 in ranges]
+
+
+def bench_header_ranges(rows: int, cols: int) -> Callable[[], Any]:
+    ranges = make_ranges(rows)
+    return lambda: [construct_header_range(a1, 1) for a1 in ranges]
+
+
+def bench_column_letters(rows: int, cols: int) -> Callable[[], Any]:
+    return lambda: [col_to_num(num_to_col(n)) for n in range(MAX_COLUMN)]
+
+
+def bench_row_dicts(rows: int, cols: int) -> Callable[[], Any]:
+    headers, values = make_sheet(rows, cols)
+    return lambda: build_row_dicts(headers, values)
+
+
+def bench_row_batch(rows: int, cols: int) -> Callable[[], Any]:
+    headers, values = make_sheet(rows, cols)
+    column_roles = infer_column_roles(headers)
+    return lambda: RowBatch.from_values(headers, values, column_roles=column_roles)
+
+
+def bench_prompts(rows: int, cols: int) -> Callable[[], Any]:
+    """Row JSON serialization plus the per-row template, as generate_ad_text_with_search builds it."""
+    headers, values = make_sheet(rows, cols)
+    batch = RowBatch.from_values(headers, values)
+    return lambda: [_row_prompt(row, fragment) for row, fragment in zip(batch, batch.to_prompt_fragments())]
+
+
+def bench_split_responses(rows: int, cols: int) -> Callable[[], Any]:
+    responses = [
+        f"Ad {r}: " + "Bright, bold and built to last. " * 4 + f"\n{RESPONSE_SEPARATOR}\n" + "Strategy note. " * 10
+        for r in range(rows)
+    ]
+    return lambda: [split_ad_response(text) for text in responses]
+
+
+def bench_parse_variants(rows: int, cols: int) -> Callable[[], Any]:
+    platforms = ["Facebook", "Google Ads", "LinkedIn"]
+    body = json.dumps({
+        "ads": {platform: [f"{platform} ad variant {v} " * 5 for v in range(3)] for platform in platforms},
+        "reference": "Strategy note. " * 10,
+    })
+    responses = [f"```json\n{body}\n```" if r % 2 else body for r in range(rows)]
+    return lambda: [parse_variants_response(text, platforms, 3) for text in responses]
+
+
+def bench_cards(rows: int, cols: int) -> Callable[[], Any]:
+    headers, _ = make_sheet(1, cols)
+    defaults = {
+        "data_range": f"'Sheet 1'!A2:{num_to_col(cols - 1)}{rows + 1}",
+        "header_row": "1",
+        "output_column": num_to_col(cols),
+        "detected_columns": ", ".join(headers),
+    }
+
+    def build_cards():
+        return [
+            json.dumps(homepage_card.create_homepage_card("https://example.com")),
+            json.dumps(generate_ads_card.create_generate_ads_card("https://example.com", defaults)),
+        ]
+    return build_cards
+
+
+def bench_cards_rendered(rows: int, cols: int) -> Callable[[], Any]:
+    headers, _ = make_sheet(1, cols)
+    defaults = {
+        "data_range": f"'Sheet 1'!A2:{num_to_col(cols - 1)}{rows + 1}",
+        "header_row": "1",
+        "output_column": num_to_col(cols),
+        "detected_columns": ", ".join(headers),
+    }
+
+    def render_cards():
+        return [
+            homepage_card.render_homepage_card("https://example.com"),
+            generate_ads_card.render_generate_ads_card("https://example.com", defaults),
+        ]
+    return render_cards
+
+
+BENCHMARKS: Dict[str, Setup] = {
+    "parse_ranges": bench_parse_ranges,
+    "header_ranges": bench_header_ranges,
+    "column_letters": bench_column_letters,
+    "row_dicts": bench_row_dicts,
+    "row_batch": bench_row_batch,
+    "prompts": bench_prompts,
+    "split_responses": bench_split_responses,
+    "parse_variants": bench_parse_variants,
+    "cards": bench_cards,
+    "cards_rendered": bench_cards_rendered,
+}
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, float]:
+    """Seconds per call: each of `repeat` samples times enough calls to last at least `min_time`."""
+    fn()  # Warm-up
+    started_at = time.perf_counter()
+    fn()
+    single = time.perf_counter() - started_at
+    number = max(1, int(min_time / single)) if single > 0 else 1000
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started_at) / number)
+    return {"median_s": statistics.median(samples), "min_s": min(samples), "calls_per_sample": number}
+
+
+def run(names: List[str], sizes: List[str], repeat: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in names:
+        for size in sizes:
+            rows, cols = SIZES[size]
+            key = f"{name}[{rows}x{cols}]"
+            results[key] = measure(BENCHMARKS[name](rows, cols), repeat, min_time)
+            print(f"{key:<36}{results[key]['median_s'] * 1000:>12.3f} ms{results[key]['min_s'] * 1000:>12.3f} ms", flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'benchmark':<36}{'baseline':>12}{'now':>12}{'change':>10}")
+    for key, result in results.items():
+        before = baseline["results"].get(key)
+        if before is None:
+            print(f"{key:<36}{'-':>12}{result['median_s'] * 1000:>10.3f}ms{'new':>10}")
+            continue
+        change = result["median_s"] / before["median_s"] - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{key:<36}{before['median_s'] * 1000:>10.3f}ms{result['median_s'] * 1000:>10.3f}ms{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all).")
+    parser.add_argument("--sizes", nargs="*", choices=sorted(SIZES), default=sorted(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per sample.")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--check", action="store_true", help="Fail if slower than the baseline by more than --threshold.")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    print(f"{'benchmark':<36}{'median':>15}{'min':>15}")
+    results = run(args.only or list(BENCHMARKS), args.sizes, args.repeat, args.min_time)
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "results": results,
+        }, indent=2) + "\n")
+        print(f"\nBaseline written to {args.baseline}")
+    if args.check:
+        if not args.baseline.exists():
+            sys.exit(f"No baseline at {args.baseline}; record one with --save (make bench-save).")
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        if regressions:
+            sys.exit(f"\nFAIL: {len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        print(f"\nOK: no benchmark regressed by more than {args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Import-time budget for the web app: runs `python -X importtime -c "import app.main"` in
+fresh interpreters (keeping the fastest of --runs), prints the slowest modules by
+cumulative import time and exits non-zero when importing app.main takes longer than the
+budget. The google-genai, google-auth and requests stacks must not show up here;
+app.core.warmup loads them after startup. tests/test_import_time.py runs the same check.
+
+    python benchmarks/import_time.py --budget-ms 2000 --top 15
+"""
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+# "import time: self [us] | cumulative | imported package"
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+DEFERRED_PACKAGES = ("google.genai", "google.oauth2", "google.auth", "requests")
+# With every dependency installed, app.main imports in 1.4-1.7 s on a single-vCPU runner.
+DEFAULT_BUDGET_MS = 2000.0
+
+
+def measure(module: str) -> List[Tuple[str, int, int]]:
+    """(module, cumulative microseconds, nesting depth) for every module imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(2)), len(match.group(3)) // 2))
+    return rows
+
+
+def total_ms(rows: List[Tuple[str, int, int]], module: str) -> float:
+    return next(cumulative for name, cumulative, _ in rows if name == module) / 1000
+
+
+def measure_fastest(module: str, runs: int) -> List[Tuple[str, int, int]]:
+    """measure() of the fastest of `runs` imports; slower runs are mostly noise from the machine."""
+    return min((measure(module) for _ in range(runs)), key=lambda rows: total_ms(rows, module))
+
+
+def check(rows: List[Tuple[str, int, int]], module: str, budget_ms: float) -> List[str]:
+    """Budget violations of one measured import; empty when it is within budget."""
+    failures = []
+    eager = sorted({name for name, _, _ in rows if name.startswith(DEFERRED_PACKAGES)})
+    if eager:
+        failures.append(f"deferred packages imported eagerly: {', '.join(eager[:10])}")
+    if total_ms(rows, module) > budget_ms:
+        failures.append(f"import {module} took {total_ms(rows, module):.0f} ms, budget {budget_ms:.0f} ms")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    rows = measure_fastest(args.module, args.runs)
+    print(f"{'module':<50}{'cumulative (ms)':>16}")
+    for name, cumulative, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f"{name:<50}{cumulative / 1000:>16.1f}")
+
+    failures = check(rows, args.module, args.budget_ms)
+    print(f"\nimport {args.module}: {total_ms(rows, args.module):.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
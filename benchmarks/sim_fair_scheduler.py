@@ -0,0 +1,102 @@
+"""
+Simulated tenants sharing model-call slots: small interactive jobs arriving steadily,
+with and without a noisy neighbour running one huge bulk job, under a plain FIFO
+semaphore vs the FairScheduler. A fake model call (sleep with jittered latency)
+stands in for Gemini. Reports small-job completion latency percentiles.
+
+    python benchmarks/sim_fair_scheduler.py --slots 16 --bulk-rows 4000 --small-jobs 40
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core.metrics import percentile  # noqa: E402
+from app.services.fair_scheduler import BULK, INTERACTIVE, FairScheduler  # noqa: E402
+
+
+class FifoSlots:
+    """Baseline: one global semaphore, first come first served."""
+
+    def __init__(self, slots: int):
+        self._semaphore = asyncio.Semaphore(slots)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, priority: str):
+        async with self._semaphore:
+            yield
+
+
+async def fake_model_call(mean_latency: float) -> None:
+    await asyncio.sleep(random.lognormvariate(0, 0.4) * mean_latency)
+
+
+async def run_job(slots, tenant: str, rows: int, priority: str, job_concurrency: int, mean_latency: float) -> float:
+    """Mirrors ai_service._gather_rows: a per-job semaphore, then a scheduler slot per row."""
+    started_at = time.perf_counter()
+    semaphore = asyncio.Semaphore(job_concurrency)
+
+    async def run_row():
+        async with semaphore:
+            async with slots.slot(tenant, priority):
+                await fake_model_call(mean_latency)
+
+    await asyncio.gather(*(run_row() for _ in range(rows)))
+    return time.perf_counter() - started_at
+
+
+async def scenario(slots, args, noisy: bool):
+    tasks = []
+    if noisy:
+        tasks.append(asyncio.create_task(
+            run_job(slots, "noisy", args.bulk_rows, BULK, args.bulk_concurrency, args.latency)
+        ))
+        await asyncio.sleep(args.latency)  # The bulk job is already running when small jobs arrive
+    small_jobs = []
+    for i in range(args.small_jobs):
+        small_jobs.append(asyncio.create_task(
+            run_job(slots, f"user-{i % args.tenants}", args.small_rows, INTERACTIVE, 8, args.latency)
+        ))
+        await asyncio.sleep(args.arrival_interval)
+    latencies = await asyncio.gather(*small_jobs)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slots", type=int, default=16, help="Concurrent model calls per worker.")
+    parser.add_argument("--tenant-cap", type=int, default=8, help="Concurrent model calls per tenant.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean fake model latency (s).")
+    parser.add_argument("--bulk-rows", type=int, default=4000)
+    parser.add_argument("--bulk-concurrency", type=int, default=64)
+    parser.add_argument("--small-jobs", type=int, default=40)
+    parser.add_argument("--small-rows", type=int, default=20)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--arrival-interval", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'scheduler':<10}{'neighbour':<12}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for name, make_slots in (
+        ("fifo", lambda: FifoSlots(args.slots)),
+        ("fair", lambda: FairScheduler(args.slots, args.tenant_cap)),
+    ):
+        for noisy in (False, True):
+            random.seed(args.seed)
+            latencies = asyncio.run(scenario(make_slots(), args, noisy))
+            print(
+                f"{name:<10}{'bulk job' if noisy else 'none':<12}"
+                f"{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}{max(latencies):>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
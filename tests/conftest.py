@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.db.models import Base
+from app.utils import google_api_clients
+from app.utils.sheet_values_cache import SheetValuesCache
+
+
+@pytest.fixture
+def session_factory():
+    """Sessions on a fresh in-memory SQLite database with the app's tables."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+class FakeSheets:
+    """Stubs the Drive version and Sheets values reads, counting both."""
+
+    def __init__(self):
+        self.version = "41"
+        self.values = [["Trail Shoe", "Grippy running shoe"]]
+        self.reads = []
+        self.version_reads = 0
+
+    async def get_spreadsheet_version(self, token, spreadsheet_id, deadline=None):
+        self.version_reads += 1
+        return self.version
+
+    async def get_sheet_values(self, token, spreadsheet_id, range_a1, deadline=None):
+        self.reads.append(range_a1)
+        return [list(row) for row in self.values]
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    """FakeSheets behind get_sheet_values_cached, with an empty values cache."""
+    fake = FakeSheets()
+    monkeypatch.setattr(settings, "SHEETS_VALUES_CACHE_ENABLED", True)
+    monkeypatch.setattr(google_api_clients, "values_cache", SheetValuesCache(max_entries=8, max_cells=1000))
+    monkeypatch.setattr(google_api_clients, "get_spreadsheet_version", fake.get_spreadsheet_version)
+    monkeypatch.setattr(google_api_clients, "get_sheet_values", fake.get_sheet_values)
+    return fake
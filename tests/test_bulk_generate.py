@@ -0,0 +1,89 @@
+import asyncio
+import csv
+
+import pytest
+
+from app.cli import bulk_generate
+from app.services import ai_service
+
+HEADERS = ["Product Name", "Description"]
+ROWS = [["Trail Shoe", "Grippy running shoe"], ["Rain Jacket", "Packable shell"]]
+OPTIONS = {"tone": "Professional", "max_length": 150, "platform": "Facebook", "concurrency": 2, "backend": "online"}
+
+
+class FakeGenerator:
+    """Stands in for generate_batch_ads_with_search; rows whose name is in `failing` get the fallback text."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.loops = []
+
+    async def __call__(self, products_data, **kwargs):
+        self.loops.append(asyncio.get_running_loop())
+        results = []
+        for row in products_data:
+            name = row["Product Name"]
+            if name in self.failing:
+                results.append((ai_service.AD_TEXT_FALLBACK, ai_service.REFERENCE_FALLBACK))
+            else:
+                results.append((f"Buy the {name}!", "Benefit-led"))
+        return results
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    fake = FakeGenerator()
+    monkeypatch.setattr(ai_service, "generate_batch_ads_with_search", fake)
+    return fake
+
+
+def read_part(parts_dir, chunk_index):
+    with open(bulk_generate._part_path(parts_dir, chunk_index), newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_chunk_is_checkpointed_when_every_row_has_an_ad(generator, tmp_path):
+    assert bulk_generate.process_chunk(0, HEADERS, ROWS, str(tmp_path), OPTIONS) == (0, 2)
+
+    assert read_part(tmp_path, 0) == [
+        ["Trail Shoe", "Grippy running shoe", "Buy the Trail Shoe!", "Benefit-led"],
+        ["Rain Jacket", "Packable shell", "Buy the Rain Jacket!", "Benefit-led"],
+    ]
+
+
+def test_fallback_rows_fail_the_chunk_without_a_checkpoint(generator, tmp_path):
+    generator.failing = {"Rain Jacket"}
+
+    with pytest.raises(bulk_generate.ChunkFailed):
+        bulk_generate.process_chunk(0, HEADERS, ROWS, str(tmp_path), OPTIONS)
+
+    assert not bulk_generate._part_path(tmp_path, 0).exists()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_chunks_of_a_worker_share_one_event_loop(generator, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_generate, "_worker_loop", None)
+
+    for chunk_index in range(3):
+        bulk_generate.process_chunk(chunk_index, HEADERS, ROWS, str(tmp_path), OPTIONS)
+
+    assert len(generator.loops) == 3
+    assert len(set(map(id, generator.loops))) == 1
+    assert not generator.loops[0].is_closed()
+    asyncio.set_event_loop(None)
+    bulk_generate._worker_loop.close()
+
+
+def finished(result=None, error=None) -> bulk_generate.Future:
+    future = bulk_generate.Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def test_failed_chunks_are_counted_not_raised():
+    done = {finished((4, 10)), finished(error=bulk_generate.ChunkFailed("1 row(s) of chunk 3 were left without an ad."))}
+
+    assert bulk_generate._collect(done, started_at=0.0, rows_done_before=0) == (10, 1)
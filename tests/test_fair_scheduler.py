@@ -0,0 +1,117 @@
+import asyncio
+from itertools import groupby
+from typing import List, Tuple
+
+from app.services.fair_scheduler import BULK, INTERACTIVE, FairScheduler
+
+
+async def grant_order(scheduler: FairScheduler, calls: List[Tuple[str, str]]) -> List[str]:
+    """
+    Queues `calls` (tenant, priority) in order behind a held slot, then lets them through
+    one at a time (max_concurrent=1) and returns the tenants in the order they were granted.
+    """
+    order: List[str] = []
+    await scheduler.acquire("holder")
+
+    async def call(tenant: str, priority: str) -> None:
+        await scheduler.acquire(tenant, priority)
+        order.append(tenant)
+        scheduler.release(tenant)
+
+    tasks = [asyncio.create_task(call(tenant, priority)) for tenant, priority in calls]
+    await asyncio.sleep(0)  # Every call is queued before the first slot frees up
+    scheduler.release("holder")
+    await asyncio.gather(*tasks)
+    return order
+
+
+def serial_scheduler() -> FairScheduler:
+    return FairScheduler(max_concurrent=1, tenant_max_concurrent=1)
+
+
+async def test_calls_of_one_tenant_run_in_fifo_order():
+    scheduler = serial_scheduler()
+    order: List[int] = []
+    await scheduler.acquire("holder")
+
+    async def call(number: int) -> None:
+        async with scheduler.slot("a", BULK):
+            order.append(number)
+
+    tasks = [asyncio.create_task(call(number)) for number in range(6)]
+    await asyncio.sleep(0)
+    scheduler.release("holder")
+    await asyncio.gather(*tasks)
+
+    assert order == list(range(6))
+
+
+async def test_tenant_arriving_behind_a_backlog_is_served_next():
+    order = await grant_order(serial_scheduler(), [("backlog", BULK)] * 20 + [("newcomer", BULK)])
+
+    assert order.index("newcomer") <= 1
+
+
+async def test_equal_weight_tenants_alternate():
+    calls = [("a", BULK)] * 4 + [("b", BULK)] * 4
+
+    assert await grant_order(serial_scheduler(), calls) == ["a", "b"] * 4
+
+
+async def test_interactive_calls_get_their_weight_in_slots():
+    # Interactive weight 4 vs bulk weight 1: while both are backlogged, 4 of every 5 slots are interactive.
+    calls = [("sheet-user", INTERACTIVE)] * 12 + [("bulk-run", BULK)] * 12
+
+    order = await grant_order(serial_scheduler(), calls)
+
+    assert order[:10].count("sheet-user") == 8
+    assert order[:15].count("sheet-user") == 12
+
+
+async def test_idle_time_earns_no_burst():
+    scheduler = serial_scheduler()
+    await grant_order(scheduler, [("a", BULK)] * 5)
+
+    order = await grant_order(scheduler, [("a", BULK)] * 3 + [("b", BULK)] * 3)
+
+    # b was idle while a ran, but does not get its 3 calls in a row to "catch up".
+    assert max(len(list(run)) for _, run in groupby(order)) <= 2
+
+
+async def test_global_and_per_tenant_limits_hold():
+    scheduler = FairScheduler(max_concurrent=4, tenant_max_concurrent=2)
+    running = {"total": 0, "a": 0, "b": 0, "c": 0}
+    peaks = dict(running)
+
+    async def call(tenant: str) -> None:
+        async with scheduler.slot(tenant, BULK):
+            for key in ("total", tenant):
+                running[key] += 1
+                peaks[key] = max(peaks[key], running[key])
+            await asyncio.sleep(0.001)
+            running["total"] -= 1
+            running[tenant] -= 1
+
+    await asyncio.gather(*(call(tenant) for tenant in "abc" for _ in range(6)))
+
+    assert peaks["total"] == 4
+    assert max(peaks[tenant] for tenant in "abc") == 2
+    assert scheduler.queue_depth() == 0
+
+
+async def test_cancelled_waiter_gives_up_its_place_without_leaking_a_slot():
+    scheduler = serial_scheduler()
+    await scheduler.acquire("holder")
+    cancelled = asyncio.create_task(scheduler.acquire("a"))
+    waiting = asyncio.create_task(scheduler.acquire("b"))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    scheduler.release("holder")
+    await asyncio.wait_for(waiting, timeout=1)
+
+    assert cancelled.cancelled()
+    assert scheduler.queue_depth() == 0
+    scheduler.release("b")
+    await asyncio.wait_for(scheduler.acquire("c"), timeout=1)  # The slot came back
@@ -0,0 +1,204 @@
+import asyncio
+import random
+import time
+from typing import Callable, List
+
+import pytest
+
+from app.core.config import settings
+from app.services.gemini_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HedgeBudget,
+    LatencyTracker,
+    resilient_call,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeModel:
+    """Stands in for client.aio.models: each call sleeps for the next latency drawn from `latencies`."""
+
+    def __init__(self, latencies: Callable[[], float], error: Exception = None):
+        self._latencies = latencies
+        self._error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_content(self) -> str:
+        self.calls += 1
+        call = self.calls
+        try:
+            await asyncio.sleep(self._latencies())
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self._error is not None:
+            raise self._error
+        return f"response {call}"
+
+
+def sequence(*latencies: float) -> Callable[[], float]:
+    remaining = list(latencies)
+    return lambda: remaining.pop(0)
+
+
+def heavy_tail(seed: int, slow_share: float, fast: float, slow: float) -> Callable[[], float]:
+    rng = random.Random(seed)
+    return lambda: slow if rng.random() < slow_share else fast * rng.uniform(0.5, 1.5)
+
+
+def breaker(clock: FakeClock = None, **overrides) -> CircuitBreaker:
+    options = dict(window=10, min_requests=4, error_rate=0.5, open_seconds=30.0, half_open_calls=1)
+    options.update(overrides)
+    return CircuitBreaker("test", clock=clock or FakeClock(), **options)
+
+
+def warm_tracker(latency: float, samples: int = 50) -> LatencyTracker:
+    tracker = LatencyTracker()
+    for _ in range(samples):
+        tracker.record(latency)
+    return tracker
+
+
+def funded_budget(tokens: float = 10.0) -> HedgeBudget:
+    budget = HedgeBudget(ratio=1.0, max_tokens=tokens)
+    for _ in range(int(tokens)):
+        budget.on_primary()
+    return budget
+
+
+@pytest.fixture(autouse=True)
+def fast_hedging(monkeypatch):
+    monkeypatch.setattr(settings, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "HEDGE_MIN_DELAY_SECONDS", 0.005)
+
+
+async def test_hedge_wins_over_slow_primary():
+    model = FakeModel(sequence(1.0, 0.01))
+    started_at = time.perf_counter()
+
+    result = await resilient_call(
+        model.generate_content, "test", breaker=breaker(), latency_tracker=warm_tracker(0.01), budget=funded_budget()
+    )
+
+    assert result == "response 2"
+    assert time.perf_counter() - started_at < 0.5
+    await asyncio.sleep(0)
+    assert model.cancelled == 1  # The slow primary
+
+
+async def test_no_hedge_without_budget():
+    model = FakeModel(sequence(0.05))
+
+    result = await resilient_call(
+        model.generate_content, "test", breaker=breaker(), latency_tracker=warm_tracker(0.005), budget=HedgeBudget(ratio=0.0)
+    )
+
+    assert result == "response 1"
+    assert model.calls == 1
+
+
+async def test_hedging_cuts_the_tail_of_a_heavy_tailed_distribution():
+    # 5% of calls take 300ms against a ~10ms median; the p95 hedge delay retries those early.
+    model = FakeModel(heavy_tail(seed=7, slow_share=0.05, fast=0.01, slow=0.3))
+    tracker, budget, latencies = warm_tracker(0.01), HedgeBudget(ratio=0.1), []
+    for _ in range(50):
+        budget.on_primary()  # Like the tracker, the budget is as a warm worker's
+
+    for _ in range(100):
+        started_at = time.perf_counter()
+        await resilient_call(model.generate_content, "test", breaker=breaker(), latency_tracker=tracker, budget=budget)
+        latencies.append(time.perf_counter() - started_at)
+
+    hedges = model.calls - 100
+    assert 0 < hedges <= 100 * budget.ratio + 5
+    assert sorted(latencies)[98] < 0.3  # p99 no longer pays the slow call
+
+
+async def test_breaker_opens_on_error_rate_and_fails_fast():
+    clock = FakeClock()
+    circuit = breaker(clock)
+    failing = FakeModel(sequence(*[0.001] * 4), error=RuntimeError("503"))
+
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            await resilient_call(failing.generate_content, "test", breaker=circuit, budget=HedgeBudget(ratio=0.0))
+    assert circuit.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        await resilient_call(failing.generate_content, "test", breaker=circuit)
+    assert failing.calls == 4
+
+
+async def test_client_errors_do_not_open_the_breaker():
+    circuit = breaker()
+    invalid = FakeModel(sequence(*[0.001] * 6), error=ValueError("400"))
+
+    for _ in range(6):
+        with pytest.raises(ValueError):
+            await resilient_call(
+                invalid.generate_content, "test", is_upstream_failure=lambda e: not isinstance(e, ValueError),
+                breaker=circuit, budget=HedgeBudget(ratio=0.0)
+            )
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+async def test_half_open_trial_closes_on_success_and_reopens_on_failure():
+    clock = FakeClock()
+    circuit = breaker(clock)
+    for _ in range(4):
+        circuit.record_failure()
+    clock.now += 30.0
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+
+    with pytest.raises(RuntimeError):
+        await resilient_call(FakeModel(sequence(0.001), error=RuntimeError("503")).generate_content, "test", breaker=circuit)
+    assert circuit.state == CircuitBreaker.OPEN
+
+    clock.now += 30.0
+    assert await resilient_call(FakeModel(sequence(0.001)).generate_content, "test", breaker=circuit) == "response 1"
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+async def test_cancelled_half_open_trial_releases_its_slot():
+    clock = FakeClock()
+    circuit = breaker(clock)
+    for _ in range(4):
+        circuit.record_failure()
+    clock.now += 30.0
+    hanging = FakeModel(sequence(10.0))
+
+    # As _run_within_deadline does when the request deadline runs out mid-trial.
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(resilient_call(hanging.generate_content, "test", breaker=circuit), timeout=0.02)
+    await asyncio.sleep(0)
+
+    assert hanging.cancelled == 1
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert await resilient_call(FakeModel(sequence(0.001)).generate_content, "test", breaker=circuit) == "response 1"
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+async def test_half_open_admits_at_most_half_open_calls_trials():
+    clock = FakeClock()
+    circuit = breaker(clock, half_open_calls=2)
+    for _ in range(4):
+        circuit.record_failure()
+    clock.now += 30.0
+    slow = FakeModel(sequence(0.05, 0.05))
+
+    results: List = await asyncio.gather(
+        *(resilient_call(slow.generate_content, "test", breaker=circuit, budget=HedgeBudget(ratio=0.0)) for _ in range(3)),
+        return_exceptions=True,
+    )
+
+    assert sum(isinstance(result, CircuitOpenError) for result in results) == 1
+    assert slow.calls == 2
@@ -0,0 +1,16 @@
+from app.core.config import settings
+from app.core.gws_cards.generate_ads_card import create_generate_ads_card
+
+
+def text_inputs(card):
+    sections = card["action"]["navigations"][0]["pushCard"]["sections"]
+    widgets = [widget for section in sections for widget in section.get("widgets", [])]
+    return {widget["textInput"]["name"]: widget["textInput"] for widget in widgets if "textInput" in widget}
+
+
+def test_platforms_default_to_the_configured_platforms(monkeypatch):
+    monkeypatch.setattr(settings, "DEFAULT_PLATFORMS", "Instagram, LinkedIn")
+
+    platforms = text_inputs(create_generate_ads_card("https://example.com"))["platforms"]
+
+    assert platforms["value"] == "Instagram, LinkedIn"
@@ -0,0 +1,43 @@
+import pytest
+
+from app.services import header_cache
+
+SHEET = "sheet-1"
+HEADER_RANGE = "Products!A1:C1"
+
+
+@pytest.fixture(autouse=True)
+def empty_memory_cache(monkeypatch):
+    monkeypatch.setattr(header_cache, "_memory_cache", header_cache.OrderedDict())
+
+
+def test_unchanged_headers_reuse_the_cached_mapping(db):
+    stored = header_cache.resolve(db, SHEET, HEADER_RANGE, 1, ["Product Name", "Description", "Link"], "Products!A2:C9")
+
+    again = header_cache.resolve(db, SHEET, HEADER_RANGE, 1, ["Product Name", "Description", "Link"])
+
+    assert again is stored
+    assert again.column_roles == {"name": 0, "description": 1, "cta_link": 2}
+    assert again.last_data_range == "Products!A2:C9"
+
+
+def test_renamed_columns_replace_a_cached_mapping_at_once(db):
+    header_cache.resolve(db, SHEET, HEADER_RANGE, 1, ["Product Name", "Description", "Link"])
+
+    # No TTL to wait out: the first run after the rename gets the new roles.
+    mapping = header_cache.resolve(db, SHEET, HEADER_RANGE, 1, ["Link", "Product Name", "Description"])
+
+    assert mapping.headers == ["Link", "Product Name", "Description"]
+    assert mapping.column_roles == {"cta_link": 0, "name": 1, "description": 2}
+    assert header_cache.get_header_mapping(db, SHEET, HEADER_RANGE) is mapping
+
+
+def test_mapping_is_shared_through_the_database(db, monkeypatch):
+    header_cache.resolve(db, SHEET, HEADER_RANGE, 1, ["Product Name", "Description", "Link"], "Products!A2:C9")
+    monkeypatch.setattr(header_cache, "_memory_cache", header_cache.OrderedDict())  # Another worker
+
+    mapping = header_cache.get_header_mapping(db, SHEET, HEADER_RANGE)
+
+    assert mapping.headers == ["Product Name", "Description", "Link"]
+    assert mapping.column_roles == {"name": 0, "description": 1, "cta_link": 2}
+    assert header_cache.get_latest_mapping(db, SHEET).last_data_range == "Products!A2:C9"
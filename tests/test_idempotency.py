@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.db import crud
+from app.db.models import IdempotencyRecord
+from app.services import idempotency
+
+SUCCESS = {"action": {"notification": {"text": "Successfully generated and wrote 3 ads."}}}
+ERROR = {"action": {"notification": {"text": "Error: Could not read data rows from sheet."}}}
+
+
+@pytest.fixture(autouse=True)
+def fresh_worker_state(monkeypatch):
+    monkeypatch.setattr(idempotency, "_in_flight", {})
+    monkeypatch.setattr(idempotency, "_completed", idempotency.OrderedDict())
+    monkeypatch.setattr(idempotency, "_last_purge", 0.0)
+
+
+def counting(response, delay: float = 0.0):
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return response
+    return run, calls
+
+
+async def test_successful_response_is_replayed(db):
+    run, calls = counting(SUCCESS)
+
+    first = await idempotency.run_once(db, "k", Deadline(5), run)
+    again = await idempotency.run_once(db, "k", Deadline(5), run)
+
+    assert first == again == SUCCESS
+    assert len(calls) == 1
+    assert crud.get_idempotency_record(db, "k").status == "completed"
+
+
+async def test_error_response_is_not_stored_or_replayed(db):
+    failing, failed_calls = counting(ERROR)
+    retry, retry_calls = counting(SUCCESS)
+
+    assert await idempotency.run_once(db, "k", Deadline(5), failing) == ERROR
+    assert crud.get_idempotency_record(db, "k") is None
+
+    assert await idempotency.run_once(db, "k", Deadline(5), retry) == SUCCESS
+    assert len(failed_calls) == len(retry_calls) == 1
+
+
+async def test_concurrent_duplicate_shares_the_run(db):
+    run, calls = counting(SUCCESS, delay=0.05)
+
+    responses = await asyncio.gather(*(idempotency.run_once(db, "k", Deadline(5), run) for _ in range(3)))
+
+    assert responses == [SUCCESS] * 3
+    assert len(calls) == 1
+
+
+async def test_expired_records_are_purged(db):
+    past = datetime.now(timezone.utc) - timedelta(minutes=5)
+    db.add_all([
+        IdempotencyRecord(key="old-completed", status="completed", response=SUCCESS, expires_at=past),
+        IdempotencyRecord(key="abandoned", status="in_progress", expires_at=past),
+    ])
+    db.commit()
+    run, _ = counting(SUCCESS)
+
+    await idempotency.run_once(db, "k", Deadline(5), run)
+
+    assert [record.key for record in db.query(IdempotencyRecord).all()] == ["k"]
+
+
+async def test_purge_runs_at_most_once_per_interval(db, monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_PURGE_INTERVAL_SECONDS", 3600.0)
+    purges = []
+    monkeypatch.setattr(crud, "delete_expired_idempotency_records", lambda session: purges.append(1) or 0)
+
+    for key in ("a", "b", "c"):
+        run, _ = counting(SUCCESS)
+        await idempotency.run_once(db, key, Deadline(5), run)
+
+    assert len(purges) == 1
@@ -0,0 +1,22 @@
+import os
+
+from benchmarks import import_time
+
+
+def test_app_main_imports_within_budget():
+    # IMPORT_TIME_BUDGET_MS overrides the budget on machines much slower or faster than CI.
+    budget_ms = float(os.getenv("IMPORT_TIME_BUDGET_MS", import_time.DEFAULT_BUDGET_MS))
+    rows = import_time.measure_fastest("app.main", runs=3)
+
+    assert import_time.check(rows, "app.main", budget_ms) == []
+
+
+def test_check_fails_over_budget_and_on_eager_sdk_imports():
+    rows = [("app.main", 2_500_000, 0), ("google.genai", 900_000, 1)]
+
+    failures = import_time.check(rows, "app.main", budget_ms=2000)
+
+    assert failures == [
+        "deferred packages imported eagerly: google.genai",
+        "import app.main took 2500 ms, budget 2000 ms",
+    ]
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from passlib.hash import bcrypt
+
+from app.api import auth
+from app.core import security
+from app.core.config import settings
+from app.db import crud
+from app.services import auth_cache
+from app.utils.ttl_cache import TTLCache
+
+PASSWORD = "correct horse battery staple"
+
+
+def rounds(password_hash: str) -> int:
+    return int(password_hash.split("$")[2])
+
+
+def test_hash_with_other_rounds_is_flagged_for_rehashing():
+    for other_rounds in (settings.BCRYPT_ROUNDS - 1, settings.BCRYPT_ROUNDS + 1):
+        valid, new_hash = security.verify_and_update_password(PASSWORD, bcrypt.using(rounds=other_rounds).hash(PASSWORD))
+
+        assert valid
+        assert new_hash is not None and rounds(new_hash) == settings.BCRYPT_ROUNDS
+
+
+def test_context_pins_the_accepted_rounds():
+    handler = security.pwd_context.handler("bcrypt")
+
+    assert handler.min_desired_rounds == handler.max_desired_rounds == settings.BCRYPT_ROUNDS
+
+
+def test_hash_with_current_rounds_is_kept():
+    assert security.verify_and_update_password(PASSWORD, security.get_password_hash(PASSWORD)) == (True, None)
+
+
+@pytest.fixture
+def in_thread_hashing(monkeypatch):
+    """Runs bcrypt in a thread instead of the spawned hashing pool."""
+    async def verify_and_update(password, password_hash):
+        return await asyncio.to_thread(security.verify_and_update_password, password, password_hash)
+    monkeypatch.setattr(auth, "verify_and_update_password_async", verify_and_update)
+    monkeypatch.setattr(auth_cache, "users_by_username", TTLCache(60.0, 10))
+
+
+async def test_login_replaces_a_hash_with_other_rounds(db, in_thread_hashing):
+    old_hash = bcrypt.using(rounds=settings.BCRYPT_ROUNDS - 1).hash(PASSWORD)
+    user = crud.create_user(db, "ana", "ana@example.com", password_hash=old_hash)
+
+    assert await auth._authenticate(db, "ana", PASSWORD) is not None
+
+    db.refresh(user)
+    assert user.password_hash != old_hash and rounds(user.password_hash) == settings.BCRYPT_ROUNDS
+    assert await auth._authenticate(db, "ana", PASSWORD) is not None  # The new hash verifies
+    assert auth_cache.users_by_username.get("ana").password_hash == user.password_hash
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.services import ai_service, header_cache, prefetch
+from app.utils import google_api_clients
+from app.utils.google_api_clients import get_sheet_values_cached
+from app.utils.ttl_cache import TTLCache
+
+TOKEN = "user-token"
+SHEET = "sheet-1"
+HEADER_RANGE = "Products!A1:C1"
+DATA_RANGE = "Products!A2:C100"
+
+
+class FakeClient:
+    """Counts how often a Gemini client is built."""
+
+    built = 0
+
+    def __init__(self):
+        FakeClient.built += 1
+
+
+def mapping(data_range=DATA_RANGE) -> header_cache.HeaderMapping:
+    return header_cache.HeaderMapping(
+        spreadsheet_id=SHEET, header_range=HEADER_RANGE, header_row=1,
+        headers=["Product Name", "Description", "Link"], column_roles={"name": 0, "description": 1, "cta_link": 2},
+        last_data_range=data_range,
+    )
+
+
+@pytest.fixture(autouse=True)
+def fakes(monkeypatch, sheets):
+    FakeClient.built = 0
+    client_cache = []
+
+    def get_client():
+        if not client_cache:
+            client_cache.append(FakeClient())
+        return client_cache[0]
+
+    async def get_user_info(token):
+        return {"email": "ana@example.com"}
+
+    monkeypatch.setattr(settings, "PREFETCH_ENABLED", True)
+    monkeypatch.setattr(prefetch, "_prefetches", TTLCache(60.0, 100))
+    monkeypatch.setattr(ai_service, "get_client", get_client)
+    monkeypatch.setattr(prefetch, "warm_certs", lambda: None)
+    monkeypatch.setattr(prefetch, "get_user_info", get_user_info)
+    monkeypatch.setattr(prefetch, "get_spreadsheet_version", sheets.get_spreadsheet_version)
+
+
+async def submit_reads():
+    """What generate_and_write_ads reads after waiting for the prefetch."""
+    found = await prefetch.wait_for(TOKEN, SHEET, HEADER_RANGE, DATA_RANGE, Deadline(5))
+    version = await google_api_clients.get_spreadsheet_version(TOKEN, SHEET)
+    await asyncio.gather(
+        get_sheet_values_cached(TOKEN, SHEET, HEADER_RANGE, version=version),
+        get_sheet_values_cached(TOKEN, SHEET, DATA_RANGE, version=version),
+    )
+    return found
+
+
+async def test_submit_reuses_the_prefetched_reads(sheets):
+    prefetch.schedule(TOKEN, SHEET, mapping())
+
+    assert await submit_reads()
+    assert sorted(sheets.reads) == [HEADER_RANGE, DATA_RANGE]  # Only the prefetch's reads
+    assert sheets.version_reads == 2  # One Drive lookup each for the prefetch and the submit
+    assert FakeClient.built == 1
+    ai_service.get_client()
+    assert FakeClient.built == 1
+
+
+async def test_submit_waits_for_a_prefetch_still_in_flight(sheets, monkeypatch):
+    read_values = sheets.get_sheet_values
+
+    async def slow_read(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await read_values(*args, **kwargs)
+    monkeypatch.setattr("app.utils.google_api_clients.get_sheet_values", slow_read)
+    prefetch.schedule(TOKEN, SHEET, mapping())
+
+    assert await submit_reads()
+    assert len(sheets.reads) == 2
+
+
+async def test_prefetch_of_other_ranges_is_not_used(sheets):
+    prefetch.schedule(TOKEN, SHEET, mapping(data_range="Products!A2:C50"))
+    await asyncio.gather(*prefetch._background_tasks)
+
+    assert not await submit_reads()
+    assert sheets.reads.count(DATA_RANGE) == 1  # Read by the submit itself
+
+
+async def test_edit_while_the_form_is_open_is_seen(sheets):
+    prefetch.schedule(TOKEN, SHEET, mapping())
+    await asyncio.gather(*prefetch._background_tasks)
+    sheets.version = "42"
+
+    await submit_reads()
+
+    assert len(sheets.reads) == 4
+
+
+async def test_other_users_prefetch_is_not_used(sheets):
+    prefetch.schedule("another-user-token", SHEET, mapping())
+
+    assert not await prefetch.wait_for(TOKEN, SHEET, HEADER_RANGE, DATA_RANGE, Deadline(5))
+
+
+async def test_same_prefetch_is_not_repeated(sheets):
+    prefetch.schedule(TOKEN, SHEET, mapping())
+    prefetch.schedule(TOKEN, SHEET, mapping())
+    await asyncio.gather(*prefetch._background_tasks)
+
+    assert len(sheets.reads) == 2
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core import profiling
+from app.core.config import settings
+
+SCOPE = {"type": "http", "method": "POST", "path": "/api/v1/gws/generate"}
+
+
+class App:
+    """An ASGI app that records the loop's task factory and the sampler state mid-request."""
+
+    def __init__(self):
+        self.seen = []
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        await asyncio.create_task(asyncio.sleep(0))
+        self.seen.append((loop.get_task_factory(), profiling.sampler._active.is_set()))
+        await send({"type": "http.response.start", "status": 200})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def send(message):
+    pass
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    store = profiling.ProfileStore(str(tmp_path), max_profiles=10)
+    monkeypatch.setattr(settings, "PROFILER_ENABLED", True)
+    monkeypatch.setattr(profiling, "store", store)
+    monkeypatch.setattr(profiling.sampler, "start", lambda thread_id: None)  # No sampling thread in tests
+    return store
+
+
+async def test_unsampled_requests_run_uninstrumented(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 0.0)
+    app = App()
+
+    await profiling.ProfilingMiddleware(app)(SCOPE, None, send)
+
+    assert app.seen == [(None, False)]
+    assert store.list() == []
+
+
+async def test_sampled_request_is_instrumented_only_while_in_flight(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 1.0)
+    app = App()
+
+    await profiling.ProfilingMiddleware(app)(SCOPE, None, send)
+
+    assert app.seen == [(profiling._timed_task_factory, True)]
+    assert asyncio.get_running_loop().get_task_factory() is None
+    assert not profiling.sampler._active.is_set()
+    [saved] = store.list()
+    assert saved["path"] == SCOPE["path"] and saved["status"] == 200 and saved["reason"] == "sampled"
+
+
+async def wait_for_gemini():
+    await asyncio.sleep(0.05)
+
+
+async def slow_app(scope, receive, send):
+    await asyncio.create_task(wait_for_gemini())
+    await send({"type": "http.response.start", "status": 200})
+
+
+async def test_unsampled_slow_request_is_saved_with_a_task_snapshot(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "PROFILER_SLOW_REQUEST_SECONDS", 0.01)
+
+    await profiling.ProfilingMiddleware(slow_app)(SCOPE, None, send)
+
+    [saved] = store.list()
+    assert saved["reason"] == "slow" and saved["wall_seconds"] >= 0.05
+    report = json.loads(store.path(saved["id"], ".json").read_text())
+    assert report["stack_samples"] == 0 and report["task_snapshot_at_seconds"] >= 0.01
+    assert any("wait_for_gemini" in stack for stack in report["task_snapshot"])
+    assert "wait_for_gemini" in store.path(saved["id"], ".folded").read_text()
+    assert asyncio.get_running_loop().get_task_factory() is None  # Still uninstrumented
+
+
+async def test_fast_request_leaves_no_snapshot_timer(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "PROFILER_SLOW_REQUEST_SECONDS", 0.05)
+
+    await profiling.ProfilingMiddleware(App())(SCOPE, None, send)
+    await asyncio.sleep(0.1)
+
+    assert store.list() == []
+
+
+async def test_instrumentation_stays_until_the_last_sampled_request_finishes(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 1.0)
+    middleware = profiling.ProfilingMiddleware(App())
+    loop = asyncio.get_running_loop()
+
+    middleware._sampling_started()
+    middleware._sampling_started()
+    middleware._sampling_finished()
+    assert loop.get_task_factory() is profiling._timed_task_factory
+
+    middleware._sampling_finished()
+    assert loop.get_task_factory() is None
+
+
+async def test_a_foreign_task_factory_is_left_alone(store, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILER_SAMPLE_RATE", 1.0)
+    loop = asyncio.get_running_loop()
+
+    def factory(loop, coro, **kwargs):
+        return asyncio.Task(coro, loop=loop, **kwargs)
+    loop.set_task_factory(factory)
+    try:
+        await profiling.ProfilingMiddleware(App())(SCOPE, None, send)
+        assert loop.get_task_factory() is factory
+    finally:
+        loop.set_task_factory(None)
@@ -0,0 +1,120 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from google.genai import types
+
+from app.core.config import settings
+from app.services import ai_service
+from app.services.model_routing import ModelRoute
+from app.utils.row_batch import RowBatch
+
+SEARCH = ModelRoute(name="search", model="gemini-2.5-flash", use_search=True)
+DIRECT = ModelRoute(name="direct", model="gemini-2.5-flash-lite", use_search=False)
+ROWS = [{"Product Name": name, "Description": "Light and packable"} for name in ("Rain Jacket", "Trail Shoe", "Day Pack")]
+PROMPT_TOKENS = 1200
+CACHED_TOKENS = 1000
+
+
+class FakeClient:
+    """Records generate_content configs and cached-content calls, as client.aio exposes them."""
+
+    def __init__(self):
+        self.configs = []
+        self.created = []
+        self.deleted = []
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self.generate_content),
+            caches=SimpleNamespace(create=self.create_cache, delete=self.delete_cache),
+        )
+
+    async def generate_content(self, model, contents, config):
+        self.configs.append((model, config))
+        cached = CACHED_TOKENS if config.cached_content else 0
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[
+                types.Part(text="Stay dry on any trail.\n---REFERENCE_STRATEGY_SEPARATOR---\nStrategy: Benefit-led.")
+            ]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=PROMPT_TOKENS, cached_content_token_count=cached, candidates_token_count=20
+            ),
+        )
+
+    async def create_cache(self, model, config):
+        self.created.append((model, config))
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    async def delete_cache(self, name):
+        self.deleted.append(name)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(ai_service, "get_client", lambda: fake)
+    monkeypatch.setattr(settings, "AD_STREAMING_ENABLED", False)
+    monkeypatch.setattr(settings, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(settings, "PROMPT_CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(ai_service, "choose_route", lambda row: SEARCH if row["Product Name"] == "Rain Jacket" else DIRECT)
+    return fake
+
+
+async def generate_batch():
+    return await ai_service.generate_batch_ads_with_search(RowBatch.from_dicts(ROWS), platform="Facebook")
+
+
+async def test_short_prefix_is_sent_as_every_rows_system_instruction(client, monkeypatch):
+    monkeypatch.setattr(settings, "PROMPT_CONTEXT_CACHE_MIN_TOKENS", 32768)
+    prefix = ai_service.ad_text_prompt_prefix("Facebook", "Professional", 150)
+
+    results = await generate_batch()
+
+    assert [ad for ad, _ in results] == ["Stay dry on any trail."] * 3
+    assert client.created == [] and client.deleted == []
+    for model, config in client.configs:
+        route = SEARCH if model == f"models/{SEARCH.model}" else DIRECT
+        assert config.system_instruction == prefix.instruction_for(route)
+        assert config.cached_content is None
+        assert bool(config.tools) == route.use_search
+    assert "Product Name" not in prefix.system_instruction  # Rows only send their own JSON
+
+
+async def test_long_prefix_is_cached_once_per_route_and_deleted_after_the_batch(client, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "PROMPT_CONTEXT_CACHE_MIN_TOKENS", 1)
+    prefix = ai_service.ad_text_prompt_prefix("Facebook", "Professional", 150)
+
+    with caplog.at_level(logging.INFO, logger=ai_service.logger.name):
+        await generate_batch()
+
+    # One cache per route: it is bound to one model and carries that route's tools.
+    assert sorted(model for model, _ in client.created) == sorted([f"models/{SEARCH.model}", f"models/{DIRECT.model}"])
+    caches = {model: f"cachedContents/{i + 1}" for i, (model, _) in enumerate(client.created)}
+    for model, config in client.created:
+        route = SEARCH if model == f"models/{SEARCH.model}" else DIRECT
+        assert config.system_instruction == prefix.instruction_for(route)
+        assert bool(config.tools) == route.use_search
+    assert len(client.configs) == 3
+    for model, config in client.configs:
+        assert config.cached_content == caches[model]
+        assert config.system_instruction is None and config.tools is None
+    assert sorted(client.deleted) == sorted(caches.values())
+    assert (
+        f"3 calls, {3 * PROMPT_TOKENS} prompt tokens, {3 * CACHED_TOKENS} served from cache "
+        f"({CACHED_TOKENS} input tokens saved per row)"
+    ) in caplog.text
+
+
+async def test_failed_cache_creation_falls_back_to_the_system_instruction(client, monkeypatch):
+    monkeypatch.setattr(settings, "PROMPT_CONTEXT_CACHE_MIN_TOKENS", 1)
+
+    async def refuse(model, config):
+        client.created.append((model, config))
+        raise RuntimeError("Cached content is too small")
+    client.aio.caches.create = refuse
+
+    results = await generate_batch()
+
+    assert [ad for ad, _ in results] == ["Stay dry on any trail."] * 3
+    assert len(client.created) == 2  # Tried once per route, not once per row
+    assert all(config.system_instruction and config.cached_content is None for _, config in client.configs)
+    assert client.deleted == []
@@ -0,0 +1,41 @@
+import pytest
+
+from app.services import ai_service
+from app.services.model_routing import ModelRoute
+
+SEARCH = ModelRoute(name="search", model="gemini-2.5-flash", use_search=True)
+DIRECT = ModelRoute(name="direct", model="gemini-2.5-flash-lite", use_search=False)
+
+PREFIXES = {
+    "ad_text": lambda: ai_service.ad_text_prompt_prefix("Facebook", "Professional", 150),
+    "variants": lambda: ai_service.ad_variants_prompt_prefix(["Facebook", "Instagram"], 2, "Professional", 150),
+}
+
+
+@pytest.mark.parametrize("kind", PREFIXES)
+def test_direct_route_is_not_told_to_search(kind):
+    prefix = PREFIXES[kind]()
+
+    direct = prefix.instruction_for(DIRECT)
+    search = prefix.instruction_for(SEARCH)
+
+    assert "Google Search" not in direct and "Search Queries" not in direct
+    assert "Google Search" in search
+    assert "Professional" in direct and "150" in direct
+
+
+@pytest.mark.parametrize("kind", PREFIXES)
+def test_batch_requests_use_the_route_instruction(kind):
+    prefix = PREFIXES[kind]()
+
+    direct = ai_service._batch_request("row", prefix, DIRECT)
+    search = ai_service._batch_request("row", prefix, SEARCH)
+
+    assert "Google Search" not in direct["system_instruction"]["parts"][0]["text"] and "tools" not in direct
+    assert "Google Search" in search["system_instruction"]["parts"][0]["text"]
+
+
+def test_routes_without_a_direct_instruction_keep_the_system_instruction():
+    prefix = ai_service.PromptPrefix("Adapt the ad.")
+
+    assert prefix.instruction_for(DIRECT) == prefix.instruction_for(SEARCH) == "Adapt the ad."
@@ -0,0 +1,104 @@
+import asyncio
+
+from app.utils import google_api_clients
+from app.utils.sheet_values_cache import SheetValuesCache
+
+SHEET = "sheet-1"
+DATA_RANGE = "Products!A2:C100"
+
+
+async def read(range_a1=DATA_RANGE):
+    return await google_api_clients.get_sheet_values_cached("token", SHEET, range_a1)
+
+
+async def test_unchanged_version_is_served_from_cache(sheets):
+    first = await read()
+    second = await read()
+
+    assert first == second == [["Trail Shoe", "Grippy running shoe"]]
+    assert sheets.reads == [DATA_RANGE]
+
+
+async def test_changed_version_refetches(sheets):
+    await read()
+    sheets.version = "42"
+    sheets.values = [["Trail Shoe", "Now waterproof"]]
+
+    assert await read() == [["Trail Shoe", "Now waterproof"]]
+    assert sheets.reads == [DATA_RANGE, DATA_RANGE]
+    assert await read() == [["Trail Shoe", "Now waterproof"]]
+    assert len(sheets.reads) == 2
+
+
+async def test_unknown_version_is_never_cached(sheets):
+    sheets.version = None
+
+    await read()
+    await read()
+
+    assert len(sheets.reads) == 2
+
+
+async def test_own_write_restamps_untouched_ranges_only(sheets):
+    header_range = "Products!A1:C1"
+    await read()
+    await read(header_range)
+
+    # Writing the ads to column E bumps the version without changing columns A-C.
+    google_api_clients.schedule_cache_restamp("token", SHEET, "41", "Products!E2:E100")
+    sheets.version = "43"
+    await asyncio.gather(*google_api_clients._background_tasks)
+
+    await read()
+    await read(header_range)
+    assert sheets.reads == [DATA_RANGE, header_range]
+
+    google_api_clients.schedule_cache_restamp("token", SHEET, "43", "Products!B2:B100")
+    sheets.version = "44"
+    await asyncio.gather(*google_api_clients._background_tasks)
+
+    await read()
+    await read(header_range)
+    assert sheets.reads == [DATA_RANGE, header_range, DATA_RANGE, header_range]
+
+
+async def run_reads(header_range="Products!A1:C1"):
+    """A run's reads: one Drive version lookup shared by the header and data reads."""
+    version = await google_api_clients.get_spreadsheet_version("token", SHEET)
+    await asyncio.gather(
+        google_api_clients.get_sheet_values_cached("token", SHEET, header_range, version=version),
+        google_api_clients.get_sheet_values_cached("token", SHEET, DATA_RANGE, version=version),
+    )
+    return version
+
+
+async def test_run_looks_up_the_version_once(sheets):
+    await run_reads()
+    await run_reads()
+
+    assert sheets.version_reads == 2  # One per run
+    assert len(sheets.reads) == 2  # The second run is served from cache
+
+
+async def test_restamp_reuses_the_runs_version(sheets):
+    version = await run_reads()
+
+    google_api_clients.schedule_cache_restamp("token", SHEET, version, "Products!E2:E100")
+    sheets.version = "43"
+    await asyncio.gather(*google_api_clients._background_tasks)
+    assert sheets.version_reads == 2  # The run's lookup, then the version after the write
+
+    await run_reads()
+    assert len(sheets.reads) == 2
+
+
+def test_cache_is_bounded_by_cells():
+    cache = SheetValuesCache(max_entries=8, max_cells=4)
+    cache.put(SHEET, "A1:B1", "1", [["a", "b"]])
+    cache.put(SHEET, "A2:B2", "1", [["c", "d"]])
+    cache.put(SHEET, "A3:B3", "1", [["e", "f"]])
+
+    assert cache.get(SHEET, "A1:B1", "1") is None
+    assert cache.get(SHEET, "A3:B3", "1") == [["e", "f"]]
+    cache.put(SHEET, "A1:C3", "1", [["x"] * 3] * 3)  # Larger than the whole cache: not stored
+    assert cache.get(SHEET, "A1:C3", "1") is None
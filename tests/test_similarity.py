@@ -0,0 +1,114 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.db import crud
+from app.services import similarity
+from app.utils.row_batch import RowBatch
+from app.utils.ttl_cache import TTLCache
+
+SHOE = {"Product Name": "Trail Running Shoe - Blue, Size 42", "Description": "Grippy trail running shoe with a rock plate"}
+SHOE_VARIANT = {"Product Name": "Trail Running Shoe - Red, Size 44", "Description": "Grippy trail running shoe with a rock plate"}
+SCOPE = ("Facebook", "Professional", 150)
+
+
+@pytest.fixture(autouse=True)
+def memory_index(monkeypatch, session_factory):
+    monkeypatch.setattr(settings, "SIMILARITY_REUSE_ENABLED", True)
+    monkeypatch.setattr(settings, "SIMILARITY_INDEX_BACKEND", "memory")
+    monkeypatch.setattr(similarity, "get_embedder", lambda: similarity.HashingEmbedder(settings.VECTOR_DIMENSION))
+    monkeypatch.setattr(similarity, "SessionLocal", session_factory)
+    monkeypatch.setattr(similarity, "_indexes", TTLCache(60.0, 10))
+
+
+@pytest.fixture
+def past_ad(db):
+    """A stored ad for SHOE, as a previous run leaves it."""
+    user = crud.get_or_create_workspace_user(db, "1001", "ana@example.com")
+    platform, tone, max_length = SCOPE
+
+    async def store():
+        lookup = await similarity.find_similar(user.id, RowBatch.from_dicts([SHOE]), *SCOPE)
+        columns = similarity.remember(lookup, {0: "Conquer any trail."})[0]
+        crud.create_ad_generations(db, [{
+            "user_id": user.id, "generated_text": "Conquer any trail.", "platform": platform,
+            "generation_params": {"tone": tone, "max_length": max_length}, **columns,
+        }])
+        similarity._indexes.clear()  # Later lookups load the index from the database
+        return user.id
+    return store
+
+
+async def test_near_duplicate_gets_the_past_ad(past_ad):
+    user_id = await past_ad()
+
+    lookup = await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE_VARIANT]), *SCOPE)
+
+    match = lookup.matches[0]
+    assert match is not None and match.ad_text == "Conquer any trail."
+    assert settings.SIMILARITY_THRESHOLD <= match.score <= settings.SIMILARITY_MAX_SCORE
+
+
+async def test_rerun_of_the_same_row_is_generated_afresh(past_ad):
+    user_id = await past_ad()
+
+    lookup = await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE, SHOE_VARIANT]), *SCOPE)
+
+    assert lookup.matches[0] is None
+    assert lookup.matches[1] is not None
+
+
+async def test_index_is_loaded_off_the_event_loop(past_ad, monkeypatch):
+    user_id = await past_ad()
+    load_threads = []
+    get_candidates = crud.get_similarity_candidates
+
+    def recording_get_candidates(*args, **kwargs):
+        load_threads.append(threading.get_ident())
+        return get_candidates(*args, **kwargs)
+    monkeypatch.setattr(crud, "get_similarity_candidates", recording_get_candidates)
+
+    await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE_VARIANT]), *SCOPE)
+    await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE_VARIANT]), *SCOPE)
+
+    assert len(load_threads) == 1  # The second lookup uses the cached index
+    assert load_threads[0] != threading.get_ident()
+
+
+async def test_newer_generations_of_other_scopes_do_not_crowd_out_the_index(past_ad, db, monkeypatch):
+    user_id = await past_ad()
+    monkeypatch.setattr(settings, "SIMILARITY_INDEX_MAX_ROWS", 2)
+    lookup = await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE_VARIANT]), "Facebook", "Playful", 150)
+    newer = datetime.now(timezone.utc) + timedelta(hours=1)
+    crud.create_ad_generations(db, [{
+        "user_id": user_id, "generated_text": "Puddles? Bring them on.", "platform": "Facebook",
+        "generation_params": {"tone": "Playful", "max_length": max_length}, "created_at": newer,
+        **similarity.remember(lookup, {0: "Puddles? Bring them on."})[0],
+    } for max_length in (150, 150, 280)])
+    similarity._indexes.clear()
+
+    lookup = await similarity.find_similar(user_id, RowBatch.from_dicts([SHOE_VARIANT]), *SCOPE)
+
+    assert lookup.matches[0] is not None and lookup.matches[0].ad_text == "Conquer any trail."
+
+
+def test_embedders_must_implement_embed():
+    class Incomplete(similarity.Embedder):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_memory_index_skips_exact_matches():
+    index = similarity.MemoryIndex(2)
+    index.add(np.asarray([[1.0, 0.0], [0.8, 0.6]], dtype=np.float32), [(1, "a", "ad a"), (2, "b", "ad b")])
+
+    matches = index.search(np.asarray([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32), threshold=0.5, max_score=0.999)
+
+    assert matches[0].generation_id == 2  # Not 1, which is the query itself
+    assert matches[1].generation_id == 2
+    assert index.search(np.asarray([[1.0, 0.0]], dtype=np.float32), threshold=0.9, max_score=0.999) == [None]
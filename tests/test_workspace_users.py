@@ -0,0 +1,70 @@
+from google.oauth2 import id_token
+
+from app.api import gws_router
+from app.db import crud
+from app.db.models import User
+
+
+def register(db, username: str, email: str) -> User:
+    return crud.create_user(db, username, email, password_hash="not-a-real-hash")
+
+
+def test_workspace_user_is_keyed_on_google_sub(db):
+    first = crud.get_or_create_workspace_user(db, "1001", "ana@example.com")
+    again = crud.get_or_create_workspace_user(db, "1001", "ana@example.com")
+
+    assert again.id == first.id
+    assert first.google_sub == "1001"
+    assert first.email == "ana@example.com"
+
+
+def test_registered_account_with_same_email_is_not_linked(db):
+    # Anyone can register with any address: the Workspace user must not inherit that account.
+    squatter = register(db, "squatter", "ana@example.com")
+
+    user = crud.get_or_create_workspace_user(db, "1001", "ana@example.com")
+
+    assert user.id != squatter.id
+    assert user.email is None
+    assert squatter.google_sub is None
+
+
+def test_username_collision_still_yields_a_user(db):
+    register(db, "google:1001", "someone@example.com")
+
+    user = crud.get_or_create_workspace_user(db, "1001", "ana@example.com")
+
+    assert user is not None
+    assert user.google_sub == "1001"
+    assert crud.get_or_create_workspace_user(db, "1001").id == user.id
+
+
+def event(user_id_token=None):
+    return {"authorizationEventObject": {"userIdToken": user_id_token}} if user_id_token else {}
+
+
+def test_db_user_comes_from_the_verified_token(db, monkeypatch):
+    claims = {"sub": "1001", "email": "ana@example.com", "email_verified": True}
+    monkeypatch.setattr(id_token, "verify_oauth2_token", lambda token, request, audience=None: claims)
+
+    user = gws_router._gws_db_user(db, event("token"))
+
+    assert user.google_sub == "1001"
+    assert user.email == "ana@example.com"
+
+
+def test_unverified_email_is_not_stored(db, monkeypatch):
+    claims = {"sub": "1001", "email": "ana@example.com", "email_verified": False}
+    monkeypatch.setattr(id_token, "verify_oauth2_token", lambda token, request, audience=None: claims)
+
+    assert gws_router._gws_db_user(db, event("token")).email is None
+
+
+def test_token_that_does_not_verify_identifies_no_one(db, monkeypatch):
+    def reject(token, request, audience=None):
+        raise ValueError("Token expired")
+    monkeypatch.setattr(id_token, "verify_oauth2_token", reject)
+
+    assert gws_router._gws_db_user(db, event("forged")) is None
+    assert gws_router._gws_db_user(db, event()) is None
+    assert db.query(User).count() == 0